@@ -0,0 +1,40 @@
+"""
+Archive stale and resolved items now, or restore archived ones.
+
+    python archive_items.py --dry-run
+    python archive_items.py
+    python archive_items.py --restore <item id> [<item id> ...]
+
+The API runs the archive every ARCHIVE_INTERVAL_SECONDS on its own (see
+controllers/archive_controller.py). Vector deletes are queued on the
+cleanup outbox and drained here before exiting.
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import argparse
+import asyncio
+
+from controllers.archive_controller import run_archive, restore_items
+from controllers.cleanup_controller import cleanup_worker
+
+
+async def main(args):
+    if args.restore:
+        restored = await restore_items(args.restore)
+        print(f"restored {len(restored)} of {len(args.restore)} items")
+        return
+    counts = await run_archive(dry_run=args.dry_run)
+    print(f"{'due' if args.dry_run else 'archived'}: {counts['stale']} stale or resolved, {counts['over_cap']} over the cap")
+    if not args.dry_run:
+        while await cleanup_worker.drain_once():
+            pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dry-run', action='store_true', help='only count the items due')
+    parser.add_argument('--restore', nargs='+', metavar='ITEM_ID')
+    args = parser.parse_args()
+    asyncio.run(main(args))
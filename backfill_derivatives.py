@@ -0,0 +1,72 @@
+"""
+Generate the thumbnail, medium WebP copy and BlurHash placeholder for items
+that don't have them yet (uploaded before derivatives existed, or their
+generation failed during the upload).
+
+    python backfill_derivatives.py --dry-run
+    python backfill_derivatives.py --concurrency 8 [--limit 1000]
+
+Originals are downloaded from Cloudinary; decoding and encoding run in
+worker threads. Safe to re-run, finished items are skipped.
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import argparse
+import asyncio
+
+import requests
+
+from controllers.mongo_database import items
+from controllers.image_derivatives import decode_image, store_derivatives
+
+BATCH_SIZE = 200
+
+
+def download(url):
+    response = requests.get(url, timeout=30)
+    response.raise_for_status()
+    return response.content
+
+
+async def backfill_item(item, semaphore):
+    async with semaphore:
+        try:
+            image = await asyncio.to_thread(lambda: decode_image(download(item['image'])))
+        except Exception as e:
+            print(f"{item['_id']}: unable to read the original ({e})")
+            return False
+        return await store_derivatives(str(item['_id']), image) is not None
+
+
+async def main(args):
+    query = {'image': {'$nin': ['', None]}, 'thumbnail': {'$exists': False}}
+    pending = await items.count_documents(query)
+    if args.dry_run:
+        print(f"{pending} items need derivatives")
+        return
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    done = failed = 0
+    last_id = None
+    while not args.limit or done + failed < args.limit:
+        batch_query = dict(query, **({'_id': {'$gt': last_id}} if last_id else {}))
+        size = BATCH_SIZE if not args.limit else min(BATCH_SIZE, args.limit - done - failed)
+        batch = await items.find(batch_query, {'image': 1}).sort('_id', 1).to_list(size)
+        if not batch:
+            break
+        last_id = batch[-1]['_id']
+        results = await asyncio.gather(*(backfill_item(item, semaphore) for item in batch))
+        done += sum(results)
+        failed += len(results) - sum(results)
+        print(f"{done} done, {failed} failed, {pending - done - failed} left")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dry-run', action='store_true', help='only count the items without derivatives')
+    parser.add_argument('--concurrency', type=int, default=8, help='items processed at once')
+    parser.add_argument('--limit', type=int, default=0, help='stop after this many items, 0 for all')
+    args = parser.parse_args()
+    asyncio.run(main(args))
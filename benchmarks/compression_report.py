@@ -0,0 +1,154 @@
+"""
+Recall@k vs size and latency for the vector compression settings
+(controllers/vector_compression.py).
+
+    python -m benchmarks.compression_report --vectors text.npy --dimensions 64,128,192 --output compression.json
+
+Vectors come from a .npy file (fit_reducer.py --export dumps a sample of an
+index), from the real models run over the synthetic dataset (--real-models
+--modality text|image), or, by default, from a synthetic low-rank
+distribution that is only good for checking the script works.
+
+A held-out set of --queries vectors is searched against the rest. The
+reference is exact float32 cosine search at full dimension; every setting is
+scored by how many of the reference top-k it retrieves. Reducers are fitted
+on the corpus only, never on the queries.
+"""
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+
+def synthetic_vectors(count, dimension, rank, seed):
+    rng = np.random.default_rng(seed)
+    basis = rng.standard_normal((rank, dimension))
+    weights = rng.standard_normal((count, rank)) * np.linspace(3, 0.3, rank)
+    return (weights @ basis + 0.3 * rng.standard_normal((count, dimension))).astype(np.float32)
+
+
+def model_vectors(modality, count, seed):
+    from benchmarks.dataset import make_description, make_image
+    from controllers import pinecone_controller
+
+    rng = random.Random(seed)
+    batches = []
+    for start in range(0, count, 32):
+        size = min(32, count - start)
+        if modality == 'text':
+            batches.append(pinecone_controller._compute_text_embeddings([make_description(rng) for _ in range(size)]))
+        else:
+            batches.append(pinecone_controller._compute_image_embeddings([make_image(rng) for _ in range(size)]))
+    return np.concatenate(batches).astype(np.float32)
+
+
+def top_k(corpus, scale, queries, k):
+    scores = (queries @ corpus.astype(np.float32).T)
+    if scale is not None:
+        scores *= scale.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def recall(reference, found):
+    hits = sum(len(set(expected) & set(got)) for expected, got in zip(reference, found))
+    return hits / reference.size
+
+
+def evaluate(corpus, queries, reducer, dtype, ks, reference):
+    from controllers.vector_compression import normalize, quantize
+
+    started = time.perf_counter()
+    projected = reducer.transform(corpus) if reducer else normalize(corpus)
+    transform_us = (time.perf_counter() - started) / len(corpus) * 1e6
+    projected_queries = reducer.transform(queries) if reducer else normalize(queries)
+    codes, scale = quantize(projected, dtype)
+
+    started = time.perf_counter()
+    found = top_k(codes, scale, projected_queries, max(ks))
+    query_ms = (time.perf_counter() - started) / len(queries) * 1000
+
+    dimension = projected.shape[1]
+    return {
+        'reduction': f"{reducer.method}-{dimension}" if reducer else 'none',
+        'dimension': dimension,
+        'dtype': dtype,
+        **{f'recall@{k}': round(recall(reference[:, :k], found[:, :k]), 4) for k in ks},
+        'local_bytes_per_vector': int(codes.nbytes / len(codes)) + (4 if scale is not None else 0),
+        'index_bytes_per_vector': dimension * 4,
+        'json_bytes_per_vector': round(sum(len(json.dumps(row.tolist())) for row in projected[:100])
+                                       / min(100, len(projected))),
+        'transform_us_per_vector': round(transform_us, 2),
+        'query_ms': round(query_ms, 3),
+    }
+
+
+def run(args):
+    from controllers.vector_compression import ProjectionReducer, normalize
+
+    if args.vectors:
+        vectors = np.load(args.vectors).astype(np.float32)
+    elif args.real_models:
+        vectors = model_vectors(args.modality, args.count, args.seed)
+    else:
+        vectors = synthetic_vectors(args.count, args.dimension, args.rank, args.seed)
+
+    order = np.random.default_rng(args.seed).permutation(len(vectors))
+    queries, corpus = vectors[order[:args.queries]], vectors[order[args.queries:]]
+    ks = sorted(int(k) for k in args.k.split(','))
+    reference = top_k(normalize(corpus), None, normalize(queries), max(ks))
+
+    reducers = [None]
+    for dimension in (int(d) for d in args.dimensions.split(',')):
+        if dimension >= vectors.shape[1]:
+            continue
+        if 'pca' in args.methods:
+            reducers.append(ProjectionReducer.fit_pca(corpus, dimension))
+        if 'random' in args.methods:
+            reducers.append(ProjectionReducer.random_projection(vectors.shape[1], dimension, args.seed))
+
+    results = [evaluate(corpus, queries, reducer, dtype, ks, reference)
+               for reducer in reducers for dtype in args.dtypes.split(',')]
+    from benchmarks.loadtest import git_revision
+    return {'revision': git_revision(), 'vectors': len(vectors), 'input_dimension': int(vectors.shape[1]),
+            'queries': len(queries), 'source': args.vectors or ('models' if args.real_models else 'synthetic'),
+            'results': results}
+
+
+def print_report(report, ks):
+    recall_columns = [f'recall@{k}' for k in ks]
+    print(f"{'reduction':<14}{'dtype':<9}" + ''.join(f'{c:>11}' for c in recall_columns)
+          + f"{'local B':>10}{'index B':>10}{'json B':>9}{'query ms':>10}")
+    for row in report['results']:
+        print(f"{row['reduction']:<14}{row['dtype']:<9}" + ''.join(f'{row[c]:>11}' for c in recall_columns)
+              + f"{row['local_bytes_per_vector']:>10}{row['index_bytes_per_vector']:>10}"
+              f"{row['json_bytes_per_vector']:>9}{row['query_ms']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vectors', help='.npy file of raw embeddings')
+    parser.add_argument('--real-models', action='store_true')
+    parser.add_argument('--modality', choices=['text', 'image'], default='text')
+    parser.add_argument('--count', type=int, default=5000, help='vectors to generate without --vectors')
+    parser.add_argument('--dimension', type=int, default=384, help='synthetic vector dimension')
+    parser.add_argument('--rank', type=int, default=48, help='synthetic intrinsic dimension')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', default='1,5,10')
+    parser.add_argument('--dimensions', default='32,64,128,256')
+    parser.add_argument('--methods', default='pca,random')
+    parser.add_argument('--dtypes', default='float32,float16,int8')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report, sorted(int(k) for k in args.k.split(',')))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Seeded synthetic users and items for the load and evaluation harnesses.
+The same seed always produces the same dataset.
+"""
+import base64
+import io
+import os
+import random
+
+import bcrypt
+import jwt
+from PIL import Image
+
+ITEM_NAMES = ['wallet', 'airpods', 'water bottle', 'id card', 'umbrella', 'laptop charger', 'keys', 'backpack',
+              'calculator', 'spectacles', 'watch', 'earphones', 'notebook', 'hoodie', 'phone']
+COLORS = ['black', 'blue', 'red', 'white', 'grey', 'green', 'brown', 'pink']
+PLACES = ['library', 'canteen', 'block A', 'block B', 'hostel mess', 'sports complex', 'auditorium', 'parking lot']
+
+USER_PASSWORD = 'Loadtest@123'
+
+
+def make_image(rng, size=256):
+    """
+    Small JPEG with a few random blocks, so decode and hashing do real work.
+    """
+    image = Image.new('RGB', (size, size), tuple(rng.randrange(256) for _ in range(3)))
+    pixels = image.load()
+    for _ in range(8):
+        x, y = rng.randrange(size), rng.randrange(size)
+        w, h = rng.randrange(8, size // 2), rng.randrange(8, size // 2)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        for i in range(x, min(size, x + w)):
+            for j in range(y, min(size, y + h)):
+                pixels[i, j] = color
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=80)
+    return buffer.getvalue()
+
+
+def make_description(rng):
+    return f"{rng.choice(COLORS)} {rng.choice(ITEM_NAMES)} near the {rng.choice(PLACES)}"
+
+
+def make_users(count, seed=0, domain='srmap.edu.in'):
+    rng = random.Random(seed)
+    # One hash for everyone: bcrypt is deliberately slow and would dominate seeding
+    password = base64.b64encode(bcrypt.hashpw(USER_PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds=4))).decode('utf-8')
+    return [
+        {
+            'name': f'Load User {i}',
+            'mail': f'loaduser{i}@{domain}',
+            'phone': f'+91{rng.randrange(7000000000, 9999999999)}',
+            'password': password,
+            'socket_id': f'ExponentPushToken[{i}]' if rng.random() < 0.5 else '',
+        }
+        for i in range(count)
+    ]
+
+
+def make_items(users, count, seed=0, start_timestamp=1_700_000_000_000):
+    rng = random.Random(seed + 1)
+    documents = []
+    for i in range(count):
+        name = rng.choice(ITEM_NAMES)
+        owner_mail = rng.choice(users)['mail']
+        documents.append({
+            'owner_mail': owner_mail,
+            'tenant': owner_mail.rsplit('@', 1)[-1],
+            'name': name,
+            'state': rng.random() < 0.5,
+            'description': make_description(rng),
+            'timestamp': start_timestamp + i * 60_000,
+            'image': f'https://images.invalid/seed-{i}.jpg',
+            'matches': [],
+        })
+    return documents
+
+
+async def seed(users_collection, items_collection, user_count=200, item_count=2000, seed=0):
+    """
+    Insert the synthetic dataset and return (users, auth tokens by mail).
+    """
+    users = make_users(user_count, seed)
+    await users_collection.insert_many(users)
+    if item_count:
+        await items_collection.insert_many(make_items(users, item_count, seed))
+    tokens = {
+        user['mail']: jwt.encode({'_id': str(user['_id'])}, os.getenv('JWT_KEY'), algorithm="HS256")
+        for user in users
+    }
+    return users, tokens
@@ -0,0 +1,230 @@
+"""
+Microbenchmark for the ViT image and MiniLM text embedding paths in
+controllers/pinecone_controller.py.
+
+    python -m benchmarks.embedding_bench --batch-sizes 1,8,32 --threads 1,2,4 --output embeddings.json
+
+Sweeps batch size, torch intra-op threads, source image resolution and
+backend (eager, torchscript, compiled, onnx when onnxruntime is installed).
+Every configuration runs in a fresh subprocess so peak RSS is attributable
+to that configuration alone. Results are written as JSON for comparison
+between commits; unsupported configurations are recorded as skipped.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+IMAGE_BACKENDS = ('eager', 'torchscript', 'compiled', 'onnx')
+TEXT_BACKENDS = ('eager', 'onnx')
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def build_image_forward(backend, model, example):
+    """
+    Return a callable pixel_values -> CLS embeddings for the given backend.
+    """
+    import torch
+
+    class ClsEmbedding(torch.nn.Module):
+        def __init__(self, vit):
+            super().__init__()
+            self.vit = vit
+
+        def forward(self, pixel_values):
+            return self.vit(pixel_values=pixel_values).last_hidden_state[:, 0, :]
+
+    wrapped = ClsEmbedding(model).eval()
+    if backend == 'eager':
+        return wrapped
+    if backend == 'torchscript':
+        with torch.no_grad():
+            return torch.jit.optimize_for_inference(torch.jit.trace(wrapped, example))
+    if backend == 'compiled':
+        return torch.compile(wrapped)
+    if backend == 'onnx':
+        import onnxruntime
+        path = os.path.join(tempfile.mkdtemp(), 'vit.onnx')
+        torch.onnx.export(wrapped, (example,), path, input_names=['pixel_values'], output_names=['embedding'],
+                          dynamic_axes={'pixel_values': {0: 'batch'}, 'embedding': {0: 'batch'}})
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        return lambda pixel_values: session.run(None, {'pixel_values': pixel_values.numpy()})[0]
+    raise ValueError(backend)
+
+
+def run_image(config, rng):
+    import io
+    import torch
+    from PIL import Image
+    from benchmarks.dataset import make_image
+    import controllers.pinecone_controller as controller
+
+    source = Image.open(io.BytesIO(make_image(rng, 256))).resize((config['resolution'], config['resolution']))
+    buffer = io.BytesIO()
+    source.save(buffer, format='JPEG', quality=85)
+    batch = [buffer.getvalue()] * config['batch_size']
+
+    example = controller.image_processor(images=[source.convert('RGB')], return_tensors='pt')['pixel_values']
+    forward = build_image_forward(config['backend'], controller.model, example)
+
+    def step():
+        images = [Image.open(io.BytesIO(image_bytes)).convert('RGB') for image_bytes in batch]
+        pixel_values = controller.image_processor(images=images, return_tensors='pt')['pixel_values']
+        with torch.no_grad():
+            return forward(pixel_values)
+
+    return step
+
+
+def run_text(config, rng):
+    from benchmarks.dataset import make_description
+
+    texts = [make_description(rng) for _ in range(config['batch_size'])]
+    if config['backend'] == 'eager':
+        import controllers.pinecone_controller as controller
+        text_model = controller.text_model
+    elif config['backend'] == 'onnx':
+        from sentence_transformers import SentenceTransformer
+        text_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2', backend='onnx')
+    else:
+        raise ValueError(config['backend'])
+    return lambda: text_model.encode(texts, batch_size=len(texts))
+
+
+def run_one(config):
+    """
+    Measure a single configuration in this process and return its result.
+    """
+    import torch
+    torch.set_num_threads(config['threads'])
+    rng = random.Random(0)
+
+    loaded_at = time.perf_counter()
+    step = run_image(config, rng) if config['modality'] == 'image' else run_text(config, rng)
+    setup_seconds = time.perf_counter() - loaded_at
+
+    for _ in range(config['warmup']):
+        step()
+
+    latencies = []
+    deadline = time.perf_counter() + config['min_seconds']
+    while len(latencies) < config['iterations'] or time.perf_counter() < deadline:
+        started = time.perf_counter()
+        step()
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+
+    total = sum(latencies)
+    return {
+        **config,
+        'setup_seconds': round(setup_seconds, 2),
+        'batches': len(latencies),
+        'items_per_second': round(len(latencies) * config['batch_size'] / total, 2),
+        'batch_p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'batch_p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'batch_p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def sweep(args):
+    configs = []
+    for modality in args.modalities:
+        backends = [b for b in args.backends if b in (IMAGE_BACKENDS if modality == 'image' else TEXT_BACKENDS)]
+        resolutions = args.resolutions if modality == 'image' else [None]
+        for backend, threads, batch_size, resolution in itertools.product(backends, args.threads, args.batch_sizes, resolutions):
+            config = {'modality': modality, 'backend': backend, 'threads': threads, 'batch_size': batch_size,
+                      'warmup': args.warmup, 'iterations': args.iterations, 'min_seconds': args.min_seconds}
+            if resolution is not None:
+                config['resolution'] = resolution
+            configs.append(config)
+    return configs
+
+
+def run_isolated(config):
+    completed = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.embedding_bench', '--run-one', json.dumps(config)],
+        capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        reason = (completed.stderr.strip().splitlines() or ['failed'])[-1]
+        return {**config, 'skipped': reason}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def csv_ints(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+def csv_strs(value):
+    return [v for v in value.split(',') if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modalities', type=csv_strs, default=['image', 'text'])
+    parser.add_argument('--backends', type=csv_strs, default=list(IMAGE_BACKENDS))
+    parser.add_argument('--batch-sizes', type=csv_ints, default=[1, 4, 16, 32])
+    parser.add_argument('--threads', type=csv_ints, default=sorted({1, 2, os.cpu_count() or 1}))
+    parser.add_argument('--resolutions', type=csv_ints, default=[224, 1024, 3000],
+                        help='side of the uploaded source image before preprocessing')
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--min-seconds', type=float, default=3)
+    parser.add_argument('--output', help='write the JSON results to this file')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(json.dumps(run_one(json.loads(args.run_one))))
+        return
+
+    import torch
+    from benchmarks.loadtest import git_revision
+    results = []
+    for config in sweep(args):
+        result = run_isolated(config)
+        results.append(result)
+        if 'skipped' in result:
+            print(f"skip  {config['modality']:<5} {config['backend']:<11} threads={config['threads']} "
+                  f"batch={config['batch_size']} res={config.get('resolution', '-')}: {result['skipped']}")
+        else:
+            print(f"{result['modality']:<5} {result['backend']:<11} threads={result['threads']:<3} "
+                  f"batch={result['batch_size']:<4} res={result.get('resolution', '-'):<5} "
+                  f"{result['items_per_second']:>9}/s  p50={result['batch_p50_ms']}ms "
+                  f"p99={result['batch_p99_ms']}ms  rss={result['peak_rss_mb']}MB")
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'cpu_count': os.cpu_count(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
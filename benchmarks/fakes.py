@@ -0,0 +1,291 @@
+"""
+Local stand-ins for the external services main.app talks to, so the API can
+be driven without Atlas, Pinecone, Cloudinary or Expo. install() must run
+before main is imported since the controllers connect at import time.
+"""
+import asyncio
+import hashlib
+import os
+import sys
+import threading
+import time
+import types
+
+import numpy as np
+
+
+class FakeLatency:
+    """
+    Simulated network round-trip for a fake service, in milliseconds.
+    """
+
+    def __init__(self, ms=0.0):
+        self.seconds = ms / 1000.0
+
+    def sleep(self):
+        if self.seconds:
+            time.sleep(self.seconds)
+
+
+class FakeNamespace:
+    def __init__(self, dimension):
+        self.ids = []
+        self.positions = {}
+        self.vectors = np.zeros((0, dimension), dtype=np.float32)
+
+
+class FakeIndex:
+    """
+    Brute-force cosine index with the subset of the Pinecone Index API the
+    controllers use. Each namespace is searched on its own, like Pinecone's.
+    """
+
+    def __init__(self, dimension, latency):
+        self.dimension = dimension
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.namespaces = {}
+
+    @property
+    def ids(self):
+        return [vector_id for space in self.namespaces.values() for vector_id in space.ids]
+
+    def _space(self, namespace):
+        return self.namespaces.setdefault(namespace or '', FakeNamespace(self.dimension))
+
+    def upsert(self, vectors, namespace=None):
+        self.latency.sleep()
+        with self.lock:
+            space = self._space(namespace)
+            for vector_id, values in vectors:
+                values = np.asarray(values, dtype=np.float32)
+                values = values / (np.linalg.norm(values) or 1.0)
+                if vector_id in space.positions:
+                    space.vectors[space.positions[vector_id]] = values
+                else:
+                    space.positions[vector_id] = len(space.ids)
+                    space.ids.append(vector_id)
+                    space.vectors = np.vstack([space.vectors, values[None, :]])
+        return {'upserted_count': len(vectors)}
+
+    def query(self, vector, top_k=5, namespace=None, **kwargs):
+        self.latency.sleep()
+        with self.lock:
+            space = self._space(namespace)
+            if not space.ids:
+                return {'matches': []}
+            query = np.asarray(vector, dtype=np.float32)
+            query = query / (np.linalg.norm(query) or 1.0)
+            scores = space.vectors @ query
+            top = np.argsort(-scores)[:top_k]
+            return {'matches': [{'id': space.ids[i], 'score': float(scores[i])} for i in top]}
+
+    def delete(self, ids=None, namespace=None, **kwargs):
+        self.latency.sleep()
+        with self.lock:
+            space = self._space(namespace)
+            keep = [i for i, vector_id in enumerate(space.ids) if vector_id not in set(ids or [])]
+            space.ids = [space.ids[i] for i in keep]
+            space.vectors = space.vectors[keep]
+            space.positions = {vector_id: i for i, vector_id in enumerate(space.ids)}
+
+    def list(self, namespace=None, **kwargs):
+        with self.lock:
+            ids = list(self._space(namespace).ids)
+        yield ids
+
+    def fetch(self, ids, namespace=None, **kwargs):
+        self.latency.sleep()
+        with self.lock:
+            space = self._space(namespace)
+            vectors = {
+                vector_id: types.SimpleNamespace(id=vector_id, values=space.vectors[space.positions[vector_id]].tolist())
+                for vector_id in ids if vector_id in space.positions
+            }
+        return types.SimpleNamespace(vectors=vectors)
+
+    def describe_index_stats(self):
+        with self.lock:
+            namespaces = {name: {'vector_count': len(space.ids)} for name, space in self.namespaces.items() if space.ids}
+        return {
+            'dimension': self.dimension,
+            'total_vector_count': sum(space['vector_count'] for space in namespaces.values()),
+            'namespaces': namespaces,
+        }
+
+
+class FakePinecone:
+    indexes = {}
+    latency = FakeLatency()
+
+    def __init__(self, api_key=None, **kwargs):
+        pass
+
+    def list_indexes(self):
+        return [{'name': name} for name in self.indexes]
+
+    def create_index(self, name, dimension, **kwargs):
+        self.indexes.setdefault(name, FakeIndex(dimension, self.latency))
+
+    def Index(self, name, **kwargs):
+        return self.indexes[name]
+
+
+class FakeImageHost:
+    """
+    Replacement for cloudinary.uploader.upload/destroy and the admin API
+    calls the cleanup worker uses.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.images = {}
+
+    def upload(self, file, public_id=None, format='jpg', **kwargs):
+        self.latency.sleep()
+        self.images[public_id] = len(file)
+        return {'secure_url': f'https://images.invalid/{public_id}.{format}', 'public_id': public_id}
+
+    def destroy(self, public_id, **kwargs):
+        self.latency.sleep()
+        self.images.pop(public_id, None)
+        return {'result': 'ok'}
+
+    def delete_resources(self, public_ids, **kwargs):
+        self.latency.sleep()
+        for public_id in public_ids:
+            self.images.pop(public_id, None)
+        return {'deleted': {public_id: 'deleted' for public_id in public_ids}}
+
+    def resources(self, max_results=10, next_cursor=None, **kwargs):
+        self.latency.sleep()
+        public_ids = sorted(self.images)
+        start = int(next_cursor or 0)
+        page = public_ids[start:start + max_results]
+        listing = {'resources': [{'public_id': public_id} for public_id in page]}
+        if start + max_results < len(public_ids):
+            listing['next_cursor'] = str(start + max_results)
+        return listing
+
+
+class FakePushEndpoint:
+    """
+    Replacement for main.send_expo_push_notification.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.sent = 0
+
+    def __call__(self, expo_push_token, title, body, data=None):
+        self.latency.sleep()
+        self.sent += 1
+        return {"success": True, "response": {"data": {"status": "ok"}}}
+
+
+def _stub_vector(payload, dimension):
+    # Deterministic pseudo-embedding: identical inputs map to identical vectors
+    seed = int.from_bytes(hashlib.blake2b(payload, digest_size=8).digest(), 'little')
+    return np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+
+
+def install_stub_models(inference_ms=0.0):
+    """
+    Register a lightweight stand-in for controllers.pinecone_controller so the
+    ViT and MiniLM weights are never loaded.
+    """
+    from controllers.embedding_config import TEXT_DIMENSION, IMAGE_DIMENSION
+    from controllers.vector_compression import compress_text_embeddings, compress_image_embeddings
+
+    latency = FakeLatency(inference_ms)
+    module = types.ModuleType('controllers.pinecone_controller')
+
+    def compute_image(image):
+        latency.sleep()
+        return _stub_vector(image if isinstance(image, bytes) else image.tobytes(), IMAGE_DIMENSION)
+
+    def compute_text(text):
+        latency.sleep()
+        return _stub_vector(text.encode('utf-8'), TEXT_DIMENSION)
+
+    async def get_image_embedding(image):
+        return compress_image_embeddings(await asyncio.to_thread(compute_image, image))
+
+    async def get_text_embedding(text: str):
+        return compress_text_embeddings(await asyncio.to_thread(compute_text, text))
+
+    async def get_image_embeddings(images):
+        embeddings = await asyncio.to_thread(lambda: np.stack([compute_image(image) for image in images]))
+        return compress_image_embeddings(embeddings)
+
+    async def get_text_embeddings(texts):
+        embeddings = await asyncio.to_thread(lambda: np.stack([compute_text(text) for text in texts]))
+        return compress_text_embeddings(embeddings)
+
+    module.get_image_embedding = get_image_embedding
+    module.get_text_embedding = get_text_embedding
+    module.get_image_embeddings = get_image_embeddings
+    module.get_text_embeddings = get_text_embeddings
+    module.__all__ = ['get_image_embedding', 'get_text_embedding', 'get_image_embeddings', 'get_text_embeddings']
+    sys.modules['controllers.pinecone_controller'] = module
+
+
+def _patch_mongomock_bulk_write():
+    # pymongo>=4.11 passes sort= to bulk update operations, which mongomock
+    # doesn't know about yet
+    from mongomock.collection import BulkOperationBuilder
+    for name in ('add_update', 'add_replace'):
+        original = getattr(BulkOperationBuilder, name)
+        if getattr(original, 'accepts_sort', False):
+            continue
+
+        def patched(self, *args, sort=None, _original=original, **kwargs):
+            return _original(self, *args, **kwargs)
+        patched.accepts_sort = True
+        setattr(BulkOperationBuilder, name, patched)
+
+
+def install(mongo_uri=None, real_models=False, vector_ms=0.0, image_host_ms=0.0, push_ms=0.0, inference_ms=0.0):
+    """
+    Patch every external dependency and return the fakes. Mongo uses the
+    given mongo_uri (e.g. a local mongod) or, without one, mongomock-motor.
+    """
+    os.environ.setdefault('JWT_KEY', 'loadtest-secret')
+    os.environ.setdefault('DB_NAME', 'reclaimit_loadtest')
+    os.environ.setdefault('SALT_ROUNDS', '4')
+    for name in ('LOST_INDEX_NAME_TEXT', 'FOUND_INDEX_NAME_TEXT', 'LOST_INDEX_NAME_IMG', 'FOUND_INDEX_NAME_IMG'):
+        os.environ.setdefault(name, name.lower().replace('_', '-'))
+
+    import motor.motor_asyncio
+    if mongo_uri:
+        real_client = motor.motor_asyncio.AsyncIOMotorClient
+        motor.motor_asyncio.AsyncIOMotorClient = lambda *args, **kwargs: real_client(mongo_uri)
+    else:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("Install mongomock-motor or pass --mongo-uri of a local mongod")
+        _patch_mongomock_bulk_write()
+        motor.motor_asyncio.AsyncIOMotorClient = lambda *args, **kwargs: AsyncMongoMockClient()
+
+    import pinecone
+    FakePinecone.indexes = {}
+    FakePinecone.latency = FakeLatency(vector_ms)
+    pinecone.Pinecone = FakePinecone
+
+    import cloudinary.api
+    import cloudinary.uploader
+    image_host = FakeImageHost(FakeLatency(image_host_ms))
+    cloudinary.uploader.upload = image_host.upload
+    cloudinary.uploader.destroy = image_host.destroy
+    cloudinary.api.delete_resources = image_host.delete_resources
+    cloudinary.api.resources = image_host.resources
+
+    if not real_models:
+        install_stub_models(inference_ms)
+
+    import main
+    push = FakePushEndpoint(FakeLatency(push_ms))
+    main.send_expo_push_notification = push
+
+    return types.SimpleNamespace(app=main.app, main=main, image_host=image_host, push=push, pinecone=FakePinecone)
@@ -0,0 +1,186 @@
+"""
+End-to-end load test of main.app against local fakes (see benchmarks/fakes.py).
+
+    python -m benchmarks.loadtest --mix mixed --concurrency 32 --duration 30 --output results.json
+
+Requests are issued in-process through httpx's ASGI transport, so the
+numbers measure the application (routing, validation, Mongo, matching,
+serialisation) rather than the network. A fixed --seed makes runs
+repeatable; the JSON output carries the git revision for regression tracking.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import time
+
+MIXES = {
+    'browse': {'getItems': 0.7, 'getUserItems': 0.1, 'notifications': 0.2},
+    'upload': {'upload': 1.0},
+    'notifications': {'notifications': 1.0},
+    'login': {'login': 1.0},
+    'search': {'search': 1.0},
+    'mixed': {'getItems': 0.5, 'notifications': 0.2, 'getUserItems': 0.1, 'upload': 0.1, 'login': 0.1},
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+
+    def record(self, route, status_code, seconds):
+        self.latencies.setdefault(route, []).append(seconds)
+        counts = self.statuses.setdefault(route, {})
+        counts[status_code] = counts.get(status_code, 0) + 1
+
+    def report(self, elapsed):
+        routes = {}
+        for route, values in sorted(self.latencies.items()):
+            values.sort()
+            routes[route] = {
+                'requests': len(values),
+                'rps': round(len(values) / elapsed, 2),
+                'p50_ms': round(percentile(values, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+                'statuses': {str(k): v for k, v in sorted(self.statuses[route].items())},
+            }
+        total = sum(route['requests'] for route in routes.values())
+        return {'elapsed_seconds': round(elapsed, 2), 'total_requests': total,
+                'total_rps': round(total / elapsed, 2), 'routes': routes}
+
+
+class VirtualUser:
+    def __init__(self, client, user, token, mix, rng, recorder):
+        self.client = client
+        self.user = user
+        self.headers = {'auth_token': token}
+        self.mix = mix
+        self.rng = rng
+        self.recorder = recorder
+
+    async def timed(self, route, method, path, **kwargs):
+        started = time.perf_counter()
+        response = await self.client.request(method, path, **kwargs)
+        self.recorder.record(route, response.status_code, time.perf_counter() - started)
+
+    async def step(self):
+        from benchmarks.dataset import make_image, make_description, USER_PASSWORD
+        action = self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        if action == 'getItems':
+            await self.timed('/getItems', 'POST', '/getItems', headers=self.headers, json={'page': self.rng.randint(1, 5)})
+        elif action == 'getUserItems':
+            await self.timed('/getUserItems', 'POST', '/getUserItems', headers=self.headers)
+        elif action == 'notifications':
+            await self.timed('/getNotifications', 'POST', '/getNotifications', headers=self.headers)
+        elif action == 'search':
+            await self.timed('/search', 'POST', '/search', headers=self.headers, json={'query': make_description(self.rng)})
+        elif action == 'login':
+            await self.timed('/login', 'POST', '/login', json={'mail': self.user['mail'], 'password': USER_PASSWORD})
+        elif action == 'upload':
+            form = {
+                'name': 'item',
+                'state': str(self.rng.random() < 0.5).lower(),
+                'description': make_description(self.rng),
+                'timestamp': str(int(time.time() * 1000)),
+            }
+            files = {'image': ('item.jpg', make_image(self.rng, 128), 'image/jpeg')}
+            await self.timed('/upload', 'POST', '/upload', headers=self.headers, data=form, files=files)
+
+    async def run(self, stop_at):
+        while time.perf_counter() < stop_at:
+            await self.step()
+
+
+async def run(args):
+    from benchmarks import fakes
+    from benchmarks.dataset import seed
+
+    os.environ.setdefault('UPLOAD_RATE_LIMIT', '1000000')
+    env = fakes.install(
+        mongo_uri=args.mongo_uri, real_models=args.real_models, vector_ms=args.vector_ms,
+        image_host_ms=args.image_host_ms, push_ms=args.push_ms, inference_ms=args.inference_ms,
+    )
+    import httpx
+
+    async with env.app.router.lifespan_context(env.app):
+        if args.mongo_uri:
+            await env.main.users.delete_many({})
+            await env.main.items.delete_many({})
+        users, tokens = await seed(env.main.users, env.main.items, args.users, args.items, args.seed)
+
+        recorder = Recorder()
+        transport = httpx.ASGITransport(app=env.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://loadtest', timeout=120) as client:
+            rng = random.Random(args.seed)
+            virtual_users = [
+                VirtualUser(client, user, tokens[user['mail']], MIXES[args.mix], random.Random(rng.random()), recorder)
+                for user in (rng.choice(users) for _ in range(args.concurrency))
+            ]
+            if args.warmup:
+                await asyncio.gather(*(vu.run(time.perf_counter() + args.warmup) for vu in virtual_users))
+                recorder = Recorder()
+                for vu in virtual_users:
+                    vu.recorder = recorder
+            started = time.perf_counter()
+            await asyncio.gather(*(vu.run(started + args.duration) for vu in virtual_users))
+            elapsed = time.perf_counter() - started
+
+    result = recorder.report(elapsed)
+    result['config'] = {k: v for k, v in vars(args).items() if k != 'output'}
+    result['revision'] = git_revision()
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def print_report(result):
+    print(f"{'route':<20}{'reqs':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses")
+    for route, stats in result['routes'].items():
+        print(f"{route:<20}{stats['requests']:>8}{stats['rps']:>10}{stats['p50_ms']:>10}"
+              f"{stats['p95_ms']:>10}{stats['p99_ms']:>10}  {stats['statuses']}")
+    print(f"total: {result['total_requests']} requests, {result['total_rps']} req/s over {result['elapsed_seconds']}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mix', choices=sorted(MIXES), default='mixed')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mongo-uri', help='local mongod to use instead of the in-memory mongomock-motor')
+    parser.add_argument('--real-models', action='store_true', help='load ViT/MiniLM instead of stub embeddings')
+    parser.add_argument('--vector-ms', type=float, default=0, help='simulated Pinecone latency')
+    parser.add_argument('--image-host-ms', type=float, default=0, help='simulated Cloudinary latency')
+    parser.add_argument('--push-ms', type=float, default=0, help='simulated Expo latency')
+    parser.add_argument('--inference-ms', type=float, default=0, help='simulated stub model latency')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,422 @@
+"""
+Match quality vs latency of the matching engine on labelled lost/found pairs.
+
+    python -m benchmarks.retrieval_eval --dataset eval/ --real-models --backends exact,int8 --output retrieval.json
+
+The dataset is a directory with a pairs.jsonl file, one pair per line:
+
+    {"lost": {"description": "...", "image": "images/l1.jpg"},
+     "found": {"description": "...", "image": "images/f1.jpg"}}
+
+Image paths are relative to the directory and optional. Either side can be
+left out to add a distractor without a counterpart. Without --dataset a
+synthetic set is generated (--synthetic pairs: the same object described and
+photographed twice), which is only good for checking the script works.
+
+Every item goes through the production path: pinecone_controller embeds it,
+the pinecone_database batch upserts index it, and get_matched_*_id matches
+it. Only the index behind those functions is swapped per backend:
+
+    exact    brute-force float32 cosine in memory (the reference)
+    float16  the same with vectors stored as float16
+    int8     the same with int8 vectors and a scale per vector
+    pinecone the configured Pinecone indexes, in a scratch namespace that is
+             deleted afterwards (needs PINECONE_API and the index names)
+
+Each labelled item is matched against the other side and scored on:
+recall@k and MRR over its ranked neighbours, precision and recall of what it
+would be notified about (the get_matched_*_id result, for each --match-top-k)
+and the latency of that call.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+import numpy as np
+
+from benchmarks.fakes import FakeIndex, FakeLatency
+
+MODALITIES = ('text', 'image', 'both')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+# Datasets, as lists of {'lost': {...} or None, 'found': {...} or None} with image bytes
+
+def load_pairs(directory):
+    pairs = []
+    with open(os.path.join(directory, 'pairs.jsonl')) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            pair = json.loads(line)
+            for side in ('lost', 'found'):
+                entry = pair.get(side)
+                if entry and entry.get('image'):
+                    with open(os.path.join(directory, entry['image']), 'rb') as image_file:
+                        entry['image'] = image_file.read()
+            pairs.append({'lost': pair.get('lost'), 'found': pair.get('found')})
+    return pairs
+
+
+def _photograph_again(image_bytes, rng):
+    # A second photo of the same object: mirrored, slightly cropped, re-encoded
+    import io
+    from PIL import Image, ImageOps
+
+    image = ImageOps.mirror(Image.open(io.BytesIO(image_bytes)).convert('RGB'))
+    margin = rng.randrange(0, image.width // 8 + 1)
+    image = image.crop((margin, margin, image.width - margin, image.height - margin))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=70)
+    return buffer.getvalue()
+
+
+def synthetic_pairs(count, seed):
+    from benchmarks.dataset import COLORS, ITEM_NAMES, PLACES, make_image
+
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(count):
+        color, name, place = rng.choice(COLORS), rng.choice(ITEM_NAMES), rng.choice(PLACES)
+        image = make_image(rng)
+        pairs.append({
+            'lost': {'description': f"lost my {color} {name} near the {place}", 'image': image},
+            'found': {'description': f"found a {color} {name} at the {place}", 'image': _photograph_again(image, rng)},
+        })
+    return pairs
+
+
+def split_items(pairs):
+    """
+    Returns (lost items, found items, {item id: counterpart id}).
+    """
+    lost, found, truth = [], [], {}
+    for number, pair in enumerate(pairs):
+        if pair['lost']:
+            lost.append({'id': f"lost-{number}", **pair['lost']})
+        if pair['found']:
+            found.append({'id': f"found-{number}", **pair['found']})
+        if pair['lost'] and pair['found']:
+            truth[f"lost-{number}"] = f"found-{number}"
+            truth[f"found-{number}"] = f"lost-{number}"
+    return lost, found, truth
+
+
+async def embed_items(items, batch_size):
+    """
+    Embed descriptions and images in batches, in place. Returns the time
+    spent per modality.
+    """
+    from controllers.pinecone_controller import get_text_embeddings, get_image_embeddings
+
+    timings = {'text': 0.0, 'image': 0.0}
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        started = time.perf_counter()
+        for item, embedding in zip(batch, await get_text_embeddings([item['description'] for item in batch])):
+            item['text_embedding'] = embedding
+        timings['text'] += time.perf_counter() - started
+
+        with_image = [item for item in batch if item.get('image')]
+        started = time.perf_counter()
+        if with_image:
+            for item, embedding in zip(with_image, await get_image_embeddings([item['image'] for item in with_image])):
+                item['image_embedding'] = embedding
+        timings['image'] += time.perf_counter() - started
+    return timings
+
+
+# Backends: objects with the subset of the Pinecone Index API pinecone_database uses
+
+class QuantizedIndex(FakeIndex):
+    """
+    FakeIndex scoring against vectors stored at reduced precision.
+    """
+
+    def __init__(self, dimension, dtype):
+        super().__init__(dimension, FakeLatency())
+        self.dtype = dtype
+        self._codes = {}
+
+    def upsert(self, vectors, namespace=None):
+        self._codes.pop(namespace or '', None)
+        return super().upsert(vectors, namespace)
+
+    def query(self, vector, top_k=5, namespace=None, **kwargs):
+        from controllers.vector_compression import quantize
+
+        with self.lock:
+            space = self._space(namespace)
+            if not space.ids:
+                return {'matches': []}
+            if (namespace or '') not in self._codes:
+                self._codes[namespace or ''] = quantize(space.vectors, self.dtype)
+            codes, scale = self._codes[namespace or '']
+            query = np.asarray(vector, dtype=np.float32)
+            query = query / (np.linalg.norm(query) or 1.0)
+            scores = codes.astype(np.float32) @ query
+            if scale is not None:
+                scores *= scale[:, 0]
+            top = np.argsort(-scores)[:top_k]
+            return {'matches': [{'id': space.ids[i], 'score': float(scores[i])} for i in top]}
+
+
+def _memory_backend(make_index):
+    def install(namespace):
+        from controllers import pinecone_database
+        pinecone_database._index_refs.clear()
+        pinecone_database._index_refs.update({
+            key: make_index(dimension) for key, (_, dimension) in pinecone_database.INDEX_SPECS.items()
+        })
+        return lambda: None
+    return install
+
+
+def _pinecone_backend(namespace):
+    from controllers import pinecone_database
+    pinecone_database._index_refs.clear()
+    pinecone_database.bootstrap_pinecone()
+
+    def cleanup():
+        for index_ref in pinecone_database._index_refs.values():
+            index_ref.delete(delete_all=True, namespace=namespace)
+    return cleanup
+
+
+BACKENDS = {
+    'exact': _memory_backend(lambda dimension: FakeIndex(dimension, FakeLatency())),
+    'float16': _memory_backend(lambda dimension: QuantizedIndex(dimension, 'float16')),
+    'int8': _memory_backend(lambda dimension: QuantizedIndex(dimension, 'int8')),
+    'pinecone': _pinecone_backend,
+}
+
+
+def wait_until_indexed(namespace, expected, timeout=120):
+    # Pinecone is eventually consistent; the in-memory backends are not
+    from controllers import pinecone_database
+    deadline = time.monotonic() + timeout
+    for key, count in expected.items():
+        while time.monotonic() < deadline:
+            stats = pinecone_database._index_refs[key].describe_index_stats()
+            if stats.get('namespaces', {}).get(namespace, {}).get('vector_count', 0) >= count:
+                break
+            time.sleep(1)
+
+
+def index_items(namespace, lost, found):
+    from controllers import pinecone_database as db
+
+    expected = {}
+    for key, upsert, side, field in (
+        ('lost_text', db.upsert_lost_items_description_in_pinecone_database, lost, 'text_embedding'),
+        ('lost_img', db.upsert_lost_items_image_in_pinecone_database, lost, 'image_embedding'),
+        ('found_text', db.upsert_found_items_description_in_pinecone_database, found, 'text_embedding'),
+        ('found_img', db.upsert_found_items_image_in_pinecone_database, found, 'image_embedding'),
+    ):
+        vectors = [(item['id'], item[field]) for item in side if field in item]
+        if vectors:
+            upsert(namespace, vectors)
+        expected[key] = len(vectors)
+    return expected
+
+
+def _embeddings(item, modality):
+    text = item['text_embedding'] if modality in ('text', 'both') else None
+    image = item.get('image_embedding') if modality in ('image', 'both') else None
+    return text, image
+
+
+def ranked_neighbours(namespace, item, lost_side, modality, top_k):
+    """
+    The other side's items ranked by their best score over every query
+    get_matched_*_id would run for this item.
+    """
+    from controllers import pinecone_database as db
+    from controllers.embedding_config import CROSS_MODAL_MATCHING
+
+    if lost_side:
+        query_text, query_image = db.query_found_item_description_in_pinecone_database, db.query_found_item_image_in_pinecone_database
+    else:
+        query_text, query_image = db.query_lost_item_description_in_pinecone_database, db.query_lost_item_image_in_pinecone_database
+    text, image = _embeddings(item, modality)
+    queries = []
+    if text is not None:
+        queries.append((query_text, text))
+        if CROSS_MODAL_MATCHING:
+            queries.append((query_image, text))
+    if image is not None:
+        queries.append((query_image, image))
+        if CROSS_MODAL_MATCHING:
+            queries.append((query_text, image))
+    best = {}
+    for query, vector in queries:
+        for match in query(namespace, vector, top_k).get('matches', []):
+            best[match['id']] = max(match['score'], best.get(match['id'], match['score']))
+    return [item_id for item_id, _ in sorted(best.items(), key=lambda match: match[1], reverse=True)]
+
+
+def evaluate_direction(namespace, queries, lost_side, truth, modality, ks, match_top_ks):
+    from controllers import pinecone_database as db
+
+    get_matched = db.get_matched_found_items_id if lost_side else db.get_matched_lost_items_id
+    labelled = [item for item in queries if item['id'] in truth and any(v is not None for v in _embeddings(item, modality))]
+    if not labelled:
+        return None
+
+    recall_hits = {k: 0 for k in ks}
+    reciprocal_ranks = 0.0
+    for item in labelled:
+        ranked = ranked_neighbours(namespace, item, lost_side, modality, max(ks))
+        expected = truth[item['id']]
+        if expected in ranked:
+            rank = ranked.index(expected) + 1
+            reciprocal_ranks += 1 / rank
+            for k in ks:
+                recall_hits[k] += rank <= k
+
+    result = {
+        'queries': len(labelled),
+        **{f'recall@{k}': round(recall_hits[k] / len(labelled), 4) for k in ks},
+        'mrr': round(reciprocal_ranks / len(labelled), 4),
+        'notify': [],
+    }
+    for match_top_k in match_top_ks:
+        db.MATCH_TOP_K = match_top_k
+        latencies, notified, relevant = [], 0, 0
+        started = time.perf_counter()
+        for item in labelled:
+            call_started = time.perf_counter()
+            matched_ids = get_matched(namespace, *_embeddings(item, modality))
+            latencies.append((time.perf_counter() - call_started) * 1000)
+            notified += len(matched_ids)
+            relevant += truth[item['id']] in matched_ids
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        result['notify'].append({
+            'match_top_k': match_top_k,
+            'precision': round(relevant / notified, 4) if notified else 0.0,
+            'recall': round(relevant / len(labelled), 4),
+            'notified_per_item': round(notified / len(labelled), 2),
+            'p50_ms': round(percentile(latencies, 0.5), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'matches_per_s': round(len(labelled) / elapsed, 1) if elapsed else 0.0,
+        })
+    return result
+
+
+def run_backend(backend, lost, found, truth, args):
+    namespace = f"eval-{uuid.uuid4().hex[:12]}"
+    cleanup = BACKENDS[backend](namespace)
+    try:
+        started = time.perf_counter()
+        expected = index_items(namespace, lost, found)
+        if backend == 'pinecone':
+            wait_until_indexed(namespace, expected)
+        index_seconds = time.perf_counter() - started
+
+        ks = sorted(int(k) for k in args.k.split(','))
+        match_top_ks = sorted(int(k) for k in args.match_top_k.split(','))
+        results = []
+        for modality in args.modalities.split(','):
+            for direction, queries, lost_side in (('lost->found', lost, True), ('found->lost', found, False)):
+                result = evaluate_direction(namespace, queries, lost_side, truth, modality, ks, match_top_ks)
+                if result:
+                    results.append({'backend': backend, 'modality': modality, 'direction': direction, **result})
+        return {'backend': backend, 'index_seconds': round(index_seconds, 3), 'results': results}
+    finally:
+        cleanup()
+
+
+def run(args):
+    if 'pinecone' in args.backends.split(','):
+        from dotenv import load_dotenv
+        load_dotenv()
+    if not args.real_models:
+        from benchmarks.fakes import install_stub_models
+        install_stub_models()
+    from controllers import pinecone_database
+    from controllers.embedding_config import EMBEDDING_MODE
+
+    pairs = load_pairs(args.dataset) if args.dataset else synthetic_pairs(args.synthetic, args.seed)
+    lost, found, truth = split_items(pairs)
+    timings = asyncio.run(embed_items(lost + found, args.batch_size))
+    items_with_image = sum(1 for item in lost + found if item.get('image'))
+
+    default_top_k = pinecone_database.MATCH_TOP_K
+    try:
+        backends = [run_backend(backend, lost, found, truth, args) for backend in args.backends.split(',')]
+    finally:
+        pinecone_database.MATCH_TOP_K = default_top_k
+
+    from benchmarks.loadtest import git_revision
+    return {
+        'revision': git_revision(),
+        'source': args.dataset or 'synthetic',
+        'embedding_mode': EMBEDDING_MODE,
+        'models': 'real' if args.real_models else 'stub',
+        'lost': len(lost), 'found': len(found), 'pairs': len(truth) // 2,
+        'embedding': {
+            'texts_per_s': round(len(lost + found) / timings['text'], 1) if timings['text'] else None,
+            'images_per_s': round(items_with_image / timings['image'], 1) if timings['image'] else None,
+        },
+        'backends': backends,
+    }
+
+
+def print_report(report, ks):
+    print(f"{report['pairs']} pairs, {report['lost']} lost / {report['found']} found items, "
+          f"{report['embedding_mode']} embeddings ({report['models']}): "
+          f"{report['embedding']['texts_per_s']} texts/s, {report['embedding']['images_per_s']} images/s")
+    recall_columns = [f'recall@{k}' for k in ks]
+    print(f"{'backend':<10}{'modality':<10}{'direction':<13}" + ''.join(f'{c:>10}' for c in recall_columns)
+          + f"{'mrr':>8}{'top_k':>7}{'prec':>8}{'recall':>8}{'notified':>10}{'p50 ms':>9}{'p95 ms':>9}{'match/s':>9}")
+    for backend in report['backends']:
+        for row in backend['results']:
+            prefix = f"{row['backend']:<10}{row['modality']:<10}{row['direction']:<13}" \
+                     + ''.join(f'{row[c]:>10}' for c in recall_columns) + f"{row['mrr']:>8}"
+            for notify in row['notify']:
+                print(prefix + f"{notify['match_top_k']:>7}{notify['precision']:>8}{notify['recall']:>8}"
+                      f"{notify['notified_per_item']:>10}{notify['p50_ms']:>9}{notify['p95_ms']:>9}{notify['matches_per_s']:>9}")
+                prefix = ' ' * len(prefix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', help='directory with pairs.jsonl')
+    parser.add_argument('--synthetic', type=int, default=200, help='pairs to generate without --dataset')
+    parser.add_argument('--real-models', action='store_true', help='load the embedding models instead of stubs')
+    parser.add_argument('--backends', default='exact,float16,int8', help=f"comma separated: {', '.join(BACKENDS)}")
+    parser.add_argument('--modalities', default='both', help=f"comma separated: {', '.join(MODALITIES)}")
+    parser.add_argument('--k', default='1,5,10')
+    parser.add_argument('--match-top-k', default='3,5,10', help='MATCH_TOP_K values to score the notifications at')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    for backend in args.backends.split(','):
+        if backend not in BACKENDS:
+            parser.error(f"unknown backend {backend}")
+    for modality in args.modalities.split(','):
+        if modality not in MODALITIES:
+            parser.error(f"unknown modality {modality}")
+
+    report = run(args)
+    print_report(report, sorted(int(k) for k in args.k.split(',')))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+Throughput and memory scaling of launcher.py from 1 to N workers.
+
+    python -m benchmarks.worker_scaling --max-workers 4 --mix browse --output scaling.json
+
+For each worker count a server is started through launcher.serve() with
+the local fakes from benchmarks/fakes.py (and the real models with
+--real-models), then driven over HTTP by several client processes.
+Per-worker RSS and PSS are read from /proc: PSS divides shared pages among
+the processes sharing them, so it shows how much of the preloaded model
+memory is actually shared copy-on-write.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def serve(args):
+    """
+    Server side, run in a subprocess: install fakes, seed, write the auth
+    tokens for the clients, then fork workers.
+    """
+    import launcher
+    threads = launcher.configure_threads(args.workers, args.threads)
+
+    from benchmarks import fakes
+    from benchmarks.dataset import seed
+    os.environ.setdefault('UPLOAD_RATE_LIMIT', '1000000')
+    env = fakes.install(real_models=args.real_models, vector_ms=args.vector_ms, image_host_ms=args.image_host_ms,
+                        push_ms=args.push_ms, inference_ms=args.inference_ms)
+    users, tokens = asyncio.run(seed(env.main.users, env.main.items, args.users, args.items, args.seed))
+    with open(args.tokens_file, 'w') as f:
+        json.dump([{'mail': user['mail'], 'token': tokens[user['mail']]} for user in users], f)
+
+    launcher.serve(env.main.asgi_app, args.workers, '127.0.0.1', args.port, threads, args.pin_workers)
+
+
+def memory_kb(pid):
+    result = {'rss_kb': 0, 'pss_kb': 0}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Rss:'):
+                    result['rss_kb'] = int(line.split()[1])
+                elif line.startswith('Pss:'):
+                    result['pss_kb'] = int(line.split()[1])
+    except OSError:
+        pass
+    return result
+
+
+def worker_pids(parent_pid):
+    try:
+        with open(f'/proc/{parent_pid}/task/{parent_pid}/children') as f:
+            return [int(pid) for pid in f.read().split()]
+    except OSError:
+        return []
+
+
+def wait_for_port(port, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.5)
+    return False
+
+
+def client_process(url, users, mix_name, concurrency, duration, warmup, seed, queue):
+    from benchmarks.loadtest import MIXES, Recorder, VirtualUser
+    import httpx
+
+    async def run():
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as client:
+            rng = random.Random(seed)
+            recorder = Recorder()
+            virtual_users = [
+                VirtualUser(client, user, user['token'], MIXES[mix_name], random.Random(rng.random()), recorder)
+                for user in (rng.choice(users) for _ in range(concurrency))
+            ]
+            await asyncio.gather(*(vu.run(time.perf_counter() + warmup) for vu in virtual_users))
+            recorder = Recorder()
+            for vu in virtual_users:
+                vu.recorder = recorder
+            await asyncio.gather(*(vu.run(time.perf_counter() + duration) for vu in virtual_users))
+            return recorder
+
+    recorder = asyncio.run(run())
+    queue.put((recorder.latencies, recorder.statuses))
+
+
+def measure(args, workers):
+    from benchmarks.loadtest import Recorder
+
+    tokens_file = os.path.join(tempfile.mkdtemp(), 'tokens.json')
+    command = [sys.executable, '-m', 'benchmarks.worker_scaling', '--serve', '--workers', str(workers),
+               '--port', str(args.port), '--tokens-file', tokens_file]
+    for flag in ('users', 'items', 'seed', 'vector_ms', 'image_host_ms', 'push_ms', 'inference_ms'):
+        command += [f"--{flag.replace('_', '-')}", str(getattr(args, flag))]
+    if args.threads:
+        command += ['--threads', str(args.threads)]
+    if args.real_models:
+        command.append('--real-models')
+    if args.pin_workers:
+        command.append('--pin-workers')
+
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for_port(args.port, args.startup_timeout):
+            raise RuntimeError(f"server with {workers} workers did not start")
+        time.sleep(1)
+        with open(tokens_file) as f:
+            users = json.load(f)
+
+        idle_memory = [memory_kb(pid) for pid in worker_pids(server.pid)]
+
+        queue = multiprocessing.Queue()
+        per_client = max(1, args.concurrency // args.client_procs)
+        clients = [
+            multiprocessing.Process(target=client_process, args=(
+                f'http://127.0.0.1:{args.port}', users, args.mix, per_client, args.duration, args.warmup,
+                args.seed + i, queue))
+            for i in range(args.client_procs)
+        ]
+        for client in clients:
+            client.start()
+        time.sleep(args.warmup + args.duration / 2)
+        loaded_memory = [memory_kb(pid) for pid in worker_pids(server.pid)]
+        parent_memory = memory_kb(server.pid)
+
+        recorder = Recorder()
+        for _ in clients:
+            latencies, statuses = queue.get()
+            for route, values in latencies.items():
+                for value in values:
+                    recorder.latencies.setdefault(route, []).append(value)
+            for route, counts in statuses.items():
+                merged = recorder.statuses.setdefault(route, {})
+                for status_code, count in counts.items():
+                    merged[status_code] = merged.get(status_code, 0) + count
+        for client in clients:
+            client.join()
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    result = recorder.report(args.duration)
+    result['workers'] = workers
+    result['parent_memory'] = parent_memory
+    result['worker_memory_idle'] = idle_memory
+    result['worker_memory_loaded'] = loaded_memory
+    if loaded_memory:
+        result['avg_worker_rss_mb'] = round(sum(m['rss_kb'] for m in loaded_memory) / len(loaded_memory) / 1024, 1)
+        result['avg_worker_pss_mb'] = round(sum(m['pss_kb'] for m in loaded_memory) / len(loaded_memory) / 1024, 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--pin-workers', action='store_true')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--mix', default='browse')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--client-procs', type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--startup-timeout', type=float, default=300)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--real-models', action='store_true')
+    parser.add_argument('--vector-ms', type=float, default=0)
+    parser.add_argument('--image-host-ms', type=float, default=0)
+    parser.add_argument('--push-ms', type=float, default=0)
+    parser.add_argument('--inference-ms', type=float, default=0)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--tokens-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    from benchmarks.loadtest import git_revision
+    results = []
+    print(f"{'workers':>8}{'req/s':>10}{'worst p99 ms':>14}{'RSS/worker MB':>15}{'PSS/worker MB':>15}")
+    for workers in range(1, args.max_workers + 1):
+        result = measure(args, workers)
+        results.append(result)
+        p99 = max((route['p99_ms'] for route in result['routes'].values()), default=0)
+        print(f"{workers:>8}{result['total_rps']:>10}{p99:>14}"
+              f"{result.get('avg_worker_rss_mb', '-'):>15}{result.get('avg_worker_pss_mb', '-'):>15}")
+
+    report = {'revision': git_revision(), 'cpu_count': os.cpu_count(), 'mix': args.mix,
+              'real_models': args.real_models, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
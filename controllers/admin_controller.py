@@ -0,0 +1,14 @@
+import hmac
+import os
+
+# The operator endpoints (/admission-stats, /cleanup-stats, /search-stats,
+# /admin/profiles) and on-demand profiling take ADMIN_TOKEN in the
+# X-Admin-Token header. PROFILE_ADMIN_TOKEN is its old name, still read when
+# ADMIN_TOKEN is not set. No token configured means no admin access.
+
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN') or os.getenv('PROFILE_ADMIN_TOKEN', '')
+
+
+def is_admin(headers):
+    token = headers.get('x-admin-token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token, ADMIN_TOKEN)
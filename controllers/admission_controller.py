@@ -0,0 +1,154 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Stage:
+    """
+    Concurrency limit for one stage of the upload pipeline.
+
+    max_queue=None waits without bound, which is what the inner stages use:
+    they are already bounded by the admission stage in front of them.
+    Otherwise at most max_queue callers wait, each for at most queue_timeout
+    seconds (or until its deadline), and the rest are shed with Overloaded.
+    """
+
+    def __init__(self, name, concurrency, max_queue=None, queue_timeout=None):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.in_flight = 0
+        self.queued = 0
+        self.shed = 0
+        self.completed = 0
+        self.avg_duration = 1.0  # seconds, exponentially weighted
+
+    def retry_after(self):
+        backlog = (self.in_flight + self.queued + 1) / self.concurrency
+        return max(1, math.ceil(backlog * self.avg_duration))
+
+    def _shed(self):
+        self.shed += 1
+        raise Overloaded(self.retry_after())
+
+    @asynccontextmanager
+    async def slot(self, deadline=None):
+        if self.max_queue is not None and self.semaphore.locked() and self.queued >= self.max_queue:
+            self._shed()
+
+        timeout = self.queue_timeout
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._shed()
+            timeout = remaining if timeout is None else min(timeout, remaining)
+
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self._shed()
+        finally:
+            self.queued -= 1
+
+        self.in_flight += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.avg_duration = 0.8 * self.avg_duration + 0.2 * (time.monotonic() - started)
+            self.semaphore.release()
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "shed": self.shed,
+            "completed": self.completed,
+            "avg_duration_seconds": round(self.avg_duration, 3),
+        }
+
+
+class UserRateLimiter:
+    """
+    Sliding-window limiter: at most limit calls per user in any window seconds.
+    """
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.calls = {}
+        self.rejected = 0
+
+    def check(self, user_id):
+        """
+        Record a call for user_id. Returns 0 if allowed, otherwise the number
+        of seconds until the next call would be allowed.
+        """
+        now = time.monotonic()
+        calls = self.calls.setdefault(user_id, deque())
+        while calls and calls[0] <= now - self.window:
+            calls.popleft()
+        if len(calls) >= self.limit:
+            self.rejected += 1
+            return max(1, math.ceil(calls[0] + self.window - now))
+        calls.append(now)
+        self._prune(now)
+        return 0
+
+    def _prune(self, now):
+        # Keep memory bounded by dropping users with no calls in the window
+        if len(self.calls) < 10000:
+            return
+        for user_id in [u for u, c in self.calls.items() if not c or c[-1] <= now - self.window]:
+            del self.calls[user_id]
+
+    def stats(self):
+        return {"limit": self.limit, "window_seconds": self.window, "tracked_users": len(self.calls), "rejected": self.rejected}
+
+
+UPLOAD_DEADLINE_SECONDS = float(os.getenv('UPLOAD_DEADLINE_SECONDS', 30))
+
+upload_stages = {
+    # Whole-pipeline admission: the only stage that sheds load
+    'admission': Stage(
+        'admission',
+        concurrency=int(os.getenv('UPLOAD_MAX_CONCURRENCY', 4)),
+        max_queue=int(os.getenv('UPLOAD_MAX_QUEUE', 16)),
+        queue_timeout=float(os.getenv('UPLOAD_QUEUE_TIMEOUT_SECONDS', 10)),
+    ),
+    'image_host': Stage('image_host', concurrency=int(os.getenv('IMAGE_HOST_CONCURRENCY', 4))),
+    'inference': Stage('inference', concurrency=int(os.getenv('INFERENCE_CONCURRENCY', 1))),
+    'vector': Stage('vector', concurrency=int(os.getenv('VECTOR_CONCURRENCY', 8))),
+}
+
+upload_rate_limiter = UserRateLimiter(
+    limit=int(os.getenv('UPLOAD_RATE_LIMIT', 10)),
+    window=float(os.getenv('UPLOAD_RATE_WINDOW_SECONDS', 60)),
+)
+
+
+def upload_deadline():
+    return time.monotonic() + UPLOAD_DEADLINE_SECONDS
+
+
+def admission_stats():
+    return {
+        "stages": {name: stage.stats() for name, stage in upload_stages.items()},
+        "rate_limit": upload_rate_limiter.stats(),
+    }
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import timedelta
+
+import requests
+from bson import ObjectId
+from pymongo import ReplaceOne
+
+from controllers.mongo_database import items, items_archive, cleanup_tasks
+from controllers.metrics_controller import span, log_event
+from controllers.cleanup_controller import utc_now, enqueue_cleanup, acquire_job_lease, wait_for_claimed_tasks
+from controllers.etag_controller import bump_match_owners
+from controllers.feed_cache import feed_cache
+from controllers.duplicate_detection import duplicate_detector
+from controllers.tenant_controller import tenant_of
+from controllers.vector_compression import pack_vector, unpack_vector
+from controllers.pinecone_database import (
+    fetch_lost_items_description_in_pinecone_database,
+    fetch_found_items_description_in_pinecone_database,
+    fetch_lost_items_image_in_pinecone_database,
+    fetch_found_items_image_in_pinecone_database,
+    upsert_lost_items_description_in_pinecone_database,
+    upsert_found_items_description_in_pinecone_database,
+    upsert_lost_items_image_in_pinecone_database,
+    upsert_found_items_image_in_pinecone_database,
+)
+
+# Cold tier. Items that were uploaded more than ARCHIVE_AFTER_DAYS ago, or
+# marked resolved more than ARCHIVE_RESOLVED_AFTER_DAYS ago, move to
+# items_archive and their vectors leave the hot indexes, so nearest-neighbour
+# search and the feed only ever see the live set. ARCHIVE_MAX_HOT_ITEMS caps
+# the live set outright by archiving the oldest items beyond it.
+#
+# The archived copy keeps its vectors (quantized, ARCHIVE_VECTOR_DTYPE), so a
+# restore puts the item back without re-embedding. The Cloudinary image is
+# left in place.
+
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', 180))
+ARCHIVE_RESOLVED_AFTER_DAYS = float(os.getenv('ARCHIVE_RESOLVED_AFTER_DAYS', 7))
+ARCHIVE_MAX_HOT_ITEMS = int(os.getenv('ARCHIVE_MAX_HOT_ITEMS', 0))  # 0 means no cap
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 200))
+ARCHIVE_VECTOR_DTYPE = os.getenv('ARCHIVE_VECTOR_DTYPE', 'float16').lower()
+# 0 disables the scheduled run (use archive_items.py instead)
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv('ARCHIVE_INTERVAL_SECONDS', 24 * 3600))
+ARCHIVE_CHECK_SECONDS = 300
+
+
+def _not_recently_restored(current):
+    # A restored item gets a fresh ARCHIVE_AFTER_DAYS before it can be archived again
+    return {'restoredAt': {'$not': {'$gte': current - timedelta(days=ARCHIVE_AFTER_DAYS)}}}
+
+
+def archive_query():
+    current = utc_now()
+    return {'$or': [
+        {'_id': {'$lt': ObjectId.from_datetime(current - timedelta(days=ARCHIVE_AFTER_DAYS))}, **_not_recently_restored(current)},
+        {'resolved': True, 'resolvedAt': {'$lt': current - timedelta(days=ARCHIVE_RESOLVED_AFTER_DAYS)}},
+    ]}
+
+
+def _by_tenant_and_state(batch):
+    groups = {}
+    for item in batch:
+        groups.setdefault((item.get('tenant'), item['state']), []).append(str(item['_id']))
+    return groups
+
+
+def _fetch_vectors(batch):
+    vectors = {}
+    for (tenant, state), item_ids in _by_tenant_and_state(batch).items():
+        if state:
+            fetch_text, fetch_image = fetch_lost_items_description_in_pinecone_database, fetch_lost_items_image_in_pinecone_database
+        else:
+            fetch_text, fetch_image = fetch_found_items_description_in_pinecone_database, fetch_found_items_image_in_pinecone_database
+        for modality, fetched in (('text', fetch_text(tenant, item_ids)), ('image', fetch_image(tenant, item_ids))):
+            for item_id, values in fetched.items():
+                vectors.setdefault(item_id, {})[modality] = pack_vector(values, ARCHIVE_VECTOR_DTYPE)
+    return vectors
+
+
+async def archive_items(batch, reason):
+    if not batch:
+        return 0
+    with span('archive_batch'):
+        vectors = await asyncio.to_thread(_fetch_vectors, batch)
+        archived_at = utc_now()
+        await items_archive.bulk_write([
+            ReplaceOne(
+                {'_id': item['_id']},
+                {**item, 'archivedAt': archived_at, 'archiveReason': reason, 'vectors': vectors.get(str(item['_id']), {})},
+                upsert=True
+            )
+            for item in batch
+        ], ordered=False)
+        await items.delete_many({'_id': {'$in': [item['_id'] for item in batch]}})
+        for item in batch:
+            feed_cache.discard(item['_id'])
+            duplicate_detector.forget(item['_id'])
+        await duplicate_detector.rehome(batch)
+        await bump_match_owners([str(item['_id']) for item in batch], [item.get('owner_mail') for item in batch])
+        for (tenant, state), item_ids in _by_tenant_and_state(batch).items():
+            await enqueue_cleanup(item_ids, state=state, vectors=True, tenant=tenant, reason='archived')
+    return len(batch)
+
+
+async def run_archive(dry_run=False):
+    """
+    Archive everything that is due, ARCHIVE_BATCH_SIZE items at a time.
+    Returns the number of items archived (or due, with dry_run).
+    """
+    counts = {'stale': 0, 'over_cap': 0}
+    query = archive_query()
+    if dry_run:
+        counts['stale'] = await items.count_documents(query)
+    else:
+        while True:
+            batch = await items.find(query).sort('_id', 1).to_list(ARCHIVE_BATCH_SIZE)
+            counts['stale'] += await archive_items(batch, 'stale')
+            if len(batch) < ARCHIVE_BATCH_SIZE:
+                break
+
+    if ARCHIVE_MAX_HOT_ITEMS:
+        excess = await items.count_documents({}) - ARCHIVE_MAX_HOT_ITEMS
+        if dry_run:
+            counts['over_cap'] = max(0, excess)
+        while not dry_run and excess > 0:
+            batch = await items.find(_not_recently_restored(utc_now())).sort('_id', 1).to_list(min(excess, ARCHIVE_BATCH_SIZE))
+            if not batch:
+                break
+            archived = await archive_items(batch, 'over_cap')
+            counts['over_cap'] += archived
+            excess -= archived
+
+    log_event('archive_done', dry_run=dry_run, **counts)
+    return counts
+
+
+def _download(url):
+    response = requests.get(url, timeout=30)
+    response.raise_for_status()
+    return response.content
+
+
+async def _embed_again(item):
+    # Only for items archived without vectors (e.g. the upsert had failed)
+    from controllers.pinecone_controller import get_text_embedding, get_image_embedding
+    vectors = {'text': await get_text_embedding(item['description'])}
+    if item.get('image'):
+        try:
+            vectors['image'] = await get_image_embedding(await asyncio.to_thread(_download, item['image']))
+        except Exception as e:
+            log_event('restore_image_embedding_failed', logging.WARNING, item_id=str(item['_id']), error=str(e))
+    return vectors
+
+
+async def _upsert_restored(upserts):
+    for (tenant, state, modality), vectors in upserts.items():
+        if state:
+            upsert = upsert_lost_items_description_in_pinecone_database if modality == 'text' else upsert_lost_items_image_in_pinecone_database
+        else:
+            upsert = upsert_found_items_description_in_pinecone_database if modality == 'text' else upsert_found_items_image_in_pinecone_database
+        await asyncio.to_thread(upsert, tenant, vectors)
+
+
+async def restore_items(item_ids):
+    """
+    Move archived items back into the live set. Returns the restored ids.
+    """
+    archived = await items_archive.find(
+        {'_id': {'$in': [ObjectId(item_id) for item_id in item_ids]}}
+    ).to_list(None)
+    if not archived:
+        return []
+
+    # {(tenant, state, modality): vectors}
+    upserts = {}
+    documents = []
+    for item in archived:
+        packed = item.pop('vectors', None) or {}
+        item.pop('archivedAt', None)
+        item.pop('archiveReason', None)
+        item.pop('resolved', None)
+        item.pop('resolvedAt', None)
+        item['restoredAt'] = utc_now()
+        # Archived before tenants existed; comes back into its tenant
+        item.setdefault('tenant', tenant_of(item['owner_mail']))
+        if 'text' in packed:
+            vectors = {modality: unpack_vector(value) for modality, value in packed.items()}
+        else:
+            vectors = await _embed_again(item)
+        for modality, vector in vectors.items():
+            upserts.setdefault((item.get('tenant'), item['state'], modality), []).append((str(item['_id']), vector))
+        documents.append(item)
+
+    restored_ids = [str(item['_id']) for item in documents]
+    with span('restore_batch'):
+        # Vector deletes queued when the items were archived must not run after this
+        await cleanup_tasks.delete_many({'item_id': {'$in': restored_ids}, 'reason': 'archived', 'claim': {'$exists': False}})
+        await _upsert_restored(upserts)
+        await items.bulk_write([ReplaceOne({'_id': item['_id']}, item, upsert=True) for item in documents], ordered=False)
+        await items_archive.delete_many({'_id': {'$in': [item['_id'] for item in documents]}})
+        # A worker that claimed one of them before the items were back may
+        # still delete the vectors; it skips restored items from now on, so
+        # once it is done the vectors are upserted again
+        if await wait_for_claimed_tasks(restored_ids, 'archived'):
+            await _upsert_restored(upserts)
+        await cleanup_tasks.delete_many({'item_id': {'$in': restored_ids}, 'reason': 'archived', 'claim': {'$exists': False}})
+        for item in documents:
+            feed_cache.put(item)
+        await bump_match_owners(restored_ids, [item.get('owner_mail') for item in documents])
+    return restored_ids
+
+
+class ArchiveJob:
+    """
+    Runs run_archive every ARCHIVE_INTERVAL_SECONDS in one of the workers.
+    """
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self._task = None
+
+    async def start(self):
+        if ARCHIVE_INTERVAL_SECONDS:
+            await items.create_index('resolvedAt', sparse=True)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                if await acquire_job_lease('archive_items', ARCHIVE_INTERVAL_SECONDS, self.worker_id):
+                    await run_archive()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_event('archive_failed', logging.ERROR, error=str(e))
+            await asyncio.sleep(min(ARCHIVE_CHECK_SECONDS, ARCHIVE_INTERVAL_SECONDS))
+
+
+archive_job = ArchiveJob()
@@ -0,0 +1,352 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import cloudinary.api
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from controllers.mongo_database import items, items_archive, cleanup_tasks, job_leases
+from controllers.metrics_controller import span, log_event
+from controllers.etag_controller import match_references, bump_user_versions
+from controllers.image_derivatives import image_public_ids, item_id_of
+from controllers.tenant_controller import TENANT_DOMAINS
+from controllers.pinecone_database import (
+    delete_lost_items_description_in_pinecone_database,
+    delete_found_items_description_in_pinecone_database,
+    delete_lost_items_image_in_pinecone_database,
+    delete_found_items_image_in_pinecone_database,
+    list_lost_items_description_ids_in_pinecone_database,
+    list_found_items_description_ids_in_pinecone_database,
+    list_lost_items_image_ids_in_pinecone_database,
+    list_found_items_image_ids_in_pinecone_database,
+)
+
+# Outbox for everything that has to go once an item is gone: its vectors, its
+# Cloudinary image and references to it in other items' matches. Requests
+# only write the task; CleanupWorker drains the outbox in batches, so one
+# multi-id delete per index and one Cloudinary call cover many items, and
+# failures are retried instead of leaving ghost matches behind.
+#
+# Task: {item_id, state (True lost / False found / None both), vectors,
+#        image, matches, tenant (the vectors' namespace), reason, attempts,
+#        availableAt, claim}
+
+CLEANUP_BATCH_SIZE = int(os.getenv('CLEANUP_BATCH_SIZE', 100))
+CLEANUP_POLL_SECONDS = float(os.getenv('CLEANUP_POLL_SECONDS', 5))
+CLEANUP_LEASE_SECONDS = float(os.getenv('CLEANUP_LEASE_SECONDS', 120))
+CLEANUP_MAX_BACKOFF_SECONDS = float(os.getenv('CLEANUP_MAX_BACKOFF_SECONDS', 3600))
+CLOUDINARY_DELETE_BATCH_SIZE = 100  # Cloudinary's limit per delete_resources call
+
+# 0 disables the periodic reconciliation (run reconcile_orphans.py instead)
+RECONCILE_INTERVAL_SECONDS = float(os.getenv('RECONCILE_INTERVAL_SECONDS', 6 * 3600))
+# Leave young ids alone so in-flight uploads are never mistaken for orphans
+RECONCILE_GRACE_SECONDS = float(os.getenv('RECONCILE_GRACE_SECONDS', 600))
+
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+
+async def enqueue_cleanup(item_ids, state=None, vectors=False, image=False, matches=False, tenant=None, reason='delete'):
+    if not item_ids:
+        return
+    current = utc_now()
+    await cleanup_tasks.insert_many([
+        {
+            'item_id': str(item_id),
+            'state': state,
+            'vectors': vectors,
+            'image': image,
+            'matches': matches,
+            'tenant': tenant,
+            'reason': reason,
+            'attempts': 0,
+            'availableAt': current,
+        }
+        for item_id in item_ids
+    ])
+    cleanup_worker.wake()
+
+
+_deferred = set()
+
+
+async def _enqueue_logged(item_ids, **kwargs):
+    try:
+        await enqueue_cleanup(item_ids, **kwargs)
+    except Exception as e:
+        log_event('cleanup_enqueue_failed', logging.ERROR, item_ids=[str(item_id) for item_id in item_ids], error=str(e))
+
+
+def defer_cleanup(item_ids, **kwargs):
+    """
+    enqueue_cleanup without making the caller wait for the write. If the
+    process dies first, reconcile_orphans still finds what was left behind.
+    """
+    task = asyncio.create_task(_enqueue_logged(item_ids, **kwargs))
+    _deferred.add(task)
+    task.add_done_callback(_deferred.discard)
+
+
+async def acquire_job_lease(name, seconds, owner):
+    """
+    True if this process may run job `name` now, at most once per `seconds`
+    across all workers.
+    """
+    current = utc_now()
+    try:
+        await job_leases.find_one_and_update(
+            {'_id': name, 'expiresAt': {'$lte': current}},
+            {'$set': {'expiresAt': current + timedelta(seconds=seconds), 'owner': owner}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def _chunks(values, size):
+    return [values[start:start + size] for start in range(0, len(values), size)]
+
+
+def _delete_images(public_ids):
+    with span('cloudinary_delete_batch', service='cloudinary'):
+        cloudinary.api.delete_resources(public_ids)
+
+
+async def _pull_matches(item_ids):
+    references = match_references(item_ids)
+    with span('mongo_pull_matches', service='mongo'):
+        owners = await items.distinct('owner_mail', {'matches': {'$in': references}})
+        await items.update_many({'matches': {'$in': references}}, {'$pull': {'matches': {'$in': references}}})
+    await bump_user_versions(owners)
+
+
+async def _restored(tasks):
+    # Archived items that were restored since, their vectors are live again
+    archived = [ObjectId(task['item_id']) for task in tasks if task.get('reason') == 'archived']
+    if not archived:
+        return set()
+    return {str(item['_id']) for item in await items.find({'_id': {'$in': archived}}, {'_id': 1}).to_list(None)}
+
+
+async def wait_for_claimed_tasks(item_ids, reason, timeout=CLEANUP_LEASE_SECONDS):
+    """
+    Wait until no worker runs a claimed task of item_ids any more. Returns
+    True if one was running.
+    """
+    query = {'item_id': {'$in': [str(item_id) for item_id in item_ids]}, 'reason': reason, 'claim': {'$exists': True}}
+    deadline = time.monotonic() + timeout
+    waited = False
+    # A claim whose lease ran out belongs to a worker that died
+    while await cleanup_tasks.count_documents({**query, 'availableAt': {'$gt': utc_now()}}) and time.monotonic() < deadline:
+        waited = True
+        await asyncio.sleep(0.1)
+    return waited
+
+
+async def run_cleanup_tasks(tasks):
+    restored = await _restored(tasks)
+    # {(tenant, state): ids}, one delete per namespace and index
+    vector_ids = {}
+    for task in tasks:
+        if task.get('vectors') and task['item_id'] not in restored:
+            for state in ((True, False) if task.get('state') is None else (task['state'],)):
+                vector_ids.setdefault((task.get('tenant'), state), []).append(task['item_id'])
+    image_ids = sorted({public_id for task in tasks if task.get('image') for public_id in image_public_ids(task['item_id'])})
+    match_ids = sorted({task['item_id'] for task in tasks if task.get('matches')})
+
+    steps = []
+    for (tenant, state), ids in vector_ids.items():
+        if state:
+            steps.append(asyncio.to_thread(delete_lost_items_description_in_pinecone_database, tenant, ids))
+            steps.append(asyncio.to_thread(delete_lost_items_image_in_pinecone_database, tenant, ids))
+        else:
+            steps.append(asyncio.to_thread(delete_found_items_description_in_pinecone_database, tenant, ids))
+            steps.append(asyncio.to_thread(delete_found_items_image_in_pinecone_database, tenant, ids))
+    for chunk in _chunks(image_ids, CLOUDINARY_DELETE_BATCH_SIZE):
+        steps.append(asyncio.to_thread(_delete_images, chunk))
+    if match_ids:
+        steps.append(_pull_matches(match_ids))
+
+    # Every step is idempotent, so a failed batch is simply retried as a whole
+    for result in await asyncio.gather(*steps, return_exceptions=True):
+        if isinstance(result, BaseException):
+            raise result
+
+
+class CleanupWorker:
+    """
+    Drains the cleanup outbox in the background of every API worker. Tasks
+    are claimed with a lease, so several workers can drain concurrently and
+    a task held by a crashed worker becomes available again.
+    """
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self._task = None
+        self._wake = None
+
+    async def start(self):
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if _deferred:
+            await asyncio.gather(*_deferred, return_exceptions=True)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _claim(self):
+        current = utc_now()
+        due = {'availableAt': {'$lte': current}}
+        candidates = await cleanup_tasks.find(due, {'_id': 1}).sort('availableAt', 1).to_list(CLEANUP_BATCH_SIZE)
+        if not candidates:
+            return []
+        claim = f"{self.worker_id}:{uuid.uuid4().hex}"
+        await cleanup_tasks.update_many(
+            {'_id': {'$in': [candidate['_id'] for candidate in candidates]}, **due},
+            {'$set': {'availableAt': current + timedelta(seconds=CLEANUP_LEASE_SECONDS), 'claim': claim}}
+        )
+        return await cleanup_tasks.find({'claim': claim}).to_list(None)
+
+    async def drain_once(self):
+        tasks = await self._claim()
+        if not tasks:
+            return 0
+        task_ids = [task['_id'] for task in tasks]
+        try:
+            with span('cleanup_batch'):
+                await run_cleanup_tasks(tasks)
+        except Exception as e:
+            attempts = max(task.get('attempts', 0) for task in tasks) + 1
+            backoff = min(CLEANUP_MAX_BACKOFF_SECONDS, CLEANUP_POLL_SECONDS * 2 ** attempts)
+            await cleanup_tasks.update_many(
+                {'_id': {'$in': task_ids}},
+                {'$inc': {'attempts': 1}, '$set': {'availableAt': utc_now() + timedelta(seconds=backoff), 'lastError': str(e)},
+                 '$unset': {'claim': ''}}
+            )
+            log_event('cleanup_batch_failed', logging.WARNING, tasks=len(tasks), attempts=attempts, error=str(e))
+            return 0
+        await cleanup_tasks.delete_many({'_id': {'$in': task_ids}})
+        log_event('cleanup_batch_done', logging.DEBUG, tasks=len(tasks))
+        return len(tasks)
+
+    async def _run(self):
+        while True:
+            drained = 0
+            try:
+                drained = await self.drain_once()
+                if RECONCILE_INTERVAL_SECONDS and await acquire_job_lease(
+                        'reconcile_orphans', RECONCILE_INTERVAL_SECONDS, self.worker_id):
+                    await reconcile_orphans()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_event('cleanup_worker_failed', logging.WARNING, error=str(e))
+            if drained == CLEANUP_BATCH_SIZE:
+                continue  # more tasks are probably waiting
+            try:
+                await asyncio.wait_for(self._wake.wait(), CLEANUP_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+
+cleanup_worker = CleanupWorker()
+
+
+async def _iterate_pages(pages):
+    # Pinecone's list() is a blocking generator; pull each page in a thread
+    while True:
+        page = await asyncio.to_thread(next, pages, None)
+        if page is None:
+            return
+        yield list(page)
+
+
+def _old_enough(ids, cutoff):
+    return [item_id for item_id in ids if ObjectId.is_valid(item_id) and ObjectId(item_id) < cutoff]
+
+
+async def _missing_items(item_ids, query=None, collection=items):
+    existing = await collection.find(
+        {'_id': {'$in': [ObjectId(item_id) for item_id in item_ids]}, **(query or {})}, {'_id': 1}
+    ).to_list(None)
+    existing_ids = {str(item['_id']) for item in existing}
+    return [item_id for item_id in item_ids if item_id not in existing_ids]
+
+
+async def _not_queued(item_ids):
+    queued = set(await cleanup_tasks.distinct('item_id', {'item_id': {'$in': item_ids}}))
+    return [item_id for item_id in item_ids if item_id not in queued]
+
+
+async def reconcile_orphans(dry_run=False):
+    """
+    Diff the vector ids and Cloudinary public_ids against the items collection
+    (and items_archive, for images) and queue cleanup for the ones whose item
+    is gone (or, for vectors, sits on the other side or in another tenant).
+    Returns the orphan counts.
+    """
+    cutoff = ObjectId.from_datetime(utc_now() - timedelta(seconds=RECONCILE_GRACE_SECONDS))
+    counts = {'lost_vectors': 0, 'found_vectors': 0, 'images': 0}
+
+    with span('reconcile_orphans'):
+        for state, key, list_functions in (
+            (True, 'lost_vectors', (list_lost_items_description_ids_in_pinecone_database, list_lost_items_image_ids_in_pinecone_database)),
+            (False, 'found_vectors', (list_found_items_description_ids_in_pinecone_database, list_found_items_image_ids_in_pinecone_database)),
+        ):
+            # The default namespace holds the vectors of items not migrated to a tenant yet
+            for tenant in TENANT_DOMAINS + [None]:
+                query = {'state': state, 'tenant': tenant if tenant else {'$exists': False}}
+                for list_ids in list_functions:
+                    async for page in _iterate_pages(await asyncio.to_thread(list_ids, tenant)):
+                        orphans = await _missing_items(_old_enough(page, cutoff), query)
+                        if orphans and not dry_run:
+                            orphans = await _not_queued(orphans)
+                            await enqueue_cleanup(orphans, state=state, vectors=True, tenant=tenant, reason='orphan')
+                        counts[key] += len(orphans)
+
+        next_cursor = None
+        while True:
+            with span('cloudinary_list', service='cloudinary'):
+                listing = await asyncio.to_thread(
+                    cloudinary.api.resources, type='upload', max_results=500, next_cursor=next_cursor
+                )
+            # Derivatives (<item id>_thumb, ...) belong to the item they were made from
+            public_ids = list(dict.fromkeys(item_id_of(resource['public_id']) for resource in listing.get('resources', [])))
+            orphans = await _missing_items(_old_enough(public_ids, cutoff))
+            if orphans:
+                # Archived items keep their image
+                orphans = await _missing_items(orphans, collection=items_archive)
+            if orphans and not dry_run:
+                orphans = await _not_queued(orphans)
+                await enqueue_cleanup(orphans, image=True, reason='orphan')
+            counts['images'] += len(orphans)
+            next_cursor = listing.get('next_cursor')
+            if not next_cursor:
+                break
+
+    log_event('reconcile_orphans_done', dry_run=dry_run, **counts)
+    return counts
+
+
+async def cleanup_stats():
+    return {
+        "pending": await cleanup_tasks.count_documents({}),
+        "retrying": await cleanup_tasks.count_documents({'attempts': {'$gt': 0}}),
+    }
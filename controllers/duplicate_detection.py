@@ -0,0 +1,368 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from datetime import timedelta
+from itertools import combinations
+
+import numpy as np
+from bson import ObjectId
+from PIL import Image, ImageOps
+
+from controllers.mongo_database import items
+from controllers.metrics_controller import Counter, log_event
+from controllers.image_derivatives import decode_image
+from controllers.cleanup_controller import utc_now
+from controllers.etag_controller import bump_user_versions
+from controllers.feed_cache import feed_cache
+
+# Near-duplicate photos (the same picture re-cropped, re-compressed or
+# reposted by someone else) are caught before they are embedded. Every
+# upload gets a 64-bit perceptual hash, stored on the item as image_hash, and
+# each worker keeps the hashes of the last DUPLICATE_WINDOW items in a
+# multi-index: the hash is cut into DUPLICATE_HASH_CHUNKS parts with a table
+# each. Two hashes at most DUPLICATE_MAX_DISTANCE bits apart agree on at
+# least one part up to DUPLICATE_MAX_DISTANCE // chunks bits, so a lookup
+# probes a few hundred buckets instead of comparing against every hash.
+# Hashes uploaded through other workers are picked up every
+# DUPLICATE_REFRESH_SECONDS; candidates are checked against the hash stored
+# on the item, so a photo edited through another worker is not matched on
+# its old hash.
+#
+# DUPLICATE_POLICY:
+#   collapse  a repost of one of the user's own items is refused, on
+#             upload and on image edits; a found item reusing someone
+#             else's photo is kept, pointing at the original with
+#             duplicate_of, but is not embedded, indexed or matched (the
+#             lost items it would match already match the original). A lost
+#             item is always matched on its own, so a lost copy of someone
+#             else's photo is only flagged
+#   flag      duplicates only get duplicate_of, the upload runs as usual
+#   off       no hashing and no lookups
+#
+# When an original is deleted or archived, its oldest copy becomes the
+# original and the other copies point at it. A found copy was never
+# embedded, so it is marked embed_pending and the next worker to wake up
+# embeds and matches it (through embed_copy, which the app sets).
+
+DUPLICATE_POLICY = os.getenv('DUPLICATE_POLICY', 'collapse').lower()
+DUPLICATE_HASH = os.getenv('DUPLICATE_HASH', 'phash').lower()  # or dhash
+DUPLICATE_MAX_DISTANCE = int(os.getenv('DUPLICATE_MAX_DISTANCE', 8))
+DUPLICATE_HASH_CHUNKS = int(os.getenv('DUPLICATE_HASH_CHUNKS', 4))  # 1, 2, 4 or 8
+DUPLICATE_WINDOW = int(os.getenv('DUPLICATE_WINDOW', 50000))
+DUPLICATE_REFRESH_SECONDS = float(os.getenv('DUPLICATE_REFRESH_SECONDS', 30))
+# How long a worker may take to embed a promoted copy before another retries it
+DUPLICATE_EMBED_LEASE_SECONDS = float(os.getenv('DUPLICATE_EMBED_LEASE_SECONDS', 300))
+
+duplicate_uploads = Counter(
+    'duplicate_uploads_total', 'Uploads whose photo duplicates a recent item, by what was done.', ('action',))
+
+
+def _pack(bits):
+    return int(np.packbits(bits.astype(np.uint8)).view('>u8')[0])
+
+
+def dhash(image):
+    # Whether each pixel is brighter than its right neighbour, on a 9x8 thumbnail
+    small = np.asarray(image.convert('L').resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    return _pack((small[:, 1:] > small[:, :-1]).flatten())
+
+
+_DCT = np.cos(np.pi * np.outer(np.arange(32), 2 * np.arange(32) + 1) / 64)
+
+
+def phash(image):
+    # The lowest 8x8 DCT frequencies of a 32x32 thumbnail against their median
+    small = np.asarray(image.convert('L').resize((32, 32), Image.Resampling.LANCZOS), dtype=np.float64)
+    low = (_DCT @ small @ _DCT.T)[:8, :8].flatten()
+    return _pack(low > np.median(low[1:]))
+
+
+HASH_FUNCTIONS = {'phash': phash, 'dhash': dhash}
+
+
+def decode_and_hash(image_bytes):
+    """
+    decode_image plus the perceptual hash of the result (None with
+    DUPLICATE_POLICY=off). Blocking, for a worker thread.
+    """
+    image = decode_image(image_bytes)
+    if DUPLICATE_POLICY == 'off':
+        return image, None
+    return image, HASH_FUNCTIONS[DUPLICATE_HASH](ImageOps.exif_transpose(image))
+
+
+def hash_to_hex(value):
+    # Stored as text: Mongo integers are signed 64-bit
+    return None if value is None else format(value, '016x')
+
+
+class HashIndex:
+    """
+    Multi-index hashing over 64-bit hashes, holding the `capacity` most
+    recently added ones. Entries carry a key (tenant, state) and only match
+    hashes with the same key.
+    """
+
+    def __init__(self, max_distance, chunks, capacity):
+        self.max_distance = max_distance
+        self.chunks = chunks
+        self.bits = 64 // chunks
+        self.capacity = capacity
+        self.entries = OrderedDict()  # item id -> (hash, key)
+        self.tables = [{} for _ in range(chunks)]
+        radius = max_distance // chunks
+        self.masks = [sum(1 << bit for bit in flipped)
+                      for distance in range(radius + 1) for flipped in combinations(range(self.bits), distance)]
+
+    def _parts(self, value):
+        mask = (1 << self.bits) - 1
+        return [(value >> (chunk * self.bits)) & mask for chunk in range(self.chunks)]
+
+    def add(self, item_id, value, key):
+        self.discard(item_id)
+        self.entries[item_id] = (value, key)
+        for table, part in zip(self.tables, self._parts(value)):
+            table.setdefault(part, set()).add(item_id)
+        while len(self.entries) > self.capacity:
+            self.discard(next(iter(self.entries)))
+
+    def discard(self, item_id):
+        entry = self.entries.pop(item_id, None)
+        if entry is None:
+            return
+        for table, part in zip(self.tables, self._parts(entry[0])):
+            bucket = table[part]
+            bucket.discard(item_id)
+            if not bucket:
+                del table[part]
+
+    def lookup(self, value, key):
+        """
+        [(distance, item id)] of the hashes within max_distance, nearest first.
+        """
+        candidates = set()
+        for table, part in zip(self.tables, self._parts(value)):
+            for mask in self.masks:
+                bucket = table.get(part ^ mask)
+                if bucket:
+                    candidates.update(bucket)
+        found = []
+        for item_id in candidates:
+            other, other_key = self.entries[item_id]
+            distance = (value ^ other).bit_count()
+            if other_key == key and distance <= self.max_distance:
+                found.append((distance, item_id))
+        return sorted(found)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class DuplicateDetector:
+    def __init__(self):
+        self.index = HashIndex(DUPLICATE_MAX_DISTANCE, DUPLICATE_HASH_CHUNKS, DUPLICATE_WINDOW)
+        self.embed_copy = None  # async (item) -> None, set by the app
+        self._last_id = None
+        self._task = None
+        self._wake = None
+
+    @property
+    def enabled(self):
+        return DUPLICATE_POLICY != 'off'
+
+    async def start(self):
+        self._wake = asyncio.Event()
+        if self.enabled:
+            try:
+                await self.refresh()
+            except Exception as e:
+                log_event('duplicate_index_refresh_failed', logging.WARNING, error=str(e))
+        # Even with the policy off, copies collapsed before still get promoted
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    def remember(self, item):
+        if self.enabled and item.get('image_hash'):
+            self.index.add(str(item['_id']), int(item['image_hash'], 16), (item.get('tenant'), item['state']))
+
+    def forget(self, item_id):
+        self.index.discard(str(item_id))
+
+    async def refresh(self):
+        # Newest first, so the first run loads only the last DUPLICATE_WINDOW
+        query = {'image_hash': {'$exists': True}}
+        if self._last_id is not None:
+            query['_id'] = {'$gt': self._last_id}
+        recent = await items.find(query, {'image_hash': 1, 'tenant': 1, 'state': 1}).sort('_id', -1).to_list(DUPLICATE_WINDOW)
+        for item in reversed(recent):
+            self.remember(item)
+        if recent:
+            self._last_id = recent[0]['_id']
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), DUPLICATE_REFRESH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                if self.enabled:
+                    await self.refresh()
+                await self.embed_pending()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_event('duplicate_index_refresh_failed', logging.WARNING, error=str(e))
+
+    async def rehome(self, removed):
+        """
+        Give the copies of items that left the live set a new original: the
+        oldest copy, marked embed_pending if it is a found one. Returns the
+        ids of the promoted copies.
+        """
+        original_ids = [str(item['_id']) for item in removed if item.get('image_hash') and not item.get('duplicate_of')]
+        if not original_ids:
+            return []
+        copies = await items.find(
+            {'duplicate_of': {'$in': original_ids}}, {'duplicate_of': 1, 'state': 1, 'owner_mail': 1}
+        ).sort('_id', 1).to_list(None)
+        by_original = {}
+        for copy in copies:
+            by_original.setdefault(copy['duplicate_of'], []).append(copy)
+        promoted = []
+        for heir, *others in by_original.values():
+            update = {'$unset': {'duplicate_of': ''}}
+            if not heir['state']:
+                update['$set'] = {'embed_pending': True}
+            await items.update_one({'_id': heir['_id']}, update)
+            if others:
+                await items.update_many({'_id': {'$in': [copy['_id'] for copy in others]}}, {'$set': {'duplicate_of': str(heir['_id'])}})
+            promoted.append(str(heir['_id']))
+        if not promoted:
+            return []
+        log_event('duplicate_copies_promoted', originals=len(by_original), copies=len(copies))
+        await bump_user_versions({copy['owner_mail'] for copy in copies})
+        await feed_cache.refresh([copy['_id'] for copy in copies])
+        self.wake()
+        return promoted
+
+    async def embed_pending(self):
+        """
+        Embed and match the copies rehome marked, whichever process
+        promoted them. Each is claimed for DUPLICATE_EMBED_LEASE_SECONDS, a
+        failed one is retried once the claim runs out. Returns the number
+        embedded.
+        """
+        if self.embed_copy is None:
+            return 0
+        embedded = 0
+        while True:
+            current = utc_now()
+            copy = await items.find_one_and_update(
+                {'$or': [{'embed_pending': True},
+                         {'embed_pending': {'$lt': current - timedelta(seconds=DUPLICATE_EMBED_LEASE_SECONDS)}}]},
+                {'$set': {'embed_pending': current}}
+            )
+            if copy is None:
+                return embedded
+            try:
+                await self.embed_copy(copy)
+            except Exception as e:
+                log_event('duplicate_copy_embed_failed', logging.WARNING, item_id=str(copy['_id']), error=str(e))
+                continue
+            await items.update_one({'_id': copy['_id'], 'embed_pending': current}, {'$unset': {'embed_pending': ''}})
+            await bump_user_versions([copy['owner_mail']])
+            await feed_cache.refresh([copy['_id']])
+            embedded += 1
+
+    async def find(self, image_hash, tenant, state, exclude=None):
+        """
+        The live items whose photo image_hash duplicates, nearest first.
+        """
+        if image_hash is None:
+            return []
+        nearest = [(distance, item_id) for distance, item_id in self.index.lookup(image_hash, (tenant, state)) if item_id != exclude]
+        if not nearest:
+            return []
+        existing = {
+            str(item['_id']): item
+            for item in await items.find(
+                {'_id': {'$in': [ObjectId(item_id) for _, item_id in nearest]}},
+                {'owner_mail': 1, 'duplicate_of': 1, 'image_hash': 1, 'tenant': 1, 'state': 1}
+            ).to_list(None)
+        }
+        duplicates = []
+        for _, item_id in nearest:
+            item = existing.get(item_id)
+            if item is None or not item.get('image_hash'):
+                # Deleted, archived or without a photo since
+                self.index.discard(item_id)
+                continue
+            stored = int(item['image_hash'], 16)
+            entry = self.index.entries.get(item_id)
+            if entry is None or entry[0] != stored:
+                # The photo was edited through another worker
+                self.remember(item)
+            distance = (image_hash ^ stored).bit_count()
+            if distance <= DUPLICATE_MAX_DISTANCE:
+                duplicates.append({**item, 'distance': distance})
+        return sorted(duplicates, key=lambda item: item['distance'])
+
+    async def check(self, image_hash, tenant, state, owner_mail):
+        """
+        Apply DUPLICATE_POLICY to an upload. Returns (action, original):
+        action is None, 'rejected', 'collapsed' or 'flagged' and original
+        the item it duplicates.
+        """
+        duplicates = await self.find(image_hash, tenant, state)
+        if not duplicates:
+            return None, None
+        action, original = duplicate_action(duplicates, state, owner_mail)
+        duplicate_uploads.inc(action=action)
+        log_event('duplicate_upload', action=action, original=str(original['_id']), distance=original['distance'])
+        return action, original
+
+    async def check_edit(self, image_hash, tenant, state, owner_mail, item_id):
+        """
+        The user's own item that a new photo for item_id reposts, or None.
+        Other duplicates are let through: the edited item is embedded with
+        its new photo either way.
+        """
+        duplicates = await self.find(image_hash, tenant, state, exclude=item_id)
+        action, original = duplicate_action(duplicates, state, owner_mail) if duplicates else (None, None)
+        if action != 'rejected':
+            return None
+        duplicate_uploads.inc(action=action)
+        log_event('duplicate_edit', action=action, item_id=item_id, original=str(original['_id']), distance=original['distance'])
+        return original
+
+
+def duplicate_action(duplicates, state, owner_mail):
+    own = [item for item in duplicates if item['owner_mail'] == owner_mail]
+    if DUPLICATE_POLICY == 'collapse' and own:
+        return 'rejected', own[0]
+    if DUPLICATE_POLICY == 'collapse' and not state:
+        return 'collapsed', duplicates[0]
+    return 'flagged', duplicates[0]
+
+
+def original_id(item):
+    # Copies of a copy point at the first upload
+    return str(item.get('duplicate_of') or item['_id'])
+
+
+duplicate_detector = DuplicateDetector()
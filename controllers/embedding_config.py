@@ -0,0 +1,18 @@
+import os
+
+# 'separate': ViT-base for images (768-d) and MiniLM for descriptions (384-d)
+# 'clip': a single CLIP model embedding images and descriptions into one
+#         shared space, which also allows text <-> image (cross-modal) matching
+EMBEDDING_MODE = os.getenv('EMBEDDING_MODE', 'separate').lower()
+
+CLIP_MODEL_NAME = os.getenv('CLIP_MODEL_NAME', 'openai/clip-vit-base-patch32')
+CLIP_DIMENSION = int(os.getenv('CLIP_DIMENSION', 512))
+
+if EMBEDDING_MODE == 'clip':
+    TEXT_DIMENSION = CLIP_DIMENSION
+    IMAGE_DIMENSION = CLIP_DIMENSION
+    CROSS_MODAL_MATCHING = True
+else:
+    TEXT_DIMENSION = 384
+    IMAGE_DIMENSION = 768
+    CROSS_MODAL_MATCHING = False
@@ -0,0 +1,70 @@
+import hashlib
+import json
+
+from bson import ObjectId
+from starlette.responses import Response
+
+from controllers.mongo_database import users, items
+
+# Conditional GETs for the per-user read endpoints. Every user document
+# carries a `version` counter that is bumped whenever that user's items, or
+# the matches shown to them, change. The counter comes for free with the
+# users.find_one every endpoint already does for auth, so a request whose
+# If-None-Match still matches is answered with a 304 before any item query.
+
+
+def match_references(item_ids):
+    # Matches hold ids as strings or ObjectIds depending on how they were recorded
+    item_ids = [str(item_id) for item_id in item_ids]
+    return item_ids + [ObjectId(item_id) for item_id in item_ids if ObjectId.is_valid(item_id)]
+
+
+async def bump_user_versions(mails):
+    mails = list({mail for mail in mails if mail})
+    if mails:
+        await users.update_many({'mail': {'$in': mails}}, {'$inc': {'version': 1}})
+
+
+async def bump_match_owners(item_ids, extra_mails=()):
+    """
+    Bump the owners of every item whose matches reference item_ids (their
+    match lists and notifications show those items), plus extra_mails.
+    """
+    mails = set(extra_mails)
+    if item_ids:
+        mails.update(await items.distinct('owner_mail', {'matches': {'$in': match_references(item_ids)}}))
+    await bump_user_versions(mails)
+
+
+def user_etag(user, route, *parts):
+    key = json.dumps([route, str(user['_id']), user.get('version', 0), *parts], default=str)
+    return f'W/"{hashlib.blake2b(key.encode(), digest_size=12).hexdigest()}"'
+
+
+def content_etag(payload):
+    key = json.dumps(payload, sort_keys=True, default=str)
+    return f'W/"{hashlib.blake2b(key.encode(), digest_size=12).hexdigest()}"'
+
+
+def _opaque(tag):
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def etag_matches(request, etag):
+    # Weak comparison, as If-None-Match requires
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return _opaque(etag) in {_opaque(tag) for tag in header.split(',')}
+
+
+def not_modified(etag):
+    return Response(status_code=304, headers={'ETag': etag, 'Cache-Control': 'private, no-cache'})
+
+
+def set_etag(response, etag):
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'private, no-cache'
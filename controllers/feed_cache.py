@@ -0,0 +1,230 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from bisect import bisect_left
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from controllers.mongo_database import items
+from controllers.metrics_controller import Counter, Gauge, log_event
+
+# /getItems is the same query for everyone on a campus: the tenant's items
+# in _id order, minus the caller's own. Each worker keeps the first
+# FEED_CACHE_SIZE items of every tenant as a window of already serialized
+# JSON, drops the caller's items in memory and serves a page from it as long
+# as the window reaches that far; deeper pages still go to Mongo. Concurrent
+# misses share one fetch.
+#
+# The window is the head of the feed rather than the newest items because
+# the feed pages oldest first with skip: page 1 is the oldest items, which
+# is where every client starts. Serving page n from the newest items would
+# need the number of the caller's own items before the window, a count per
+# caller. New uploads to a tenant with more items than the window land on
+# pages past it and are read from Mongo.
+#
+# Uploads, edits and deletes through this worker update the window right
+# away. With FEED_CACHE_INVALIDATION=mongo every worker also tails the items
+# collection with a change stream (needs a replica set, as on Atlas), so
+# writes through other workers and background jobs (matches, thumbnails,
+# archiving) show up as well; otherwise those are picked up when the window
+# expires after FEED_CACHE_TTL_SECONDS.
+
+FEED_CACHE_SIZE = int(os.getenv('FEED_CACHE_SIZE', 500))  # 0 disables the cache
+FEED_CACHE_TTL_SECONDS = float(os.getenv('FEED_CACHE_TTL_SECONDS', 30))
+FEED_CACHE_INVALIDATION = os.getenv('FEED_CACHE_INVALIDATION', 'local').lower()
+
+feed_cache_reads = Counter(
+    'feed_cache_reads_total', 'Feed pages by how they were served: hit, miss, coalesced or fallback (Mongo).', ('result',))
+
+
+def serialize_item(item):
+    # Encoded the way FastAPI encodes the uncached response (datetimes as ISO
+    # 8601 and so on), then dumped with JSONResponse's settings
+    return json.dumps(
+        jsonable_encoder({**item, '_id': str(item['_id'])}), ensure_ascii=False, allow_nan=False, separators=(',', ':')
+    ).encode('utf-8')
+
+
+class FeedWindow:
+    """
+    The first items of one tenant in _id order. complete when that is all
+    of them.
+    """
+
+    def __init__(self, tenant_items, complete, size):
+        self.ids = [item['_id'] for item in tenant_items]
+        self.owners = [item['owner_mail'] for item in tenant_items]
+        self.serialized = [serialize_item(item) for item in tenant_items]
+        self.complete = complete
+        self.size = size
+        self.expires = time.monotonic() + FEED_CACHE_TTL_SECONDS
+
+    def put(self, item):
+        position = bisect_left(self.ids, item['_id'])
+        if position < len(self.ids) and self.ids[position] == item['_id']:
+            self.owners[position] = item['owner_mail']
+            self.serialized[position] = serialize_item(item)
+            return
+        # Past the end of a partial window: not part of it
+        if position == len(self.ids) and not self.complete:
+            return
+        self.ids.insert(position, item['_id'])
+        self.owners.insert(position, item['owner_mail'])
+        self.serialized.insert(position, serialize_item(item))
+        if len(self.ids) > self.size:
+            del self.ids[-1], self.owners[-1], self.serialized[-1]
+            self.complete = False
+
+    def discard(self, item_id):
+        # A shorter window is still the first items of the tenant
+        position = bisect_left(self.ids, item_id)
+        if position < len(self.ids) and self.ids[position] == item_id:
+            del self.ids[position], self.owners[position], self.serialized[position]
+
+    def page(self, viewer_mail, skip, limit):
+        """
+        JSON array of the page, or None when the window ends before it.
+        """
+        selected = []
+        seen = 0
+        for owner, serialized in zip(self.owners, self.serialized):
+            if owner == viewer_mail:
+                continue
+            if seen >= skip:
+                selected.append(serialized)
+                if len(selected) == limit:
+                    break
+            seen += 1
+        if len(selected) < limit and not self.complete:
+            return None
+        return b'[' + b','.join(selected) + b']'
+
+
+class FeedCache:
+    def __init__(self, collection, size):
+        self.collection = collection
+        self.size = size
+        self.windows = {}  # tenant -> FeedWindow
+        self._loading = {}  # tenant -> fetch in flight
+        self._pending = {}  # tenant -> writes seen while its fetch runs
+        self._task = None
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    async def start(self):
+        if self.enabled and FEED_CACHE_INVALIDATION == 'mongo':
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def page(self, tenant, viewer_mail, skip, limit):
+        """
+        The serialized feed page, or None if it has to come from Mongo.
+        """
+        if not self.enabled:
+            return None
+        window = self.windows.get(tenant)
+        if window is not None and window.expires > time.monotonic():
+            result = 'hit'
+        else:
+            result = 'coalesced' if tenant in self._loading else 'miss'
+            window = await self._load(tenant)
+        page = window.page(viewer_mail, skip, limit)
+        feed_cache_reads.inc(result='fallback' if page is None else result)
+        return page
+
+    async def _load(self, tenant):
+        fetch = self._loading.get(tenant)
+        if fetch is None:
+            fetch = asyncio.ensure_future(self._fetch(tenant))
+            self._loading[tenant] = fetch
+            fetch.add_done_callback(lambda _: self._loading.pop(tenant, None))
+        # Shielded: one caller going away must not cancel the fetch for the others
+        return await asyncio.shield(fetch)
+
+    async def _fetch(self, tenant):
+        pending = self._pending[tenant] = []
+        try:
+            # One extra item tells whether the window holds the whole tenant
+            tenant_items = await self.collection.find({'tenant': tenant}).sort('_id', 1).to_list(self.size + 1)
+        finally:
+            del self._pending[tenant]
+        window = FeedWindow(tenant_items[:self.size], len(tenant_items) <= self.size, self.size)
+        # Writes that raced the fetch may or may not be in it, applying them again is harmless
+        for write, argument in pending:
+            getattr(window, write)(argument)
+        self.windows[tenant] = window
+        return window
+
+    def put(self, item):
+        tenant = item.get('tenant')
+        if tenant in self._pending:
+            self._pending[tenant].append(('put', item))
+        if tenant in self.windows:
+            self.windows[tenant].put(item)
+
+    def discard(self, item_id):
+        item_id = ObjectId(item_id)
+        for pending in self._pending.values():
+            pending.append(('discard', item_id))
+        for window in self.windows.values():
+            window.discard(item_id)
+
+    async def refresh(self, item_ids):
+        """
+        Re-read items after a write and update the windows: changed ones
+        are replaced, missing ones removed.
+        """
+        if not self.enabled or not item_ids:
+            return
+        item_ids = [ObjectId(item_id) for item_id in item_ids]
+        try:
+            found = {item['_id']: item for item in await self.collection.find({'_id': {'$in': item_ids}}).to_list(None)}
+        except Exception as e:
+            # Served stale until the window expires
+            log_event('feed_cache_refresh_failed', logging.WARNING, error=str(e))
+            return
+        for item_id in item_ids:
+            if item_id in found:
+                self.put(found[item_id])
+            else:
+                self.discard(item_id)
+
+    async def _watch(self):
+        pipeline = [{'$match': {'operationType': {'$in': ['insert', 'update', 'replace', 'delete']}}}]
+        resume_token = None
+        while True:
+            try:
+                async with self.collection.watch(pipeline, full_document='updateLookup', resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        if change.get('fullDocument') is None:
+                            # Deleted, or already gone by the time of the lookup
+                            self.discard(change['documentKey']['_id'])
+                        else:
+                            self.put(change['fullDocument'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Changes may have been missed meanwhile
+                self.windows.clear()
+                log_event('feed_change_stream_interrupted', logging.WARNING, error=str(e))
+                await asyncio.sleep(1)
+
+
+feed_cache = FeedCache(items, FEED_CACHE_SIZE)
+
+Gauge('feed_cache_window_items', 'Items held in each tenant\'s cached feed window.', ('tenant',),
+      lambda: [((tenant,), len(window.ids)) for tenant, window in feed_cache.windows.items()])
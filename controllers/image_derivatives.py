@@ -0,0 +1,176 @@
+import asyncio
+import io
+import logging
+import math
+import os
+
+import cloudinary.uploader
+import numpy as np
+from bson import ObjectId
+from PIL import Image, ImageOps
+
+from controllers.mongo_database import items
+from controllers.metrics_controller import span, log_event
+from controllers.admission_controller import upload_stages
+from controllers.etag_controller import bump_match_owners
+
+# Smaller copies of every uploaded photo for the list views: a thumbnail and
+# a medium size in WebP, hosted next to the original as <item id>_thumb and
+# <item id>_medium, plus a BlurHash string stored on the item that clients
+# render while the thumbnail loads. They are made from the same decoded
+# image the embedding uses, in a worker thread. backfill_derivatives.py
+# fills them in for items uploaded before this existed.
+
+DERIVATIVE_SIZES = {
+    'thumb': int(os.getenv('IMAGE_THUMB_SIZE', 320)),
+    'medium': int(os.getenv('IMAGE_MEDIUM_SIZE', 1024)),
+}
+# The item field each derivative's URL is stored in
+DERIVATIVE_FIELDS = {'thumb': 'thumbnail', 'medium': 'image_medium'}
+WEBP_QUALITY = int(os.getenv('IMAGE_WEBP_QUALITY', 75))
+BLURHASH_COMPONENTS = (4, 3)
+
+_pending = set()
+
+
+def decode_image(image_bytes):
+    """
+    Decode an upload to RGB, no larger than the medium size: nothing
+    downstream needs more (the models see 224px). JPEGs are decoded straight
+    at a reduced DCT scale, so a phone photo never exists at full resolution.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    medium = DERIVATIVE_SIZES['medium']
+    image.draft('RGB', (medium, medium))
+    image = image.convert('RGB')
+    image.thumbnail((medium, medium))
+    return image
+
+
+def derivative_public_id(item_id, name):
+    return f"{item_id}_{name}"
+
+
+def image_public_ids(item_id):
+    """
+    Everything hosted for an item: the original and its derivatives.
+    """
+    return [str(item_id)] + [derivative_public_id(item_id, name) for name in DERIVATIVE_SIZES]
+
+
+def item_id_of(public_id):
+    return public_id.rsplit('_', 1)[0] if public_id.rsplit('_', 1)[-1] in DERIVATIVE_SIZES else public_id
+
+
+def _webp(image, size):
+    resized = image.copy()
+    resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    resized.save(buffer, format='WEBP', quality=WEBP_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+# BlurHash (https://blurha.sh): a few DCT components of the image, base83 encoded
+
+_BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+
+def _base83(value, length):
+    return ''.join(_BASE83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def _srgb_to_linear(values):
+    values = values / 255
+    return np.where(values <= 0.04045, values / 12.92, ((values + 0.055) / 1.055) ** 2.4)
+
+
+def _linear_to_srgb(value):
+    value = min(max(value, 0.0), 1.0)
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash(image, components=BLURHASH_COMPONENTS):
+    components_x, components_y = components
+    small = image.copy()
+    small.thumbnail((32, 32))
+    pixels = _srgb_to_linear(np.asarray(small, dtype=np.float64))
+    height, width = pixels.shape[:2]
+
+    factors = []
+    for j in range(components_y):
+        for i in range(components_x):
+            basis = np.outer(np.cos(np.pi * j * np.arange(height) / height), np.cos(np.pi * i * np.arange(width) / width))
+            scale = 1 if i == j == 0 else 2
+            factors.append(scale * (pixels * basis[..., None]).sum(axis=(0, 1)) / (width * height))
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83(components_x - 1 + (components_y - 1) * 9, 1)
+    if ac:
+        quantised_max = int(min(max(math.floor(max(np.abs(factor).max() for factor in ac) * 166 - 0.5), 0), 82))
+        max_value = (quantised_max + 1) / 166
+    else:
+        quantised_max, max_value = 0, 1
+    result += _base83(quantised_max, 1)
+    result += _base83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+    for factor in ac:
+        r, g, b = (
+            int(min(max(math.floor(math.copysign(abs(value / max_value) ** 0.5, value) * 9 + 9.5), 0), 18))
+            for value in factor
+        )
+        result += _base83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+def make_derivatives(image):
+    """
+    Returns ({name: webp bytes}, blurhash) for a decoded image.
+    """
+    with span('image_derivatives'):
+        image = ImageOps.exif_transpose(image)
+        return {name: _webp(image, size) for name, size in DERIVATIVE_SIZES.items()}, blurhash(image)
+
+
+def _upload(data, public_id):
+    with span('cloudinary_upload_derivative', service='cloudinary'):
+        return cloudinary.uploader.upload(data, public_id=public_id, format='webp').get('secure_url')
+
+
+async def _host(data, public_id):
+    async with upload_stages['image_host'].slot():
+        return await asyncio.to_thread(_upload, data, public_id)
+
+
+async def store_derivatives(item_id, image):
+    """
+    Generate, host and record the derivatives of one item. Failures are only
+    logged; the item keeps working with the original image and a backfill
+    picks it up later. Returns the fields set on the item, or None.
+    """
+    try:
+        encoded, placeholder = await asyncio.to_thread(make_derivatives, image)
+        urls = await asyncio.gather(*(_host(data, derivative_public_id(item_id, name)) for name, data in encoded.items()))
+        fields = {DERIVATIVE_FIELDS[name]: url for name, url in zip(encoded, urls)}
+        fields['blurhash'] = placeholder
+        item = await items.find_one_and_update({'_id': ObjectId(item_id)}, {'$set': fields}, projection={'owner_mail': 1})
+    except Exception as e:
+        log_event('image_derivatives_failed', logging.WARNING, item_id=str(item_id), error=str(e))
+        return None
+    if item is not None:
+        try:
+            # Cached lists (ETags) of the owner and of whoever it is matched with now show the thumbnail
+            await bump_match_owners([str(item_id)], [item['owner_mail']])
+        except Exception as e:
+            log_event('image_derivatives_version_bump_failed', logging.WARNING, item_id=str(item_id), error=str(e))
+    return fields
+
+
+def start_derivatives(item_id, image):
+    """
+    store_derivatives as a task that runs alongside the rest of the upload.
+    """
+    task = asyncio.create_task(store_derivatives(item_id, image))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+    return task
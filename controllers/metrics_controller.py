@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Minimal Prometheus text-format metrics, kept in-process so no extra
+# dependency is needed. Observations may come from worker threads
+# (asyncio.to_thread), hence the lock.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_registry = []
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for key, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels -> [bucket counts..., sum, count]
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with _lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for key, series in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, ("le", bound))} {count}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, ("le", "+Inf"))} {series[-1]}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}')
+        return lines
+
+
+class Gauge:
+    """
+    Gauge whose samples are read from collect() at scrape time; collect
+    returns a list of (labelvalues, value) pairs.
+    """
+
+    def __init__(self, name, documentation, labelnames, collect):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        _registry.append(self)
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        for key, value in self.collect():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+def render_metrics():
+    lines = []
+    with _lock:
+        for metric in _registry:
+            if not isinstance(metric, Gauge):
+                lines.extend(metric.expose())
+    for metric in _registry:
+        if isinstance(metric, Gauge):
+            lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+
+request_latency = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route.', ('method', 'route', 'status'))
+stage_latency = Histogram(
+    'stage_duration_seconds', 'Latency of individual pipeline stages.', ('stage',))
+external_calls = Counter(
+    'external_calls_total', 'Calls to external services.', ('service', 'operation'))
+external_errors = Counter(
+    'external_call_errors_total', 'Failed calls to external services.', ('service', 'operation'))
+
+
+@contextmanager
+def span(stage, service=None):
+    """
+    Time a block of code as stage. When service is given (mongo, cloudinary,
+    pinecone, expo, ...) the block also counts as one call to that service,
+    and as an error if it raises. Works in sync code and around awaits.
+    """
+    started = time.perf_counter()
+    if service is not None:
+        external_calls.inc(service=service, operation=stage)
+    try:
+        yield
+    except BaseException:
+        if service is not None:
+            external_errors.inc(service=service, operation=stage)
+        raise
+    finally:
+        stage_latency.observe(time.perf_counter() - started, stage=stage)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _build_logger():
+    log = logging.getLogger('reclaimit')
+    if not log.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter())
+        log.addHandler(handler)
+        log.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+        log.propagate = False
+    return log
+
+
+logger = _build_logger()
+
+
+def log_event(event, level=logging.INFO, **fields):
+    logger.log(level, event, extra={'fields': fields})
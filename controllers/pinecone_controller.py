@@ -1,32 +1,98 @@
-from transformers import ViTImageProcessor, ViTModel
+from transformers import ViTImageProcessor, ViTModel, CLIPModel, CLIPProcessor
 from sentence_transformers import SentenceTransformer
 from PIL import Image
 import torch
-import io
+import asyncio
+from controllers.metrics_controller import span
+from controllers.embedding_config import EMBEDDING_MODE, CLIP_MODEL_NAME
+from controllers.vector_compression import compress_text_embeddings, compress_image_embeddings
+from controllers.image_derivatives import decode_image
 
-# Load Model & Processor once globally (optional for performance)
-model = ViTModel.from_pretrained("google/vit-base-patch16-224-in21k")
-image_processor = ViTImageProcessor.from_pretrained("google/vit-base-patch16-224-in21k")
+if EMBEDDING_MODE == 'clip':
+    # One model for both modalities
+    clip_model = CLIPModel.from_pretrained(CLIP_MODEL_NAME).eval()
+    clip_processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+else:
+    # Load Model & Processor once globally (optional for performance)
+    model = ViTModel.from_pretrained("google/vit-base-patch16-224-in21k")
+    image_processor = ViTImageProcessor.from_pretrained("google/vit-base-patch16-224-in21k")
 
-# Load model once globally (for performance)
-text_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+    # Load model once globally (for performance)
+    text_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
 
-async def get_image_embedding(image_bytes: bytes):
+def _compute_clip_image_embeddings(images):
+    with span('clip_preprocess'):
+        inputs = clip_processor(images=images, return_tensors="pt")
+    with span('clip_image_embedding'), torch.no_grad():
+        features = clip_model.get_image_features(**inputs)
+    return torch.nn.functional.normalize(features, dim=-1).numpy()  # Shape: (batch, 512)
 
-    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
 
-    # Process image
-    inputs = image_processor(images=image, return_tensors="pt")
+def _compute_clip_text_embeddings(texts):
+    with span('clip_text_embedding'), torch.no_grad():
+        inputs = clip_processor(text=texts, padding=True, truncation=True, return_tensors="pt")
+        features = clip_model.get_text_features(**inputs)
+    return torch.nn.functional.normalize(features, dim=-1).numpy()
 
-    # Generate embedding using ViT
-    with torch.no_grad():
+
+def _compute_image_embeddings(images):
+
+    # Raw uploads or images already decoded with decode_image
+    with span('image_decode'):
+        images = [image if isinstance(image, Image.Image) else decode_image(image) for image in images]
+
+    if EMBEDDING_MODE == 'clip':
+        return _compute_clip_image_embeddings(images)
+
+    # Process images
+    with span('vit_preprocess'):
+        inputs = image_processor(images=images, return_tensors="pt")
+
+    # Generate embeddings using ViT, one forward pass for the whole batch
+    with span('vit_embedding'), torch.no_grad():
         outputs = model(**inputs)
 
     # Extract CLS token as embedding
-    embedding = outputs.last_hidden_state[:, 0, :]  # Shape: (1, 768)
-    return embedding.squeeze().tolist()
+    return outputs.last_hidden_state[:, 0, :].numpy()  # Shape: (batch, 768)
+
+
+def _compute_image_embedding(image):
+    return _compute_image_embeddings([image])[0]
+
+
+def _compute_text_embeddings(texts):
+    if EMBEDDING_MODE == 'clip':
+        return _compute_clip_text_embeddings(texts)
+    with span('minilm_embedding'):
+        return text_model.encode(texts, batch_size=max(1, len(texts)))
+
+
+def _compute_text_embedding(text: str):
+    if EMBEDDING_MODE == 'clip':
+        return _compute_clip_text_embeddings([text])[0]
+    with span('minilm_embedding'):
+        return text_model.encode(text)
+
+
+# Inference runs in a worker thread so the event loop keeps serving other requests.
+# Embeddings are returned as float32 numpy arrays, projected to the index
+# dimension when a reducer is configured (see vector_compression.py).
+
+async def get_image_embedding(image):
+    embedding = await asyncio.to_thread(_compute_image_embedding, image)
+    return compress_image_embeddings(embedding)
+
+
+async def get_image_embeddings(images):
+    embeddings = await asyncio.to_thread(_compute_image_embeddings, images)
+    return compress_image_embeddings(embeddings)
 
 
 async def get_text_embedding(text: str):
-    embedding = text_model.encode(text)
-    return embedding.squeeze().tolist()
+    embedding = await asyncio.to_thread(_compute_text_embedding, text)
+    return compress_text_embeddings(embedding)
+
+
+async def get_text_embeddings(texts):
+    embeddings = await asyncio.to_thread(_compute_text_embeddings, texts)
+    return compress_text_embeddings(embeddings)
@@ -1,125 +1,334 @@
 import jwt
 from pinecone import Pinecone, ServerlessSpec
 import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from bson import ObjectId
-
-pinecone_ref = Pinecone(api_key=os.getenv('PINECONE_API'))
+from controllers.metrics_controller import span, log_event
+from controllers.embedding_config import EMBEDDING_MODE, CROSS_MODAL_MATCHING
+from controllers.vector_compression import TEXT_INDEX_DIMENSION, IMAGE_INDEX_DIMENSION
 
 lost_index_name_text = os.getenv('LOST_INDEX_NAME_TEXT')
 found_index_name_text = os.getenv('FOUND_INDEX_NAME_TEXT')
 lost_index_name_img = os.getenv('LOST_INDEX_NAME_IMG')
 found_index_name_img = os.getenv('FOUND_INDEX_NAME_IMG')
 
-my_pinecone_indexes = pinecone_ref.list_indexes()
-
-my_pinecone_indexes_names = [index["name"] for index in my_pinecone_indexes]
-
-if lost_index_name_text not in my_pinecone_indexes_names:
-    pinecone_ref.create_index(
-        name=lost_index_name_text,
-        dimension=384,  # Set according to your embedding model
-        metric="cosine",
-        spec=ServerlessSpec(cloud="aws", region="us-east-1")
-    )
-
-if found_index_name_text not in my_pinecone_indexes_names:
-    pinecone_ref.create_index(
-        name=found_index_name_text,
-        dimension=384,  # Set according to your embedding model
-        metric="cosine",
-        spec=ServerlessSpec(cloud="aws", region="us-east-1")
-    )
-
-if lost_index_name_img not in my_pinecone_indexes_names:
-    pinecone_ref.create_index(
-        name=lost_index_name_img,
-        dimension=768,  # Set according to your embedding model
-        metric="cosine",
-        spec=ServerlessSpec(cloud="aws", region="us-east-1")
-    )
-
-if found_index_name_img not in my_pinecone_indexes_names:
-    pinecone_ref.create_index(
-        name=found_index_name_img,
-        dimension=768,  # Set according to your embedding model
-        metric="cosine",
-        spec=ServerlessSpec(cloud="aws", region="us-east-1")
-    )
-
-lost_index_text_ref = pinecone_ref.Index(lost_index_name_text)
-found_index_text_ref = pinecone_ref.Index(found_index_name_text)
-lost_index_img_ref = pinecone_ref.Index(lost_index_name_img)
-found_index_img_ref = pinecone_ref.Index(found_index_name_img)
+if EMBEDDING_MODE == 'clip':
+    # CLIP vectors live in their own indexes so both pipelines can run side by
+    # side while existing items are re-embedded (see migrate_embeddings.py)
+    lost_index_name_text = os.getenv('CLIP_LOST_INDEX_NAME_TEXT', f"{lost_index_name_text}-clip")
+    found_index_name_text = os.getenv('CLIP_FOUND_INDEX_NAME_TEXT', f"{found_index_name_text}-clip")
+    lost_index_name_img = os.getenv('CLIP_LOST_INDEX_NAME_IMG', f"{lost_index_name_img}-clip")
+    found_index_name_img = os.getenv('CLIP_FOUND_INDEX_NAME_IMG', f"{found_index_name_img}-clip")
+
+# Nothing here talks to Pinecone at import time. The client, the indexes and
+# their handles are set up by init_pinecone() when the app starts (in the
+# background, with retries) or, failing that, by the first call that needs
+# an index. PINECONE_CLIENT=grpc uses the gRPC transport (pip install
+# "pinecone[grpc]"), which has less per-request overhead than HTTP.
+PINECONE_CLIENT = os.getenv('PINECONE_CLIENT', 'http').lower()
+PINECONE_INIT_ATTEMPTS = int(os.getenv('PINECONE_INIT_ATTEMPTS', 5))
+PINECONE_INIT_BACKOFF_SECONDS = float(os.getenv('PINECONE_INIT_BACKOFF_SECONDS', 1))
+# Neighbours taken per query when matching an item, i.e. how many candidates
+# a single modality can notify (see benchmarks/retrieval_eval.py)
+MATCH_TOP_K = int(os.getenv('MATCH_TOP_K', 5))
+
+INDEX_SPECS = {
+    'lost_text': (lost_index_name_text, TEXT_INDEX_DIMENSION),
+    'found_text': (found_index_name_text, TEXT_INDEX_DIMENSION),
+    'lost_img': (lost_index_name_img, IMAGE_INDEX_DIMENSION),
+    'found_img': (found_index_name_img, IMAGE_INDEX_DIMENSION),
+}
+
+_pinecone_ref = None
+_index_refs = {}
+_bootstrap_lock = threading.Lock()
+
+
+def get_pinecone():
+    global _pinecone_ref
+    if _pinecone_ref is None:
+        if PINECONE_CLIENT == 'grpc':
+            from pinecone.grpc import PineconeGRPC
+            _pinecone_ref = PineconeGRPC(api_key=os.getenv('PINECONE_API'))
+        else:
+            _pinecone_ref = Pinecone(api_key=os.getenv('PINECONE_API'))
+    return _pinecone_ref
+
+
+def create_index_if_missing(name, dimension, existing_names=None):
+    pinecone_ref = get_pinecone()
+    if existing_names is None:
+        existing_names = [index["name"] for index in pinecone_ref.list_indexes()]
+    if name not in existing_names:
+        pinecone_ref.create_index(
+            name=name,
+            dimension=dimension,  # Set according to your embedding model
+            metric="cosine",
+            spec=ServerlessSpec(cloud="aws", region="us-east-1")
+        )
+
+
+def bootstrap_pinecone():
+    """
+    Create missing indexes and open a handle for each one. Blocking.
+    """
+    with _bootstrap_lock:
+        if len(_index_refs) == len(INDEX_SPECS):
+            return
+        pinecone_ref = get_pinecone()
+        with span('pinecone_bootstrap', service='pinecone'):
+            existing_names = [index["name"] for index in pinecone_ref.list_indexes()]
+            for key, (name, dimension) in INDEX_SPECS.items():
+                create_index_if_missing(name, dimension, existing_names)
+                _index_refs[key] = pinecone_ref.Index(name)
+
+
+def pinecone_ready():
+    return len(_index_refs) == len(INDEX_SPECS)
+
+
+async def init_pinecone():
+    for attempt in range(1, PINECONE_INIT_ATTEMPTS + 1):
+        try:
+            await asyncio.to_thread(bootstrap_pinecone)
+            log_event('pinecone_ready', client=PINECONE_CLIENT, attempts=attempt)
+            return
+        except Exception as e:
+            log_event('pinecone_init_failed', logging.WARNING, attempt=attempt, error=str(e))
+            if attempt == PINECONE_INIT_ATTEMPTS:
+                # Requests that need an index will retry the bootstrap themselves
+                return
+            await asyncio.sleep(PINECONE_INIT_BACKOFF_SECONDS * 2 ** (attempt - 1))
+
+
+def _index(key):
+    index_ref = _index_refs.get(key)
+    if index_ref is None:
+        bootstrap_pinecone()
+        index_ref = _index_refs[key]
+    return index_ref
+
+def lost_index_text():
+    return _index('lost_text')
+
+def found_index_text():
+    return _index('found_text')
+
+def lost_index_img():
+    return _index('lost_img')
+
+def found_index_img():
+    return _index('found_img')
 
 #querying
 
-def query_lost_item_description_in_pinecone_database(vector_embedding):
-    return lost_index_text_ref.query(vector=vector_embedding, top_k=5)
+# Every tenant (campus) has its own namespace in each index, so queries only
+# ever scan one campus's vectors. Vectors written before tenants existed sit
+# in the default namespace ('') until migrate_tenants.py moves them.
+def _namespace(tenant):
+    return tenant or ''
+
+# Embeddings are numpy arrays; upsert converts them itself but query only takes lists
+def _as_values(vector_embedding):
+    return vector_embedding.tolist() if hasattr(vector_embedding, 'tolist') else vector_embedding
 
-def query_found_item_description_in_pinecone_database(vector_embedding):
-    return found_index_text_ref.query(vector=vector_embedding, top_k=5)
+def query_lost_item_description_in_pinecone_database(tenant, vector_embedding, top_k=5):
+    with span('pinecone_query_lost_text', service='pinecone'):
+        return lost_index_text().query(vector=_as_values(vector_embedding), top_k=top_k, namespace=_namespace(tenant))
 
-def query_lost_item_image_in_pinecone_database(vector_embedding):
-    return lost_index_img_ref.query(vector=vector_embedding, top_k=5)
+def query_found_item_description_in_pinecone_database(tenant, vector_embedding, top_k=5):
+    with span('pinecone_query_found_text', service='pinecone'):
+        return found_index_text().query(vector=_as_values(vector_embedding), top_k=top_k, namespace=_namespace(tenant))
 
-def query_found_item_image_in_pinecone_database(vector_embedding):
-    return found_index_img_ref.query(vector=vector_embedding, top_k=5)
+def query_lost_item_image_in_pinecone_database(tenant, vector_embedding, top_k=5):
+    with span('pinecone_query_lost_img', service='pinecone'):
+        return lost_index_img().query(vector=_as_values(vector_embedding), top_k=top_k, namespace=_namespace(tenant))
+
+def query_found_item_image_in_pinecone_database(tenant, vector_embedding, top_k=5):
+    with span('pinecone_query_found_img', service='pinecone'):
+        return found_index_img().query(vector=_as_values(vector_embedding), top_k=top_k, namespace=_namespace(tenant))
 
 #upserting
 
-def upsert_lost_item_description_in_pinecone_database(post_id, vector_embedding):
-    lost_index_text_ref.upsert([(post_id, vector_embedding)])
+def upsert_lost_item_description_in_pinecone_database(tenant, post_id, vector_embedding):
+    with span('pinecone_upsert_lost_text', service='pinecone'):
+        lost_index_text().upsert([(post_id, vector_embedding)], namespace=_namespace(tenant))
+
+def upsert_found_item_description_in_pinecone_database(tenant, post_id, vector_embedding):
+    with span('pinecone_upsert_found_text', service='pinecone'):
+        found_index_text().upsert([(post_id, vector_embedding)], namespace=_namespace(tenant))
+
+def upsert_lost_item_image_in_pinecone_database(tenant, post_id, vector_embedding):
+    with span('pinecone_upsert_lost_img', service='pinecone'):
+        lost_index_img().upsert([(post_id, vector_embedding)], namespace=_namespace(tenant))
+
+def upsert_found_item_image_in_pinecone_database(tenant, post_id, vector_embedding):
+    with span('pinecone_upsert_found_img', service='pinecone'):
+        found_index_img().upsert([(post_id, vector_embedding)], namespace=_namespace(tenant))
+
+#batch upserting, vectors is a list of (post_id, vector_embedding)
 
-def upsert_found_item_description_in_pinecone_database(post_id, vector_embedding):
-    found_index_text_ref.upsert([(post_id, vector_embedding)])
+UPSERT_BATCH_SIZE = 100
 
-def upsert_lost_item_image_in_pinecone_database(post_id, vector_embedding):
-    lost_index_img_ref.upsert([(post_id, vector_embedding)])
+def _upsert_in_batches(index_ref, tenant, vectors):
+    for start in range(0, len(vectors), UPSERT_BATCH_SIZE):
+        index_ref.upsert(vectors[start:start + UPSERT_BATCH_SIZE], namespace=_namespace(tenant))
 
-def upsert_found_item_image_in_pinecone_database(post_id, vector_embedding):
-    found_index_img_ref.upsert([(post_id, vector_embedding)])
+def upsert_lost_items_description_in_pinecone_database(tenant, vectors):
+    with span('pinecone_upsert_lost_text_batch', service='pinecone'):
+        _upsert_in_batches(lost_index_text(), tenant, vectors)
+
+def upsert_found_items_description_in_pinecone_database(tenant, vectors):
+    with span('pinecone_upsert_found_text_batch', service='pinecone'):
+        _upsert_in_batches(found_index_text(), tenant, vectors)
+
+def upsert_lost_items_image_in_pinecone_database(tenant, vectors):
+    with span('pinecone_upsert_lost_img_batch', service='pinecone'):
+        _upsert_in_batches(lost_index_img(), tenant, vectors)
+
+def upsert_found_items_image_in_pinecone_database(tenant, vectors):
+    with span('pinecone_upsert_found_img_batch', service='pinecone'):
+        _upsert_in_batches(found_index_img(), tenant, vectors)
 
 #deleting
 
-def delete_lost_item_description_in_pinecone_database(post_id):
-    lost_index_text_ref.delete(ids=[post_id])
+def delete_lost_item_description_in_pinecone_database(tenant, post_id):
+    with span('pinecone_delete_lost_text', service='pinecone'):
+        lost_index_text().delete(ids=[post_id], namespace=_namespace(tenant))
 
-def delete_found_item_description_in_pinecone_database(post_id):
-    found_index_text_ref.delete(ids=[post_id])
+def delete_found_item_description_in_pinecone_database(tenant, post_id):
+    with span('pinecone_delete_found_text', service='pinecone'):
+        found_index_text().delete(ids=[post_id], namespace=_namespace(tenant))
 
-def delete_lost_item_image_in_pinecone_database(post_id):
-    lost_index_img_ref.delete(ids=[post_id])
+def delete_lost_item_image_in_pinecone_database(tenant, post_id):
+    with span('pinecone_delete_lost_img', service='pinecone'):
+        lost_index_img().delete(ids=[post_id], namespace=_namespace(tenant))
 
-def delete_found_item_image_in_pinecone_database(post_id):
-    found_index_img_ref.delete(ids=[post_id])
+def delete_found_item_image_in_pinecone_database(tenant, post_id):
+    with span('pinecone_delete_found_img', service='pinecone'):
+        found_index_img().delete(ids=[post_id], namespace=_namespace(tenant))
 
+#batch deleting, post_ids is a list of ids
 
-def get_matched_lost_items_id(text_embedding, image_embedding):
-    res = set()
+DELETE_BATCH_SIZE = 1000  # Pinecone's limit per delete request
 
-    matched_lost_text = query_lost_item_description_in_pinecone_database(text_embedding)
-    matched_lost_text_list = matched_lost_text.get('matches', [])
-    for match in matched_lost_text_list:
-        res.add(match['id'])
+def _delete_in_batches(index_ref, tenant, post_ids):
+    for start in range(0, len(post_ids), DELETE_BATCH_SIZE):
+        index_ref.delete(ids=post_ids[start:start + DELETE_BATCH_SIZE], namespace=_namespace(tenant))
 
-    matched_lost_image = query_lost_item_image_in_pinecone_database(image_embedding)
-    matched_lost_image_list = matched_lost_image.get('matches', [])
-    for match in matched_lost_image_list:
-        res.add(match['id'])
+def delete_lost_items_description_in_pinecone_database(tenant, post_ids):
+    with span('pinecone_delete_lost_text_batch', service='pinecone'):
+        _delete_in_batches(lost_index_text(), tenant, post_ids)
 
-    return list(res)
+def delete_found_items_description_in_pinecone_database(tenant, post_ids):
+    with span('pinecone_delete_found_text_batch', service='pinecone'):
+        _delete_in_batches(found_index_text(), tenant, post_ids)
 
-def get_matched_found_items_id(text_embedding, image_embedding):
-    res = set()
+def delete_lost_items_image_in_pinecone_database(tenant, post_ids):
+    with span('pinecone_delete_lost_img_batch', service='pinecone'):
+        _delete_in_batches(lost_index_img(), tenant, post_ids)
+
+def delete_found_items_image_in_pinecone_database(tenant, post_ids):
+    with span('pinecone_delete_found_img_batch', service='pinecone'):
+        _delete_in_batches(found_index_img(), tenant, post_ids)
 
-    matched_found_text = query_found_item_description_in_pinecone_database(text_embedding)
-    matched_found_text_list = matched_found_text.get('matches', [])
-    for match in matched_found_text_list:
-        res.add(match)
+#batch fetching, returns {post_id: values} for the ids that have a vector
 
-    matched_found_image = query_found_item_image_in_pinecone_database(image_embedding)
-    matched_found_image_list = matched_found_image.get('matches', [])
-    for match in matched_found_image_list:
-        res.add(match)
+FETCH_BATCH_SIZE = 100
 
+def _fetch_in_batches(index_ref, tenant, post_ids):
+    vectors = {}
+    for start in range(0, len(post_ids), FETCH_BATCH_SIZE):
+        fetched = index_ref.fetch(ids=post_ids[start:start + FETCH_BATCH_SIZE], namespace=_namespace(tenant)).vectors
+        vectors.update({post_id: vector.values for post_id, vector in fetched.items()})
+    return vectors
+
+def fetch_lost_items_description_in_pinecone_database(tenant, post_ids):
+    with span('pinecone_fetch_lost_text_batch', service='pinecone'):
+        return _fetch_in_batches(lost_index_text(), tenant, post_ids)
+
+def fetch_found_items_description_in_pinecone_database(tenant, post_ids):
+    with span('pinecone_fetch_found_text_batch', service='pinecone'):
+        return _fetch_in_batches(found_index_text(), tenant, post_ids)
+
+def fetch_lost_items_image_in_pinecone_database(tenant, post_ids):
+    with span('pinecone_fetch_lost_img_batch', service='pinecone'):
+        return _fetch_in_batches(lost_index_img(), tenant, post_ids)
+
+def fetch_found_items_image_in_pinecone_database(tenant, post_ids):
+    with span('pinecone_fetch_found_img_batch', service='pinecone'):
+        return _fetch_in_batches(found_index_img(), tenant, post_ids)
+
+#listing, yields pages of vector ids
+
+def list_lost_items_description_ids_in_pinecone_database(tenant):
+    return lost_index_text().list(namespace=_namespace(tenant))
+
+def list_found_items_description_ids_in_pinecone_database(tenant):
+    return found_index_text().list(namespace=_namespace(tenant))
+
+def list_lost_items_image_ids_in_pinecone_database(tenant):
+    return lost_index_img().list(namespace=_namespace(tenant))
+
+def list_found_items_image_ids_in_pinecone_database(tenant):
+    return found_index_img().list(namespace=_namespace(tenant))
+
+
+def _collect_matched_ids(*query_results):
+    res = set()
+    for query_result in query_results:
+        for match in query_result.get('matches', []):
+            res.add(match['id'])
     return list(res)
+
+def _query_both_modalities(query_text_index, query_image_index, tenant, text_embedding, image_embedding):
+    # image_embedding is None for text-only items (CLIP mode), and an edited
+    # item only passes the modality that changed. With a shared embedding
+    # space each vector is also matched against the other modality.
+    results = []
+    if text_embedding is not None:
+        results.append(query_text_index(tenant, text_embedding, MATCH_TOP_K))
+    if image_embedding is not None:
+        results.append(query_image_index(tenant, image_embedding, MATCH_TOP_K))
+    if CROSS_MODAL_MATCHING:
+        if text_embedding is not None:
+            results.append(query_image_index(tenant, text_embedding, MATCH_TOP_K))
+        if image_embedding is not None:
+            results.append(query_text_index(tenant, image_embedding, MATCH_TOP_K))
+    return _collect_matched_ids(*results)
+
+def get_matched_lost_items_id(tenant, text_embedding, image_embedding):
+    with span('match_lost_items'):
+        return _query_both_modalities(
+            query_lost_item_description_in_pinecone_database,
+            query_lost_item_image_in_pinecone_database,
+            tenant,
+            text_embedding,
+            image_embedding
+        )
+
+def get_matched_found_items_id(tenant, text_embedding, image_embedding):
+    with span('match_found_items'):
+        return _query_both_modalities(
+            query_found_item_description_in_pinecone_database,
+            query_found_item_image_in_pinecone_database,
+            tenant,
+            text_embedding,
+            image_embedding
+        )
+
+# Pinecone has no multi-vector query, so batches fan the single queries out
+# over a small thread pool instead of running them one after another
+_query_executor = ThreadPoolExecutor(max_workers=int(os.getenv('PINECONE_QUERY_THREADS', 8)))
+
+def get_matched_lost_items_ids(tenant, text_embeddings, image_embeddings):
+    with span('match_lost_items_batch'):
+        return list(_query_executor.map(partial(get_matched_lost_items_id, tenant), text_embeddings, image_embeddings))
+
+def get_matched_found_items_ids(tenant, text_embeddings, image_embeddings):
+    with span('match_found_items_batch'):
+        return list(_query_executor.map(partial(get_matched_found_items_id, tenant), text_embeddings, image_embeddings))
@@ -0,0 +1,372 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import selectors
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import Counter as Tally
+from concurrent.futures import thread as futures_thread
+
+from controllers.metrics_controller import Counter, Histogram, log_event
+from controllers.admin_controller import ADMIN_TOKEN, is_admin
+
+# Opt-in profiling for production requests.
+#
+# A request is profiled when it is picked by PROFILE_SAMPLE_RATE or carries
+# `X-Profile: 1` together with the admin token (see admin_controller). While
+# any profiled request is in flight, a sampler thread wakes every
+# PROFILE_INTERVAL_MS and records, for each profiled request, where it is:
+#   loop;...    running on the event loop (its task or a task it spawned)
+#   thread;...  running in a worker thread it started with asyncio.to_thread
+#   await;...   suspended, with the chain of coroutines it is waiting in
+# so the result is a wall-clock profile. Profiles are written as folded stacks
+# (flamegraph.pl, speedscope, inferno) to PROFILE_DIR, with a .json summary.
+#
+# Independently, LoopMonitor measures event-loop lag and logs the loop's
+# stack whenever a single callback blocks it for BLOCKING_THRESHOLD_MS.
+
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', 5))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 200))
+LOOP_MONITOR_INTERVAL_MS = float(os.getenv('LOOP_MONITOR_INTERVAL_MS', 100))  # 0 disables
+BLOCKING_THRESHOLD_MS = float(os.getenv('BLOCKING_THRESHOLD_MS', 100))
+MAX_STACK_DEPTH = 128
+
+loop_lag = Histogram(
+    'event_loop_lag_seconds', 'Delay of the event loop monitor wake-ups.', (),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+loop_blocked = Counter(
+    'event_loop_blocked_total', 'Times the event loop stalled for BLOCKING_THRESHOLD_MS, by cause.', ('kind',))
+
+_current_profile = contextvars.ContextVar('profile', default=None)
+# Tasks spawned by a profiled request, see _task_factory
+_task_profiles = weakref.WeakKeyDictionary()
+_WORK_ITEM_RUN = futures_thread._WorkItem.run.__code__
+
+
+class Profile:
+    def __init__(self, method, path, task):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.task = task
+        self.started = time.time()
+        self.samples = Tally()
+        self.blocked = []
+        self.max_loop_lag_ms = 0.0
+        self.status = None
+        self.route = None
+
+    @property
+    def name(self):
+        route = re.sub(r'[^A-Za-z0-9]+', '_', self.route or self.path).strip('_') or 'root'
+        return f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime(self.started))}-{self.method.lower()}-{route}-{self.id}"
+
+
+_labels = {}
+
+
+def _label(code):
+    label = _labels.get(code)
+    if label is None:
+        filename = code.co_filename
+        for marker in ('site-packages/', 'lib/python'):
+            if marker in filename:
+                filename = filename.split(marker, 1)[1]
+                break
+        else:
+            filename = os.path.relpath(filename) if os.path.isabs(filename) else filename
+        label = _labels[code] = f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(';', ':')
+    return label
+
+
+def _walk(frame):
+    """
+    Leaf-to-root labels of a thread's stack, plus the contextvars.Context the
+    thread is running in when it is an executor thread (asyncio.to_thread
+    runs the call through context.run).
+    """
+    labels = []
+    context = None
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        if frame.f_code is _WORK_ITEM_RUN:
+            try:
+                call = frame.f_locals['self'].fn
+                owner = getattr(getattr(call, 'func', None), '__self__', None)
+                if isinstance(owner, contextvars.Context):
+                    context = owner
+            except Exception:
+                pass
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    return labels, context
+
+
+def _await_chain(task):
+    labels = []
+    try:
+        awaitable = task.get_coro()
+        while awaitable is not None and len(labels) < MAX_STACK_DEPTH:
+            frame = getattr(awaitable, 'cr_frame', None) or getattr(awaitable, 'gi_frame', None)
+            if frame is None:
+                if not hasattr(awaitable, 'cr_frame') and not hasattr(awaitable, 'gi_frame'):
+                    labels.append(f"[{type(awaitable).__name__}]")
+                break
+            labels.append(_label(frame.f_code))
+            awaitable = getattr(awaitable, 'cr_await', None) or getattr(awaitable, 'gi_yieldfrom', None)
+    except Exception:
+        pass
+    return labels
+
+
+class Sampler:
+    """
+    One thread for all profiled requests; it only runs while there are any.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.loop_thread_id = None
+        self.active = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, profile):
+        with self._lock:
+            self.active.add(profile)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def remove(self, profile):
+        with self._lock:
+            self.active.discard(profile)
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            with self._lock:
+                if not self.active:
+                    self._wake.clear()
+                    continue
+                self._sample()
+            time.sleep(PROFILE_INTERVAL_MS / 1000)
+
+    def _sample(self):
+        sampled = set()
+        me = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            labels, context = _walk(frame)
+            if thread_id == self.loop_thread_id:
+                running = asyncio.current_task(self.loop)
+                profile = _task_profiles.get(running) if running is not None else None
+                root = 'loop'
+            else:
+                profile = context.get(_current_profile) if context is not None else None
+                root = 'thread'
+            if profile in self.active:
+                profile.samples[';'.join([root] + labels[::-1])] += 1
+                sampled.add(profile)
+        for profile in self.active - sampled:
+            profile.samples[';'.join(['await'] + _await_chain(profile.task))] += 1
+
+
+sampler = Sampler()
+
+
+def _task_factory(loop, coro, **kwargs):
+    task = asyncio.Task(coro, loop=loop, **kwargs)
+    profile = _current_profile.get()
+    if profile is not None:
+        _task_profiles[task] = profile
+    return task
+
+
+def _write_profile(profile, duration):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, profile.name)
+    with open(f"{path}.folded", 'w') as folded:
+        for stack, count in profile.samples.most_common():
+            folded.write(f"{stack} {count}\n")
+    summary = {
+        'name': profile.name,
+        'method': profile.method,
+        'path': profile.path,
+        'route': profile.route,
+        'status': profile.status,
+        'started': profile.started,
+        'duration_ms': round(duration * 1000, 2),
+        'interval_ms': PROFILE_INTERVAL_MS,
+        'samples': sum(profile.samples.values()),
+        'max_loop_lag_ms': round(profile.max_loop_lag_ms, 2),
+        'blocked': profile.blocked,
+    }
+    with open(f"{path}.json", 'w') as sidecar:
+        json.dump(summary, sidecar)
+
+    summaries = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith('.json'))
+    for name in summaries[:max(0, len(summaries) - PROFILE_KEEP)]:
+        for suffix in ('.json', '.folded'):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, name[:-len('.json')] + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(limit=50):
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted((name for name in os.listdir(PROFILE_DIR) if name.endswith('.json')), reverse=True)[:limit]:
+        try:
+            with open(os.path.join(PROFILE_DIR, name)) as sidecar:
+                profiles.append(json.load(sidecar))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def profile_path(name):
+    """
+    Path of a stored profile's folded stacks, or None.
+    """
+    if not re.fullmatch(r'[A-Za-z0-9_.-]+', name):
+        return None
+    path = os.path.join(PROFILE_DIR, name if name.endswith('.folded') else f"{name}.folded")
+    return path if os.path.isfile(path) else None
+
+
+class ProfilerMiddleware:
+    """
+    Plain ASGI middleware, so the endpoint runs in the same task and that
+    task's await chain can be sampled.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self._wanted(scope):
+            return await self.app(scope, receive, send)
+
+        profile = Profile(scope['method'], scope['path'], asyncio.current_task())
+        _task_profiles[profile.task] = profile
+        token = _current_profile.set(profile)
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                profile.status = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.remove(profile)
+            _current_profile.reset(token)
+            route = scope.get('route')
+            profile.route = getattr(route, 'path', None)
+            try:
+                await asyncio.to_thread(_write_profile, profile, time.perf_counter() - started)
+            except Exception as e:
+                log_event('profile_write_failed', logging.WARNING, error=str(e))
+
+    @staticmethod
+    def _wanted(scope):
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            return True
+        if not ADMIN_TOKEN:
+            return False
+        headers = {key.decode('latin-1'): value.decode('latin-1') for key, value in scope['headers']}
+        return headers.get('x-profile') == '1' and is_admin(headers)
+
+
+class LoopMonitor:
+    """
+    Wakes every LOOP_MONITOR_INTERVAL_MS to measure how late the loop runs
+    it. A watchdog thread notices when the wake-up is overdue by
+    BLOCKING_THRESHOLD_MS, i.e. something is holding the loop, and captures
+    the loop thread's stack while it still is.
+    """
+
+    def __init__(self):
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+        self._heartbeat = 0.0
+        self._loop_thread_id = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        sampler.loop = loop
+        sampler.loop_thread_id = self._loop_thread_id
+        if (PROFILE_SAMPLE_RATE or ADMIN_TOKEN) and loop.get_task_factory() is None:
+            loop.set_task_factory(_task_factory)
+        if not LOOP_MONITOR_INTERVAL_MS:
+            return
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        interval = LOOP_MONITOR_INTERVAL_MS / 1000
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            lag = max(0.0, time.perf_counter() - started - interval)
+            self._heartbeat = time.monotonic()
+            loop_lag.observe(lag)
+            for profile in list(sampler.active):
+                profile.max_loop_lag_ms = max(profile.max_loop_lag_ms, lag * 1000)
+
+    def _watch(self):
+        interval = LOOP_MONITOR_INTERVAL_MS / 1000
+        threshold = BLOCKING_THRESHOLD_MS / 1000
+        check = min(interval, threshold) / 2
+        blocked_since, event = None, None
+        while not self._stopped.wait(check):
+            heartbeat = self._heartbeat
+            overdue = time.monotonic() - heartbeat - interval
+            if blocked_since is None and overdue > threshold:
+                blocked_since = heartbeat
+                frame = sys._current_frames().get(self._loop_thread_id)
+                event = {'blocked_ms': round(overdue * 1000, 1), 'stack': _walk(frame)[0][:20] if frame is not None else []}
+                # Sitting in select() means no callback is running: the loop
+                # thread is waiting for the GIL held by busy worker threads
+                event['starved'] = frame is not None and frame.f_code.co_filename == selectors.__file__
+                for profile in list(sampler.active):
+                    profile.blocked.append(event)
+            elif blocked_since is not None and heartbeat != blocked_since:
+                event['blocked_ms'] = round((heartbeat - blocked_since - interval) * 1000, 1)
+                loop_blocked.inc(kind='starved' if event['starved'] else 'callback')
+                log_event('event_loop_starved' if event['starved'] else 'event_loop_blocked', logging.WARNING, **event)
+                blocked_since, event = None, None
+
+
+loop_monitor = LoopMonitor()
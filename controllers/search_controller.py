@@ -0,0 +1,91 @@
+import asyncio
+import os
+
+from controllers.cache_controller import TTLCache
+from controllers.metrics_controller import span
+from controllers.pinecone_controller import get_text_embedding
+from controllers.embedding_config import CROSS_MODAL_MATCHING
+from controllers.vector_compression import QuantizedVector, LOCAL_VECTOR_DTYPE
+from controllers.pinecone_database import (
+    query_lost_item_description_in_pinecone_database,
+    query_found_item_description_in_pinecone_database,
+    query_lost_item_image_in_pinecone_database,
+    query_found_item_image_in_pinecone_database,
+)
+
+# Popular queries ("black wallet", "airpods") repeat constantly. Embeddings
+# never change for a given text, so they are kept for long; vector search
+# results go stale as items are uploaded, so they only live briefly.
+query_embedding_cache = TTLCache(
+    maxsize=int(os.getenv('SEARCH_EMBEDDING_CACHE_SIZE', 2048)),
+    ttl=float(os.getenv('SEARCH_EMBEDDING_CACHE_TTL_SECONDS', 3600)),
+)
+search_result_cache = TTLCache(
+    maxsize=int(os.getenv('SEARCH_RESULT_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('SEARCH_RESULT_CACHE_TTL_SECONDS', 30)),
+)
+
+# Filters (owner, time window) are applied when hydrating from Mongo, so
+# fetch more candidates than requested to leave room for filtered ones
+SEARCH_OVERFETCH = int(os.getenv('SEARCH_OVERFETCH', 4))
+# Cosine similarity below which a hit is noise rather than a weak match
+SEARCH_MIN_SCORE = float(os.getenv('SEARCH_MIN_SCORE', 0.2))
+SEARCH_MAX_TOP_K = 100
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+async def embed_search_query(query):
+    cached = query_embedding_cache.get(query)
+    if cached is not None:
+        return cached.get()
+    with span('search_query_embedding'):
+        embedding = await get_text_embedding(query)
+    # Stored at reduced precision (LOCAL_VECTOR_DTYPE) to fit more queries in memory
+    query_embedding_cache.set(query, QuantizedVector(embedding, LOCAL_VECTOR_DTYPE))
+    return embedding
+
+
+async def search_descriptions(tenant, query, state, limit):
+    """
+    Return [(item_id, score)] from the description index of lost (state=True),
+    found (state=False) or both (state=None) items of one tenant, best first
+    and scoring at least SEARCH_MIN_SCORE. With a shared (CLIP) embedding
+    space the photos are searched as well.
+    """
+    top_k = min(SEARCH_MAX_TOP_K, limit * SEARCH_OVERFETCH)
+    key = (tenant, query, state, top_k)
+    matches = search_result_cache.get(key)
+    if matches is not None:
+        return matches
+
+    embedding = await embed_search_query(query)
+    query_functions = []
+    if state is None or state:
+        query_functions.append(query_lost_item_description_in_pinecone_database)
+        if CROSS_MODAL_MATCHING:
+            query_functions.append(query_lost_item_image_in_pinecone_database)
+    if state is None or not state:
+        query_functions.append(query_found_item_description_in_pinecone_database)
+        if CROSS_MODAL_MATCHING:
+            query_functions.append(query_found_item_image_in_pinecone_database)
+    results = await asyncio.gather(
+        *(asyncio.to_thread(query_function, tenant, embedding, top_k) for query_function in query_functions)
+    )
+
+    # An item can be hit through both its description and its photo; keep its best score
+    best_scores = {}
+    for result in results:
+        for match in result.get('matches', []):
+            if match['score'] < SEARCH_MIN_SCORE:
+                continue
+            best_scores[match['id']] = max(match['score'], best_scores.get(match['id'], match['score']))
+    matches = sorted(best_scores.items(), key=lambda match: match[1], reverse=True)
+    search_result_cache.set(key, matches)
+    return matches
+
+
+def search_cache_stats():
+    return {"embeddings": query_embedding_cache.stats(), "results": search_result_cache.stats()}
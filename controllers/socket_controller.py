@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import socketio
+from bson import ObjectId
+
+from controllers.mongo_database import users, match_events
+from controllers.metrics_controller import log_event
+
+# Socket.IO server mounted next to the FastAPI app (see main.asgi_app)
+socket_server = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
+
+MATCH_EVENT_TTL_SECONDS = int(os.getenv('MATCH_EVENT_TTL_SECONDS', 3600))
+
+
+def user_room(user_id):
+    return f"user:{user_id}"
+
+
+async def emit_to_user(user_id, event, data):
+    await socket_server.emit(event, data=data, room=user_room(user_id))
+
+
+@socket_server.event
+async def connect(sid, environ, auth):
+    # Clients send the same auth_token used for the REST endpoints, either in the
+    # Socket.IO auth payload or as an auth_token header.
+    auth_token = None
+    if isinstance(auth, dict):
+        auth_token = auth.get('auth_token')
+    if auth_token is None:
+        auth_token = environ.get('HTTP_AUTH_TOKEN')
+    if not auth_token:
+        raise socketio.exceptions.ConnectionRefusedError("Unauthorized Access!")
+
+    try:
+        data = jwt.decode(auth_token, os.getenv('JWT_KEY'), algorithms=["HS256"])
+        existing_user = await users.find_one({'_id': ObjectId(data['_id'])}, {'_id': 1})
+    except Exception:
+        raise socketio.exceptions.ConnectionRefusedError("Unauthorized access!")
+    if existing_user is None:
+        raise socketio.exceptions.ConnectionRefusedError("Unauthorized access!")
+
+    user_id = str(existing_user['_id'])
+    await socket_server.save_session(sid, {'user_id': user_id})
+    await socket_server.enter_room(sid, user_room(user_id))
+
+
+@socket_server.event
+async def disconnect(sid):
+    # Rooms are left automatically by the server on disconnect
+    pass
+
+
+class InProcessBroker:
+    """
+    Delivers match events straight to the sockets connected to this process.
+    Only correct when the API runs as a single worker.
+    """
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, user_id, event, data):
+        await emit_to_user(user_id, event, data)
+
+
+class MongoChangeStreamBroker:
+    """
+    Fans match events out to every worker: publishing inserts into the
+    match_events collection and each worker tails it with a change stream,
+    emitting to whichever sockets it holds locally.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._task = None
+
+    async def start(self):
+        await self._ensure_ttl_index()
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def publish(self, user_id, event, data):
+        await self.collection.insert_one({
+            'user_id': user_id,
+            'event': event,
+            'data': data,
+            'expiresAt': datetime.now(timezone.utc) + timedelta(seconds=MATCH_EVENT_TTL_SECONDS),
+        })
+
+    async def _ensure_ttl_index(self):
+        async for index in self.collection.list_indexes():
+            if "expiresAt" in index["key"]:
+                return
+        await self.collection.create_index("expiresAt", expireAfterSeconds=0)
+
+    async def _watch(self):
+        pipeline = [{'$match': {'operationType': 'insert'}}]
+        resume_token = None
+        while True:
+            try:
+                async with self.collection.watch(pipeline, resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        event = change['fullDocument']
+                        await emit_to_user(event['user_id'], event['event'], event['data'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_event('match_event_stream_interrupted', logging.WARNING, error=str(e))
+                await asyncio.sleep(1)
+
+
+def create_broker():
+    broker_name = os.getenv('NOTIFICATION_BROKER', 'local').lower()
+    if broker_name == 'mongo':
+        return MongoChangeStreamBroker(match_events)
+    return InProcessBroker()
+
+
+notification_broker = create_broker()
+
+
+async def publish_match_notification(user_id, item, matched_ids):
+    """
+    Push a match event to the owner of item. Never raises: a missed socket
+    event is recoverable through /getNotifications.
+    """
+    data = {
+        "item_id": str(item['_id']),
+        "item_name": item['name'],
+        "item_state": item['state'],
+        "matched_item_ids": [str(matched_id) for matched_id in matched_ids],
+        "message": f"Your {item['name']} has {len(matched_ids)} new possible {'match' if len(matched_ids) == 1 else 'matches'}",
+    }
+    try:
+        await notification_broker.publish(str(user_id), 'notification', data)
+    except Exception as e:
+        log_event('match_notification_publish_failed', logging.ERROR, user_id=str(user_id), error=str(e))
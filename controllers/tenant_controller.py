@@ -0,0 +1,40 @@
+import os
+import re
+
+import pymongo
+
+from controllers.mongo_database import items
+
+# Every campus is a tenant, named after its mail domain. A user belongs to
+# the tenant of their mail, and so does every item they post: the feed, the
+# search and the matching only ever look at one tenant's items, and each
+# tenant has its own namespace in the Pinecone indexes. TENANT_DOMAINS lists
+# the campuses that can register (comma separated). Items from before tenants
+# existed have no `tenant` and their vectors sit in the default namespace
+# until migrate_tenants.py moves them.
+
+TENANT_DOMAINS = [
+    domain.strip().lower()
+    for domain in os.getenv('TENANT_DOMAINS', 'srmap.edu.in').split(',')
+    if domain.strip()
+]
+
+# Same local part rules as before, with any of the allowed domains
+email_regex = r"^[a-zA-Z0-9](?:[a-zA-Z0-9._%+-]*[a-zA-Z0-9])?@(?:" + '|'.join(re.escape(domain) for domain in TENANT_DOMAINS) + r")$"
+
+
+def tenant_of(mail):
+    return mail.rsplit('@', 1)[-1].strip().lower()
+
+
+async def check_item_indexes():
+    # No-ops when they already exist
+    # The feed and the tenant window of the feed cache: one tenant's items in _id order
+    await items.create_index([('tenant', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)])
+    # A user's own items (the mail implies the tenant), in _id order
+    await items.create_index([('owner_mail', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)])
+    # Items whose matches reference an item: version bumps and the cleanup's match pull
+    await items.create_index('matches')
+    # Copies of an item that leaves the live set, see DuplicateDetector.rehome
+    await items.create_index('duplicate_of', sparse=True)
+    # (resolvedAt, for the archive job, is created by ArchiveJob.start)
@@ -0,0 +1,161 @@
+import os
+
+import numpy as np
+
+from controllers.embedding_config import EMBEDDING_MODE, TEXT_DIMENSION, IMAGE_DIMENSION
+
+# Embeddings travel through the app as float32 numpy arrays and are only
+# turned into lists by the Pinecone client when the request is serialised.
+#
+# Optionally they are projected down to fewer dimensions before they reach
+# the index (see fit_reducer.py), and vectors kept in process memory (the
+# search query cache) are stored quantized. Use benchmarks/compression_report.py
+# to pick a reduction and a storage dtype from recall@k vs size and latency.
+
+VECTOR_DTYPE = np.float32
+
+
+class ProjectionReducer:
+    """
+    Linear projection x -> (x - mean) @ components, fitted with PCA on our own
+    embeddings or drawn at random (Johnson-Lindenstrauss). Outputs are L2
+    normalised, the indexes use the cosine metric anyway.
+    """
+
+    def __init__(self, components, mean=None, method='pca'):
+        self.components = np.asarray(components, dtype=VECTOR_DTYPE)
+        self.mean = np.zeros(self.components.shape[0], dtype=VECTOR_DTYPE) if mean is None \
+            else np.asarray(mean, dtype=VECTOR_DTYPE)
+        self.method = method
+
+    @property
+    def input_dimension(self):
+        return self.components.shape[0]
+
+    @property
+    def output_dimension(self):
+        return self.components.shape[1]
+
+    @classmethod
+    def fit_pca(cls, vectors, dimension):
+        vectors = normalize(vectors)
+        if dimension > min(vectors.shape):
+            raise ValueError(f"PCA to {dimension} dimensions needs at least {dimension} vectors")
+        mean = vectors.mean(axis=0)
+        # Right singular vectors of the centred data are the principal axes
+        _, _, vt = np.linalg.svd(vectors - mean, full_matrices=False)
+        return cls(vt[:dimension].T, mean, method='pca')
+
+    @classmethod
+    def random_projection(cls, input_dimension, dimension, seed=0):
+        rng = np.random.default_rng(seed)
+        components = rng.standard_normal((input_dimension, dimension)) / np.sqrt(dimension)
+        return cls(components, method='random')
+
+    def transform(self, vectors):
+        vectors = np.asarray(vectors, dtype=VECTOR_DTYPE)
+        return normalize((vectors - self.mean) @ self.components)
+
+    def save(self, path):
+        np.savez(path, components=self.components, mean=self.mean, method=self.method)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['components'], data['mean'], str(data['method']))
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=VECTOR_DTYPE)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+# Scalar quantization for vectors we keep locally. int8 stores one scale per
+# vector (symmetric, max |x| -> 127); float16 is a plain cast.
+
+def quantize(vectors, dtype):
+    vectors = np.asarray(vectors, dtype=VECTOR_DTYPE)
+    if dtype == 'float32':
+        return vectors, None
+    if dtype == 'float16':
+        return vectors.astype(np.float16), None
+    if dtype == 'int8':
+        scale = np.abs(vectors).max(axis=-1, keepdims=True) / 127
+        scale = np.where(scale == 0, 1, scale).astype(VECTOR_DTYPE)
+        return np.round(vectors / scale).astype(np.int8), scale
+    raise ValueError(f"Unknown vector dtype {dtype}")
+
+
+def dequantize(codes, scale=None):
+    vectors = np.asarray(codes, dtype=VECTOR_DTYPE)
+    return vectors if scale is None else vectors * scale
+
+
+class QuantizedVector:
+    """
+    A single vector held in a cache at reduced precision.
+    """
+    __slots__ = ('codes', 'scale')
+
+    def __init__(self, vector, dtype):
+        self.codes, self.scale = quantize(vector, dtype)
+
+    def get(self):
+        return dequantize(self.codes, self.scale)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (0 if self.scale is None else self.scale.nbytes)
+
+
+def pack_vector(vector, dtype):
+    """
+    Quantize a vector into a BSON-friendly document (e.g. for items_archive).
+    """
+    codes, scale = quantize(vector, dtype)
+    return {'dtype': str(codes.dtype), 'values': codes.tobytes(), 'scale': None if scale is None else float(scale[0])}
+
+
+def unpack_vector(packed):
+    return dequantize(np.frombuffer(packed['values'], dtype=packed['dtype']), packed.get('scale'))
+
+
+LOCAL_VECTOR_DTYPE = os.getenv('LOCAL_VECTOR_DTYPE', 'float16').lower()
+
+
+def _load_reducer(path, input_dimension):
+    if not path:
+        return None
+    reducer = ProjectionReducer.load(path)
+    if reducer.input_dimension != input_dimension:
+        raise ValueError(f"{path} projects {reducer.input_dimension}-d vectors, "
+                         f"the {EMBEDDING_MODE} embeddings are {input_dimension}-d")
+    return reducer
+
+
+text_reducer = _load_reducer(os.getenv('TEXT_REDUCER_PATH'), TEXT_DIMENSION)
+if EMBEDDING_MODE == 'clip':
+    # Both modalities share one space, so they must share one projection too
+    image_reducer = text_reducer
+else:
+    image_reducer = _load_reducer(os.getenv('IMAGE_REDUCER_PATH'), IMAGE_DIMENSION)
+
+# What the Pinecone indexes are created with
+TEXT_INDEX_DIMENSION = text_reducer.output_dimension if text_reducer else TEXT_DIMENSION
+IMAGE_INDEX_DIMENSION = image_reducer.output_dimension if image_reducer else IMAGE_DIMENSION
+
+
+def compress_text_embeddings(embeddings):
+    """
+    (n, d) model output -> (n, TEXT_INDEX_DIMENSION) float32 array.
+    """
+    if text_reducer is not None:
+        return text_reducer.transform(embeddings)
+    return np.asarray(embeddings, dtype=VECTOR_DTYPE)
+
+
+def compress_image_embeddings(embeddings):
+    if image_reducer is not None:
+        return image_reducer.transform(embeddings)
+    return np.asarray(embeddings, dtype=VECTOR_DTYPE)
@@ -0,0 +1,126 @@
+"""
+Fit a dimensionality reduction on the vectors already in Pinecone.
+
+    python fit_reducer.py --modality text --method pca --dimension 128 --output reducers/text-pca128.npz
+
+Optionally copy the existing vectors, projected, into new indexes so nothing
+has to be re-embedded:
+
+    python fit_reducer.py ... --copy-suffix=-pca128
+
+creates <index name>-pca128 for the lost and found indexes of that modality.
+Then point LOST_/FOUND_INDEX_NAME_TEXT (or _IMG) at the new indexes and set
+TEXT_REDUCER_PATH (or IMAGE_REDUCER_PATH) to the .npz file. In CLIP mode
+both modalities share one space: fit with --modality both and only set
+TEXT_REDUCER_PATH.
+
+--export writes the sampled raw vectors to a .npy file for
+benchmarks/compression_report.py.
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import argparse
+import os
+
+import numpy as np
+
+from controllers.pinecone_database import (
+    get_pinecone, create_index_if_missing,
+    lost_index_name_text, found_index_name_text, lost_index_name_img, found_index_name_img,
+    lost_index_text, found_index_text, lost_index_img, found_index_img,
+)
+from controllers.tenant_controller import TENANT_DOMAINS
+from controllers.vector_compression import ProjectionReducer
+
+FETCH_BATCH_SIZE = 100
+# Every tenant's namespace, plus the default one for items not migrated yet
+NAMESPACES = TENANT_DOMAINS + ['']
+
+MODALITIES = {
+    'text': [(lost_index_name_text, lost_index_text), (found_index_name_text, found_index_text)],
+    'image': [(lost_index_name_img, lost_index_img), (found_index_name_img, found_index_img)],
+}
+MODALITIES['both'] = MODALITIES['text'] + MODALITIES['image']
+
+
+def iter_vectors(index_ref, namespace, limit=None):
+    """
+    Yield (id, values) pages from a namespace of an index, FETCH_BATCH_SIZE
+    at a time.
+    """
+    seen = 0
+    for ids in index_ref.list(namespace=namespace):
+        ids = list(ids)
+        for start in range(0, len(ids), FETCH_BATCH_SIZE):
+            batch = ids[start:start + FETCH_BATCH_SIZE]
+            if limit is not None:
+                batch = batch[:limit - seen]
+            if not batch:
+                return
+            fetched = index_ref.fetch(ids=batch, namespace=namespace).vectors
+            yield [(vector_id, fetched[vector_id].values) for vector_id in batch if vector_id in fetched]
+            seen += len(batch)
+
+
+def sample_vectors(indexes, sample):
+    vectors = []
+    per_index = sample // len(indexes) if sample else None
+    for name, index in indexes:
+        count = 0
+        for namespace in NAMESPACES:
+            for page in iter_vectors(index(), namespace, per_index - count if per_index else None):
+                vectors.extend(values for _, values in page)
+                count += len(page)
+        print(f"sampled {count} vectors from {name}")
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def copy_projected(indexes, reducer, suffix):
+    for name, index in indexes:
+        target_name = f"{name}{suffix}"
+        create_index_if_missing(target_name, reducer.output_dimension)
+        target_ref = get_pinecone().Index(target_name)
+        copied = 0
+        for namespace in NAMESPACES:
+            for page in iter_vectors(index(), namespace):
+                projected = reducer.transform([values for _, values in page])
+                target_ref.upsert(list(zip([vector_id for vector_id, _ in page], projected)), namespace=namespace)
+                copied += len(page)
+        print(f"copied {copied} vectors from {name} to {target_name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modality', choices=sorted(MODALITIES), required=True)
+    parser.add_argument('--method', choices=['pca', 'random'], default='pca')
+    parser.add_argument('--dimension', type=int, required=True)
+    parser.add_argument('--sample', type=int, default=20000, help='vectors to fit on, 0 for all')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--copy-suffix', help='copy projected vectors into <index><suffix>')
+    parser.add_argument('--export', help='also save the sampled raw vectors to this .npy file')
+    args = parser.parse_args()
+
+    indexes = MODALITIES[args.modality]
+    vectors = sample_vectors(indexes, args.sample)
+    if args.export:
+        np.save(args.export, vectors)
+    if args.method == 'pca':
+        reducer = ProjectionReducer.fit_pca(vectors, args.dimension)
+        centered = vectors / np.linalg.norm(vectors, axis=1, keepdims=True) - reducer.mean
+        kept = np.square(centered @ reducer.components).sum() / np.square(centered).sum()
+        print(f"PCA keeps {kept:.1%} of the variance in {args.dimension} of {vectors.shape[1]} dimensions")
+    else:
+        reducer = ProjectionReducer.random_projection(vectors.shape[1], args.dimension, args.seed)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    reducer.save(args.output)
+    print(f"saved {reducer.method} {reducer.input_dimension} -> {reducer.output_dimension} to {args.output}")
+
+    if args.copy_suffix:
+        copy_projected(indexes, reducer, args.copy_suffix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Pre-forking production launcher.
+
+    python launcher.py --workers 4 --port 8000
+
+The app (and with it the ViT and MiniLM weights) is imported once in the
+parent, then workers are forked so the weights are shared copy-on-write
+instead of being loaded once per worker. Torch/OMP/MKL intra-op threads
+are split between workers so they don't oversubscribe the cores, and each
+worker can optionally be pinned to its own slice of CPUs.
+
+Configuration comes from the command line or the environment:
+WEB_CONCURRENCY (workers), TORCH_THREADS (per worker), PIN_WORKERS,
+HOST and PORT.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+
+def available_cpus():
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def configure_threads(workers, threads=None):
+    """
+    Decide the intra-op thread count per worker and export it before torch is
+    imported, since OMP/MKL read their variables once at load time.
+    """
+    if threads is None:
+        threads = max(1, len(available_cpus()) // workers)
+    for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[name] = str(threads)
+    # Tokenizers spawn their own pool, which is unsafe to fork
+    os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+    return threads
+
+
+def cpu_slice(worker_index, workers):
+    cpus = available_cpus()
+    per_worker = max(1, len(cpus) // workers)
+    start = (worker_index * per_worker) % len(cpus)
+    return set(cpus[start:start + per_worker])
+
+
+def bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock, worker_index, workers, threads, pin_workers):
+    import uvicorn
+
+    if pin_workers and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpu_slice(worker_index, workers))
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(threads)
+
+    server = uvicorn.Server(uvicorn.Config(app, log_level='info'))
+    server.run(sockets=[sock])
+
+
+def serve(app, workers=1, host='0.0.0.0', port=8000, threads=None, pin_workers=False):
+    """
+    Fork workers that serve app on one shared listening socket, restarting
+    any worker that dies, until the parent receives SIGINT/SIGTERM.
+    """
+    threads = threads or max(1, len(available_cpus()) // workers)
+    sock = bind_socket(host, port)
+
+    # Move everything imported so far out of the GC's generations so that
+    # collections in the workers don't touch (and un-share) those pages.
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def spawn(worker_index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                run_worker(app, sock, worker_index, workers, threads, pin_workers)
+            finally:
+                os._exit(0)
+        children[pid] = worker_index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    print(f"Serving on {host}:{port} with {workers} workers x {threads} threads", flush=True)
+    for worker_index in range(workers):
+        spawn(worker_index)
+
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        worker_index = children.pop(pid, None)
+        if worker_index is not None and not stopping:
+            time.sleep(1)
+            spawn(worker_index)
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_CONCURRENCY', 1)))
+    parser.add_argument('--threads', type=int, default=int(os.getenv('TORCH_THREADS', 0)) or None,
+                        help='intra-op threads per worker (default: cores / workers)')
+    parser.add_argument('--pin-workers', action='store_true', default=os.getenv('PIN_WORKERS', '') in ('1', 'true'))
+    parser.add_argument('--host', default=os.getenv('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 8000)))
+    args = parser.parse_args()
+
+    threads = configure_threads(args.workers, args.threads)
+
+    import main as application  # loads the models once, before forking
+    serve(application.asgi_app, args.workers, args.host, args.port, threads, args.pin_workers)
+
+
+if __name__ == '__main__':
+    main()
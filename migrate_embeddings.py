@@ -0,0 +1,102 @@
+"""
+Re-embed every item with CLIP into the CLIP indexes.
+
+    python migrate_embeddings.py --batch-size 32
+
+Migration path from the separate ViT + MiniLM pipeline:
+1. run this script while the API keeps serving with EMBEDDING_MODE=separate
+   (the CLIP vectors go to their own indexes, see pinecone_database.py);
+2. re-run it with --after <last id printed> to pick up items uploaded
+   meanwhile;
+3. restart the API with EMBEDDING_MODE=clip.
+The old indexes can be deleted once the CLIP mode is live.
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import argparse
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ['EMBEDDING_MODE'] = 'clip'
+
+import requests
+from bson import ObjectId
+
+from controllers.mongo_database import items
+from controllers.pinecone_controller import get_image_embeddings, get_text_embeddings
+from controllers.pinecone_database import (
+    upsert_lost_items_description_in_pinecone_database,
+    upsert_found_items_description_in_pinecone_database,
+    upsert_lost_items_image_in_pinecone_database,
+    upsert_found_items_image_in_pinecone_database,
+)
+
+
+def download_image(url):
+    if not url:
+        return None
+    try:
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        return response.content
+    except Exception as e:
+        print(f"Unable to download {url}: {str(e)}")
+        return None
+
+
+async def migrate_batch(batch, downloader):
+    item_ids = [str(item['_id']) for item in batch]
+    text_embeddings = await get_text_embeddings([item['description'] for item in batch])
+    images = list(downloader.map(download_image, [item.get('image', '') for item in batch]))
+
+    with_image = [index for index, image_bytes in enumerate(images) if image_bytes is not None]
+    image_embeddings = {}
+    if with_image:
+        embedded = await get_image_embeddings([images[index] for index in with_image])
+        image_embeddings = dict(zip(with_image, embedded))
+
+    for state, upsert_text, upsert_image in (
+        (True, upsert_lost_items_description_in_pinecone_database, upsert_lost_items_image_in_pinecone_database),
+        (False, upsert_found_items_description_in_pinecone_database, upsert_found_items_image_in_pinecone_database),
+    ):
+        # Into the same namespace the item's current vectors are in
+        for tenant in {item.get('tenant') for item in batch if item['state'] == state}:
+            indexes = [index for index, item in enumerate(batch) if item['state'] == state and item.get('tenant') == tenant]
+            text_vectors = [(item_ids[index], text_embeddings[index]) for index in indexes]
+            image_vectors = [(item_ids[index], image_embeddings[index]) for index in indexes if index in image_embeddings]
+            if text_vectors:
+                await asyncio.to_thread(upsert_text, tenant, text_vectors)
+            if image_vectors:
+                await asyncio.to_thread(upsert_image, tenant, image_vectors)
+    return len(batch) - len(with_image)
+
+
+async def migrate(batch_size, after):
+    query = {'_id': {'$gt': ObjectId(after)}} if after else {}
+    cursor = items.find(query, {'description': 1, 'image': 1, 'state': 1, 'tenant': 1}).sort('_id', 1)
+    migrated = missing_images = 0
+    with ThreadPoolExecutor(max_workers=8) as downloader:
+        batch = []
+        async for item in cursor:
+            batch.append(item)
+            if len(batch) == batch_size:
+                missing_images += await migrate_batch(batch, downloader)
+                migrated += len(batch)
+                print(f"migrated {migrated} items, last id {batch[-1]['_id']}")
+                batch = []
+        if batch:
+            missing_images += await migrate_batch(batch, downloader)
+            migrated += len(batch)
+            print(f"migrated {migrated} items, last id {batch[-1]['_id']}")
+    print(f"done: {migrated} items re-embedded, {missing_images} without an image")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--after', help='resume after this item id')
+    args = parser.parse_args()
+    asyncio.run(migrate(args.batch_size, args.after))
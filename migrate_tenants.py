@@ -0,0 +1,108 @@
+"""
+Move items from before tenants existed into their tenant: set `tenant` from
+the owner's mail domain and move their vectors from the default Pinecone
+namespace into the tenant's namespace.
+
+    python migrate_tenants.py --dry-run
+    python migrate_tenants.py [--batch-size 100]
+
+Until an item is migrated it is left out of the feed, search and matching.
+Vectors are copied before the item is updated and deleted after, so it is
+safe to stop and re-run; migrated items are skipped.
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import argparse
+import asyncio
+
+from pymongo import UpdateOne
+
+from controllers.mongo_database import items, items_archive
+from controllers.tenant_controller import tenant_of
+from controllers.pinecone_database import (
+    fetch_lost_items_description_in_pinecone_database,
+    fetch_found_items_description_in_pinecone_database,
+    fetch_lost_items_image_in_pinecone_database,
+    fetch_found_items_image_in_pinecone_database,
+    upsert_lost_items_description_in_pinecone_database,
+    upsert_found_items_description_in_pinecone_database,
+    upsert_lost_items_image_in_pinecone_database,
+    upsert_found_items_image_in_pinecone_database,
+    delete_lost_items_description_in_pinecone_database,
+    delete_found_items_description_in_pinecone_database,
+    delete_lost_items_image_in_pinecone_database,
+    delete_found_items_image_in_pinecone_database,
+)
+
+# (state, fetch, upsert, delete) for every index
+INDEXES = [
+    (True, fetch_lost_items_description_in_pinecone_database, upsert_lost_items_description_in_pinecone_database, delete_lost_items_description_in_pinecone_database),
+    (True, fetch_lost_items_image_in_pinecone_database, upsert_lost_items_image_in_pinecone_database, delete_lost_items_image_in_pinecone_database),
+    (False, fetch_found_items_description_in_pinecone_database, upsert_found_items_description_in_pinecone_database, delete_found_items_description_in_pinecone_database),
+    (False, fetch_found_items_image_in_pinecone_database, upsert_found_items_image_in_pinecone_database, delete_found_items_image_in_pinecone_database),
+]
+
+UNMIGRATED = {'tenant': {'$exists': False}}
+
+
+def move_vectors(batch):
+    tenants = {str(item['_id']): tenant_of(item['owner_mail']) for item in batch}
+    moved = 0
+    for state, fetch, upsert, _ in INDEXES:
+        item_ids = [str(item['_id']) for item in batch if item['state'] == state]
+        if not item_ids:
+            continue
+        vectors = fetch(None, item_ids)
+        for tenant in set(tenants[item_id] for item_id in vectors):
+            upsert(tenant, [(item_id, values) for item_id, values in vectors.items() if tenants[item_id] == tenant])
+        moved += len(vectors)
+    return moved
+
+
+def delete_old_vectors(batch):
+    for state, _, _, delete in INDEXES:
+        item_ids = [str(item['_id']) for item in batch if item['state'] == state]
+        if item_ids:
+            delete(None, item_ids)
+
+
+def set_tenants(batch):
+    return [UpdateOne({'_id': item['_id']}, {'$set': {'tenant': tenant_of(item['owner_mail'])}}) for item in batch]
+
+
+async def main(args):
+    pending = await items.count_documents(UNMIGRATED)
+    archived = await items_archive.count_documents(UNMIGRATED)
+    if args.dry_run:
+        print(f"{pending} items and {archived} archived items have no tenant")
+        return
+
+    migrated = vectors = 0
+    while True:
+        # Migrated items drop out of the query, so this always takes the next batch
+        batch = await items.find(UNMIGRATED, {'owner_mail': 1, 'state': 1}).sort('_id', 1).to_list(args.batch_size)
+        if not batch:
+            break
+        vectors += await asyncio.to_thread(move_vectors, batch)
+        await items.bulk_write(set_tenants(batch), ordered=False)
+        await asyncio.to_thread(delete_old_vectors, batch)
+        migrated += len(batch)
+        print(f"{migrated} items migrated, {vectors} vectors moved, {pending - migrated} left")
+
+    # Archived items keep their vectors in the document, only the field is missing
+    while True:
+        batch = await items_archive.find(UNMIGRATED, {'owner_mail': 1}).to_list(args.batch_size)
+        if not batch:
+            break
+        await items_archive.bulk_write(set_tenants(batch), ordered=False)
+    print(f"{archived} archived items migrated")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dry-run', action='store_true', help='only count the items without a tenant')
+    parser.add_argument('--batch-size', type=int, default=100, help='items moved at a time')
+    args = parser.parse_args()
+    asyncio.run(main(args))
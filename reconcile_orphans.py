@@ -0,0 +1,35 @@
+"""
+Find vectors and Cloudinary images whose item no longer exists and purge them.
+
+    python reconcile_orphans.py --dry-run
+
+The API runs the same job every RECONCILE_INTERVAL_SECONDS; this script is
+for running it on demand. Orphans are queued on the cleanup outbox and then
+drained here, so the script can be run while the API is serving.
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import argparse
+import asyncio
+
+from controllers.cleanup_controller import reconcile_orphans, cleanup_worker, cleanup_stats
+
+
+async def main(dry_run):
+    counts = await reconcile_orphans(dry_run=dry_run)
+    print(f"orphans: {counts['lost_vectors']} lost vectors, {counts['found_vectors']} found vectors, "
+          f"{counts['images']} images")
+    if dry_run:
+        return
+    while await cleanup_worker.drain_once():
+        pass
+    print(f"outbox: {await cleanup_stats()}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dry-run', action='store_true', help='only count the orphans')
+    args = parser.parse_args()
+    asyncio.run(main(args.dry_run))
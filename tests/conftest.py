@@ -0,0 +1,86 @@
+"""
+The API runs against the fakes from benchmarks/fakes.py (mongomock-motor,
+in-memory Pinecone and Cloudinary, stub embedding models). The controllers
+connect at import time, so the fakes are installed before any test imports
+them. Every test shares one event loop: module-level asyncio objects (the
+upload stages, the feed cache) must not move between loops.
+"""
+import asyncio
+import random
+
+import httpx
+import pytest
+
+from benchmarks import fakes
+
+env = fakes.install()
+
+from benchmarks.dataset import seed, make_image  # noqa: E402 (needs the fakes)
+from controllers.duplicate_detection import duplicate_detector  # noqa: E402
+from controllers.feed_cache import feed_cache  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def event_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope='session')
+def run(event_loop):
+    return event_loop.run_until_complete
+
+
+@pytest.fixture(scope='session')
+def app(run):
+    lifespan = env.app.router.lifespan_context(env.app)
+    run(lifespan.__aenter__())
+    # Pinecone comes up in the background
+    run(asyncio.sleep(0.3))
+    yield env
+    run(lifespan.__aexit__(None, None, None))
+
+
+@pytest.fixture
+def api(app, run):
+    """
+    A client on an empty database with three users on one campus. Returns
+    (client, users, headers by user index).
+    """
+    async def reset():
+        for collection in (env.main.users, env.main.items):
+            await collection.delete_many({})
+        for index in env.pinecone.indexes.values():
+            index.namespaces.clear()
+        feed_cache.windows.clear()
+        duplicate_detector.index.entries.clear()
+        for table in duplicate_detector.index.tables:
+            table.clear()
+        return await seed(env.main.users, env.main.items, 3, 0)
+
+    users, tokens = run(reset())
+    headers = [{'auth_token': tokens[user['mail']]} for user in users]
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=env.app), base_url='http://test')
+    yield client, users, headers
+    run(client.aclose())
+
+
+def photo(seed, size=128):
+    return make_image(random.Random(seed), size)
+
+
+@pytest.fixture
+def upload(api, run):
+    """
+    Post an item as users[user]; returns the response.
+    """
+    client, _, headers = api
+
+    def post(user, state, description, image, name='item'):
+        return run(client.post(
+            '/upload', headers=headers[user],
+            data={'name': name, 'state': 'true' if state else 'false', 'description': description, 'timestamp': '1'},
+            files={'image': ('photo.jpg', image, 'image/jpeg')}
+        ))
+    return post
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+import pytest
+
+from controllers.admission_controller import Stage, UserRateLimiter, Overloaded
+
+
+def test_stage_sheds_when_the_queue_is_full(run):
+    stage = Stage('test', concurrency=1, max_queue=0)
+
+    async def scenario():
+        async with stage.slot():
+            with pytest.raises(Overloaded):
+                async with stage.slot():
+                    pass
+
+    run(scenario())
+    assert stage.shed == 1
+    assert stage.in_flight == 0
+
+
+def test_stage_sheds_after_the_queue_timeout(run):
+    stage = Stage('test', concurrency=1, max_queue=5, queue_timeout=0.05)
+
+    async def scenario():
+        async with stage.slot():
+            started = time.monotonic()
+            with pytest.raises(Overloaded) as shed:
+                async with stage.slot():
+                    pass
+            return time.monotonic() - started, shed.value
+
+    waited, error = run(scenario())
+    assert 0.04 <= waited < 1
+    assert error.retry_after >= 1
+    assert stage.queued == 0
+
+
+def test_stage_sheds_past_the_deadline_without_waiting(run):
+    stage = Stage('test', concurrency=1)
+
+    async def scenario():
+        with pytest.raises(Overloaded):
+            async with stage.slot(deadline=time.monotonic() - 1):
+                pass
+
+    run(scenario())
+    assert stage.shed == 1
+    assert stage.completed == 0
+
+
+def test_stage_waiter_gets_the_slot_when_released(run):
+    stage = Stage('test', concurrency=1, max_queue=1, queue_timeout=1)
+    order = []
+
+    async def hold(name, seconds):
+        async with stage.slot():
+            order.append(name)
+            await asyncio.sleep(seconds)
+
+    async def scenario():
+        await asyncio.gather(hold('first', 0.02), hold('second', 0))
+
+    run(scenario())
+    assert order == ['first', 'second']
+    assert stage.completed == 2
+
+
+def test_rate_limiter_rejects_past_the_limit():
+    limiter = UserRateLimiter(limit=2, window=60)
+    assert limiter.check('a') == 0
+    assert limiter.check('a') == 0
+    assert limiter.check('a') >= 1
+    assert limiter.check('b') == 0
+    assert limiter.rejected == 1
+
+
+def test_admission_stats_need_the_admin_token(api, run):
+    client, _, _ = api
+    assert run(client.get('/admission-stats')).status_code == 403
+
+
+def test_admission_stats_with_the_admin_token(api, run, monkeypatch):
+    client, _, _ = api
+    monkeypatch.setattr('controllers.admin_controller.ADMIN_TOKEN', 'secret')
+    response = run(client.get('/admission-stats', headers={'X-Admin-Token': 'secret'}))
+    assert response.status_code == 200
+    assert 'admission' in response.json()['stages']
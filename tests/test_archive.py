@@ -0,0 +1,44 @@
+import asyncio
+
+from conftest import env, photo
+from controllers.archive_controller import archive_items, restore_items
+from controllers.cleanup_controller import CleanupWorker, cleanup_worker, run_cleanup_tasks
+from controllers.mongo_database import cleanup_tasks, items_archive
+
+TENANT = 'srmap.edu.in'
+
+
+def vector_ids():
+    namespace = env.pinecone.indexes['found-index-name-text'].namespaces.get(TENANT)
+    return set(namespace.ids) if namespace else set()
+
+
+def test_restore_survives_a_claimed_archive_task(api, run, upload):
+    upload(0, False, 'red bottle', photo(1))
+    item = run(env.main.items.find_one({}))
+    item_id = str(item['_id'])
+    run(cleanup_worker.stop())
+    try:
+        run(cleanup_tasks.delete_many({}))
+        run(items_archive.delete_many({}))
+        run(archive_items([item], 'stale'))
+        tasks = run(CleanupWorker()._claim())
+        assert [task['item_id'] for task in tasks] == [item_id]
+
+        async def scenario():
+            restore = asyncio.create_task(restore_items([item_id]))
+            while await env.main.items.find_one({'_id': item['_id']}) is None:
+                await asyncio.sleep(0.01)
+            # A worker running the task from now on leaves the vectors alone...
+            await run_cleanup_tasks(tasks)
+            assert item_id in vector_ids()
+            # ...but one that checked before the item was back deletes them late
+            env.pinecone.indexes['found-index-name-text'].delete(ids=[item_id], namespace=TENANT)
+            await cleanup_tasks.delete_many({'_id': {'$in': [task['_id'] for task in tasks]}})
+            return await restore
+
+        assert run(scenario()) == [item_id]
+        assert item_id in vector_ids()
+        assert run(cleanup_tasks.count_documents({})) == 0
+    finally:
+        run(cleanup_worker.start())
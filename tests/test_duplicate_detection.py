@@ -0,0 +1,174 @@
+import asyncio
+import io
+import random
+
+from PIL import Image
+
+from conftest import env, photo
+from controllers import duplicate_detection
+from controllers.duplicate_detection import HashIndex, duplicate_action, duplicate_detector, hash_to_hex, phash, dhash
+
+KEY = ('srmap.edu.in', False)
+
+
+def flip(value, *bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def test_lookup_finds_hashes_within_the_radius():
+    index = HashIndex(8, 4, 100)
+    index.add('a', 0, KEY)
+    index.add('b', flip(0, 1, 17, 33, 49, 60), KEY)
+    index.add('c', flip(0, *range(9)), KEY)
+    assert index.lookup(0, KEY) == [(0, 'a'), (5, 'b')]
+    assert index.lookup(0, ('srmap.edu.in', True)) == []
+
+
+def test_lookup_agrees_with_brute_force():
+    rng = random.Random(7)
+    index = HashIndex(8, 4, 1000)
+    base = [rng.getrandbits(64) for _ in range(20)]
+    hashes = {}
+    for i in range(500):
+        value = flip(rng.choice(base), *rng.sample(range(64), rng.randrange(12)))
+        hashes[str(i)] = value
+        index.add(str(i), value, KEY)
+    for query in base:
+        expected = sorted(((query ^ value).bit_count(), item_id)
+                          for item_id, value in hashes.items() if (query ^ value).bit_count() <= 8)
+        assert index.lookup(query, KEY) == expected
+
+
+def test_capacity_evicts_the_oldest_and_discard_cleans_the_tables():
+    index = HashIndex(8, 4, 2)
+    for item_id, value in (('a', 1), ('b', 2), ('c', 3)):
+        index.add(item_id, value, KEY)
+    assert list(index.entries) == ['b', 'c']
+    index.discard('b')
+    index.discard('c')
+    index.discard('missing')
+    assert len(index) == 0
+    assert all(not table for table in index.tables)
+
+
+def reencoded(image_bytes, crop):
+    image = Image.open(io.BytesIO(image_bytes))
+    width, height = image.size
+    image = image.crop((crop, crop, width - crop, height - crop)).resize((width * 2, height * 2))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=60)
+    return Image.open(io.BytesIO(buffer.getvalue()))
+
+
+def test_hashes_survive_crop_and_recompression():
+    original = photo(1, 256)
+    for hash_function in (phash, dhash):
+        value = hash_function(Image.open(io.BytesIO(original)))
+        assert (value ^ hash_function(reencoded(original, 4))).bit_count() <= 8
+        assert (value ^ hash_function(Image.open(io.BytesIO(photo(2, 256))))).bit_count() > 8
+
+
+def test_duplicate_action(monkeypatch):
+    duplicates = [{'_id': 'theirs', 'owner_mail': 'b', 'distance': 1}, {'_id': 'mine', 'owner_mail': 'a', 'distance': 3}]
+    assert duplicate_action(duplicates, False, 'a') == ('rejected', duplicates[1])
+    assert duplicate_action(duplicates, True, 'a') == ('rejected', duplicates[1])
+    assert duplicate_action(duplicates[:1], False, 'a') == ('collapsed', duplicates[0])
+    assert duplicate_action(duplicates[:1], True, 'a') == ('flagged', duplicates[0])
+    monkeypatch.setattr(duplicate_detection, 'DUPLICATE_POLICY', 'flag')
+    assert duplicate_action(duplicates, False, 'a') == ('flagged', duplicates[0])
+
+
+def vector_ids(state, tenant='srmap.edu.in'):
+    side = 'lost' if state else 'found'
+    namespace = env.pinecone.indexes[f'{side}-index-name-text'].namespaces.get(tenant)
+    return set(namespace.ids) if namespace else set()
+
+
+def test_reposting_own_photo_is_refused(api, run, upload):
+    first = upload(0, False, 'red bottle', photo(1))
+    assert first.status_code == 200
+    second = upload(0, False, 'red bottle again', photo(1))
+    assert second.status_code == 409
+    assert run(env.main.items.count_documents({})) == 1
+
+
+def test_found_copy_is_collapsed(api, run, upload):
+    upload(0, True, 'red bottle', photo(3))
+    upload(1, False, 'red bottle', photo(1))
+    original = run(env.main.items.find_one({'owner_mail': api[1][1]['mail']}))
+    response = upload(2, False, 'red bottle', photo(1))
+    assert response.status_code == 200
+    assert response.json()['duplicate_of'] == str(original['_id'])
+    copy = run(env.main.items.find_one({'owner_mail': api[1][2]['mail']}))
+    assert copy['duplicate_of'] == str(original['_id'])
+    assert str(copy['_id']) not in vector_ids(False)
+    assert str(copy['_id']) not in run(env.main.items.find_one({'state': True}))['matches']
+
+
+def test_lost_copy_is_flagged_and_matched(api, run, upload):
+    upload(2, False, 'red bottle', photo(3))
+    upload(0, True, 'red bottle', photo(1))
+    original = run(env.main.items.find_one({'owner_mail': api[1][0]['mail']}))
+    assert upload(1, True, 'red bottle', photo(1)).status_code == 200
+    copy = run(env.main.items.find_one({'owner_mail': api[1][1]['mail']}))
+    assert copy['duplicate_of'] == str(original['_id'])
+    assert str(copy['_id']) in vector_ids(True)
+    found = run(env.main.items.find_one({'state': False}))
+    assert copy['matches'] == [str(found['_id'])]
+
+
+def test_hash_changed_elsewhere_is_not_matched(api, run, upload):
+    upload(1, False, 'red bottle', photo(1))
+    edited = run(env.main.items.find_one({}))
+    # Another worker replaced the photo, this worker's index still has the old hash
+    new_hash = hash_to_hex(phash(Image.open(io.BytesIO(photo(2)))))
+    run(env.main.items.update_one({'_id': edited['_id']}, {'$set': {'image_hash': new_hash}}))
+
+    assert upload(2, False, 'red bottle', photo(1)).json().get('duplicate_of') is None
+    assert duplicate_detector.index.entries[str(edited['_id'])][0] == int(new_hash, 16)
+
+
+def test_editing_in_a_photo_of_an_own_item_is_refused(api, run, upload):
+    client, users, headers = api
+    upload(0, False, 'red bottle', photo(1))
+    upload(0, False, 'blue bottle', photo(2))
+    first, second = run(env.main.items.find().sort('_id', 1).to_list(None))
+
+    def edit_image(item, image):
+        return run(client.post(f"/update-item/{item['_id']}", headers=headers[0],
+                               files={'image': ('new.jpg', image, 'image/jpeg')}))
+
+    response = edit_image(second, photo(1))
+    assert response.status_code == 409
+    assert response.json()['item_id'] == str(first['_id'])
+    assert run(env.main.items.find_one({'_id': second['_id']}))['image_hash'] == second['image_hash']
+    # Its own photo again is not a repost
+    assert edit_image(first, photo(1)).status_code == 200
+
+
+def test_deleting_the_original_promotes_its_oldest_copy(api, run, upload, monkeypatch):
+    client, users, headers = api
+    monkeypatch.setattr(env.main, 'download_image', lambda url: photo(1))
+    upload(0, True, 'red bottle', photo(3))
+    upload(1, False, 'red bottle', photo(1))
+    upload(2, False, 'red bottle', photo(1))
+    upload(0, False, 'red bottle', photo(1))
+    lost, original, heir, other = run(env.main.items.find().sort('_id', 1).to_list(None))
+    assert heir['duplicate_of'] == other['duplicate_of'] == str(original['_id'])
+    assert lost['matches'] == [str(original['_id'])]
+
+    assert run(client.delete(f"/delete-item/{original['_id']}", headers=headers[1])).status_code == 200
+
+    async def promoted():
+        for _ in range(100):
+            if str(heir['_id']) in vector_ids(False):
+                return True
+            await asyncio.sleep(0.02)
+        return False
+    assert run(promoted())
+    heir = run(env.main.items.find_one({'_id': heir['_id']}))
+    assert 'duplicate_of' not in heir and 'embed_pending' not in heir
+    assert run(env.main.items.find_one({'_id': other['_id']}))['duplicate_of'] == str(heir['_id'])
+    assert str(heir['_id']) in run(env.main.items.find_one({'_id': lost['_id']}))['matches']
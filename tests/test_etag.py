@@ -0,0 +1,76 @@
+import io
+from types import SimpleNamespace
+
+from PIL import Image
+
+from conftest import env, photo
+from controllers.etag_controller import etag_matches, user_etag
+from controllers.image_derivatives import store_derivatives
+
+
+def request_with(if_none_match=None):
+    return SimpleNamespace(headers={'if-none-match': if_none_match} if if_none_match else {})
+
+
+def test_etag_matches_weakly_and_in_lists():
+    etag = 'W/"abc"'
+    assert etag_matches(request_with('W/"abc"'), etag)
+    assert etag_matches(request_with('"abc"'), etag)
+    assert etag_matches(request_with('"x", W/"abc"'), etag)
+    assert etag_matches(request_with('*'), etag)
+    assert not etag_matches(request_with('W/"abd"'), etag)
+    assert not etag_matches(request_with(), etag)
+
+
+def test_user_etag_follows_the_version():
+    user = {'_id': 'u', 'version': 1}
+    assert user_etag(user, 'route') == user_etag(dict(user), 'route')
+    assert user_etag(user, 'route') != user_etag({**user, 'version': 2}, 'route')
+    assert user_etag(user, 'route') != user_etag(user, 'other')
+
+
+def test_user_items_are_not_modified_until_the_user_uploads(api, run, upload):
+    client, _, headers = api
+    first = run(client.post('/getUserItems', headers=headers[0]))
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+
+    again = run(client.post('/getUserItems', headers={**headers[0], 'If-None-Match': etag}))
+    assert again.status_code == 304
+
+    assert upload(0, True, 'black wallet', photo(1)).status_code == 200
+    changed = run(client.post('/getUserItems', headers={**headers[0], 'If-None-Match': etag}))
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert len(changed.json()['items']) == 1
+
+
+def test_get_user_hides_internal_fields(api, run):
+    client, users, headers = api
+    run(env.main.users.update_one({'_id': users[1]['_id']}, {'$set': {'version': 6}}))
+    profile = run(client.post('/getUser', headers=headers[0], json={'mail': users[1]['mail']})).json()
+    assert profile['mail'] == users[1]['mail']
+    for field in ('_id', 'password', 'socket_id', 'version'):
+        assert field not in profile
+
+
+def test_new_thumbnails_bump_the_owner_and_matched_owners(api, run):
+    _, users, _ = api
+    found = {'owner_mail': users[0]['mail'], 'tenant': 'srmap.edu.in', 'name': 'keys', 'state': False,
+             'description': 'keys', 'timestamp': 1, 'image': 'https://images.invalid/keys.jpg'}
+    run(env.main.items.insert_one(found))
+    run(env.main.items.insert_one({'owner_mail': users[1]['mail'], 'tenant': 'srmap.edu.in', 'name': 'keys',
+                                   'state': True, 'description': 'keys', 'timestamp': 1, 'image': '',
+                                   'matches': [str(found['_id'])]}))
+
+    def versions():
+        return [run(env.main.users.find_one({'_id': user['_id']})).get('version', 0) for user in users]
+
+    before = versions()
+    image = Image.open(io.BytesIO(photo(2))).convert('RGB')
+    fields = run(store_derivatives(str(found['_id']), image))
+    assert fields['thumbnail'] and fields['blurhash']
+    after = versions()
+    assert after[0] == before[0] + 1
+    assert after[1] == before[1] + 1
+    assert after[2] == before[2]
@@ -0,0 +1,116 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+from conftest import env, photo
+from controllers.feed_cache import FeedCache, FeedWindow, serialize_item
+
+
+def make_items(owners):
+    return [{'_id': ObjectId(), 'owner_mail': owner, 'tenant': 't', 'name': str(i)} for i, owner in enumerate(owners)]
+
+
+def names(page):
+    return [item['name'] for item in json.loads(page)]
+
+
+def test_page_skips_the_viewer():
+    window = FeedWindow(make_items('abab'), True, 10)
+    assert names(window.page('a', 0, 10)) == ['1', '3']
+    assert names(window.page('a', 1, 1)) == ['3']
+    assert names(window.page('c', 1, 2)) == ['1', '2']
+
+
+def test_page_past_a_partial_window():
+    window = FeedWindow(make_items('abab'), False, 4)
+    assert names(window.page('a', 0, 2)) == ['1', '3']
+    assert window.page('a', 1, 2) is None
+    # All of the tenant: the last page is just short
+    window.complete = True
+    assert names(window.page('a', 1, 2)) == ['3']
+
+
+def test_put_and_discard():
+    first, second, third = make_items('abc')
+    window = FeedWindow([first, third], True, 3)
+    window.put({**first, 'name': 'renamed'})
+    window.put(second)
+    assert names(window.page('x', 0, 10)) == ['renamed', '1', '2']
+    window.put({'_id': ObjectId(), 'owner_mail': 'd', 'name': 'overflow'})
+    assert window.ids == [first['_id'], second['_id'], third['_id']]
+    assert not window.complete
+    # Beyond a partial window
+    window.put({'_id': ObjectId(), 'owner_mail': 'd', 'name': 'late'})
+    assert len(window.ids) == 3
+    window.discard(second['_id'])
+    window.discard(ObjectId())
+    assert names(window.page('x', 0, 2)) == ['renamed', '2']
+
+
+def test_serialize_item_matches_the_uncached_response():
+    item = {'_id': ObjectId(), 'owner_mail': 'a', 'name': 'café', 'resolvedAt': datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc)}
+    uncached = JSONResponse(content=[{**item, '_id': str(item['_id']), 'resolvedAt': item['resolvedAt'].isoformat()}]).body
+    assert b'[' + serialize_item(item) + b']' == uncached
+
+
+class Cursor:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def sort(self, *args):
+        return self
+
+    async def to_list(self, length):
+        self.collection.finds += 1
+        await self.collection.release.wait()
+        return self.collection.documents[:length]
+
+
+class Collection:
+    def __init__(self, documents):
+        self.documents = documents
+        self.finds = 0
+        self.release = asyncio.Event()
+
+    def find(self, query):
+        return Cursor(self)
+
+
+def test_misses_share_one_fetch_and_keep_racing_writes(run):
+    documents = make_items('ab')
+    collection = Collection(documents)
+    cache = FeedCache(collection, 10)
+
+    async def scenario():
+        readers = [asyncio.create_task(cache.page('t', 'x', 0, 10)) for _ in range(3)]
+        while not collection.finds:
+            await asyncio.sleep(0)
+        late = {'_id': ObjectId(), 'owner_mail': 'c', 'tenant': 't', 'name': 'late'}
+        cache.put(late)
+        cache.discard(documents[0]['_id'])
+        collection.release.set()
+        return await asyncio.gather(*readers)
+
+    pages = run(scenario())
+    assert collection.finds == 1
+    assert [names(page) for page in pages] == [['1', 'late']] * 3
+    assert not cache._pending and not cache._loading
+
+
+def test_cached_feed_matches_mongo(api, run, upload, monkeypatch):
+    client, users, headers = api
+    for i in range(4):
+        upload(i % 3, bool(i % 2), f'item {i}', photo(i))
+    item = run(env.main.items.find_one({'owner_mail': users[1]['mail']}))
+    assert run(client.post(f"/resolve-item/{item['_id']}", headers=headers[1])).status_code == 200
+
+    def feed():
+        return [run(client.post('/getItems', headers=headers[0], json={'page': page})).content for page in (1, 2)]
+
+    cached = feed()
+    assert len(json.loads(cached[0])) == 2
+    monkeypatch.setattr(env.main.feed_cache, 'size', 0)
+    assert cached == feed()
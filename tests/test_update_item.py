@@ -0,0 +1,121 @@
+import numpy as np
+
+from conftest import env, photo
+from controllers.embedding_config import TEXT_DIMENSION
+
+TENANT = 'srmap.edu.in'
+
+
+def find_item(run, **query):
+    return run(env.main.items.find_one(query))
+
+
+def edit(run, client, headers, item, data=None, files=None):
+    return run(client.post(f"/update-item/{item['_id']}", headers=headers, data=data or {}, files=files))
+
+
+def test_metadata_edit_keeps_vectors_and_matches(api, run, upload):
+    client, users, headers = api
+    upload(1, False, 'black wallet', photo(1))
+    upload(0, True, 'black wallet', photo(2), name='wallet')
+    lost = find_item(run, state=True)
+    index = env.pinecone.indexes['lost-index-name-text']
+    vector = index.fetch([str(lost['_id'])], namespace=TENANT).vectors[str(lost['_id'])].values
+
+    response = edit(run, client, headers[0], lost, {'name': 'leather wallet', 'timestamp': '5', 'description': 'black wallet'})
+    assert response.status_code == 200
+    assert response.json() == {"message": "Item updated successfully", "updated": ['name', 'timestamp'], "new_matches": []}
+    edited = find_item(run, _id=lost['_id'])
+    assert (edited['name'], edited['timestamp'], edited['matches']) == ('leather wallet', 5, lost['matches'])
+    assert np.array_equal(index.fetch([str(lost['_id'])], namespace=TENANT).vectors[str(lost['_id'])].values, vector)
+
+    assert edit(run, client, headers[0], lost, {'name': 'leather wallet'}).json()['updated'] == []
+
+
+def test_description_edit_adds_only_new_matches(api, run, upload):
+    client, users, headers = api
+    upload(1, False, 'black wallet', photo(1))
+    upload(0, True, 'black wallet', photo(2))
+    known = find_item(run, state=False)
+    lost = find_item(run, state=True)
+    assert lost['matches'] == [str(known['_id'])]
+
+    # A found item that was never matched with the lost one
+    unmatched = {'owner_mail': users[2]['mail'], 'tenant': TENANT, 'name': 'purse', 'state': False,
+                 'description': 'brown purse', 'timestamp': 1, 'image': ''}
+    run(env.main.items.insert_one(unmatched))
+    env.pinecone.indexes['found-index-name-text'].upsert([(str(unmatched['_id']), np.ones(TEXT_DIMENSION))], namespace=TENANT)
+
+    response = edit(run, client, headers[0], lost, {'description': 'black leather wallet'})
+    assert response.status_code == 200
+    assert response.json()['updated'] == ['description']
+    assert response.json()['new_matches'] == [str(unmatched['_id'])]
+    assert find_item(run, _id=lost['_id'])['matches'] == [str(known['_id']), str(unmatched['_id'])]
+
+    again = edit(run, client, headers[0], lost, {'description': 'black leather wallet, worn'})
+    assert again.json()['new_matches'] == []
+    assert len(find_item(run, _id=lost['_id'])['matches']) == 2
+
+
+def test_found_edit_is_not_added_twice_to_lost_matches(api, run, upload):
+    client, users, headers = api
+    upload(0, True, 'blue umbrella', photo(1))
+    upload(1, False, 'blue umbrella', photo(2))
+    found = find_item(run, state=False)
+    assert find_item(run, state=True)['matches'] == [str(found['_id'])]
+
+    response = edit(run, client, headers[1], found, files={'image': ('new.jpg', photo(3), 'image/jpeg')})
+    assert response.status_code == 200
+    assert response.json()['updated'] == ['image']
+    assert response.json()['new_matches'] == []
+    assert find_item(run, state=True)['matches'] == [str(found['_id'])]
+
+
+def test_edit_errors(api, run, upload):
+    client, users, headers = api
+    upload(0, True, 'black wallet', photo(1))
+    lost = find_item(run, state=True)
+    assert edit(run, client, headers[1], lost, {'name': 'mine now'}).status_code == 404
+    assert edit(run, client, headers[0], lost, {'name': '  '}).status_code == 406
+    unreadable = edit(run, client, headers[0], lost, files={'image': ('bad.jpg', b'not an image', 'image/jpeg')})
+    assert unreadable.status_code == 406
+    assert find_item(run, _id=lost['_id'])['image'] == lost['image']
+
+
+def stored_vector(index, item):
+    fetched = env.pinecone.indexes[index].fetch([str(item['_id'])], namespace=TENANT).vectors
+    return fetched[str(item['_id'])].values if str(item['_id']) in fetched else None
+
+
+def test_failed_image_edit_keeps_the_item_and_its_vectors(api, run, upload, monkeypatch):
+    client, users, headers = api
+    upload(0, False, 'black wallet', photo(1))
+    found = find_item(run, state=False)
+    vector = stored_vector('found-index-name-img', found)
+
+    async def unreachable(*args):
+        raise RuntimeError('cloudinary down')
+    monkeypatch.setattr(env.main, 'host_image', unreachable)
+    response = edit(run, client, headers[0], found, files={'image': ('new.jpg', photo(2), 'image/jpeg')})
+    assert response.status_code == 500
+    after = find_item(run, _id=found['_id'])
+    assert (after['image'], after['image_hash']) == (found['image'], found['image_hash'])
+    assert np.allclose(stored_vector('found-index-name-img', found), vector)
+
+
+def test_failed_edit_of_a_collapsed_copy_keeps_it_collapsed(api, run, upload, monkeypatch):
+    client, users, headers = api
+    upload(0, False, 'black wallet', photo(1))
+    upload(1, False, 'black wallet', photo(1))
+    copy = find_item(run, owner_mail=users[1]['mail'])
+    assert copy['duplicate_of']
+
+    def failing(*args):
+        raise RuntimeError('pinecone down')
+    monkeypatch.setattr(env.main, 'upsert_found_item_image_in_pinecone_database', failing)
+    response = edit(run, client, headers[1], copy, files={'image': ('new.jpg', photo(2), 'image/jpeg')})
+    assert response.status_code == 500
+    after = find_item(run, _id=copy['_id'])
+    assert (after['image'], after['duplicate_of']) == (copy['image'], copy['duplicate_of'])
+    # The text vector upserted before the failure is taken out again
+    assert stored_vector('found-index-name-text', copy) is None